@@ -0,0 +1,186 @@
+'''
+Headless batch processing: runs an operation chain over BMP files in a process pool
+Usage: python Batch.py -o OUTDIR [-r REPORT.csv|.json] [-j WORKERS] [--band-rows N]
+                       [--colors N [--kmeans N] [--dither D]] -p OPS INPUT_GLOB [INPUT_GLOB ...]
+OPS is a comma separated chain of the menu actions, e.g. "autolevel,dither8,huffman":
+    grayscale, dither2, dither4, dither8, colordither2, colordither4, colordither8, autolevel, huffman
+--colors writes results as 8-bit indexed BMPs with an adaptive palette of at most N colours
+'''
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+
+from Utils import readBMP, writeBMP, setThreads
+from Tiled import processTiled
+from Pipeline import Pipeline, Grayscale, Dither, Autolevel, Huffman
+from Quantize import quantize, DITHER_METHODS
+
+DITHERING = {'2': 0, '4': 1, '8': 2}
+OPERATIONS = ['grayscale', 'autolevel', 'huffman'] + ['dither' + size for size in DITHERING] + \
+             ['colordither' + size for size in DITHERING]
+REPORT_FIELDS = ['input', 'output', 'width', 'height', 'seconds', 'low', 'gamma', 'high', 'entropy', 'huffman', 'colors',
+                 'error']
+
+'''
+Graph operations of a chain operation
+'''
+def graphOperations(operation: str) -> list:
+    if operation == 'grayscale':
+        return [Grayscale()]
+    if operation.startswith('dither'):
+        # same as the Ordered Dithering menu: grayscale first
+        return [Grayscale(), Dither(int(operation[len('dither'):]))]
+    if operation.startswith('colordither'):
+        return [Dither(int(operation[len('colordither'):]))]
+    if operation == 'autolevel':
+        return [Autolevel()]
+    if operation == 'huffman':
+        return [Huffman()]
+    raise ValueError("Unknown operation: %s" % operation)
+
+'''
+Apply an operation chain to RGB data, returning processed data and collected statistics
+The chain runs as a single fused pass, plus one histogram pass per statistics operation
+'''
+def runOperations(data, operations: [str]) -> (object, dict):
+    pipeline = Pipeline(data)
+    node = pipeline.chain([graphOperation for operation in operations for graphOperation in graphOperations(operation)])
+    return pipeline.evaluate(node), pipeline.stats(node)
+
+'''
+Worker: read, process and write a single file, only statistics are sent back to the parent process
+quantization: (colors, k-means iterations, dithering) of indexed output, None for full colour output
+'''
+def processFile(inFile: str, outFile: str, operations: [str], bandRows: int = 0, quantization: tuple = None) -> dict:
+    start = time.perf_counter()
+    row = {'input': inFile, 'output': outFile}
+    if bandRows > 0:
+        # out-of-core: stream row bands instead of decoding the whole image
+        stats, errMsg = processTiled(inFile, outFile, operations, bandRows)
+        row.update(stats)
+        if errMsg:
+            row['output'], row['error'] = '', errMsg
+        row['seconds'] = time.perf_counter() - start
+        return row
+    data, (row['width'], row['height']), errMsg = readBMP(inFile)
+    if data is None:
+        row['output'], row['error'] = '', errMsg
+        return row
+    data, stats = runOperations(data, operations)
+    row.update(stats)
+    palette = None
+    if quantization is not None:
+        # grayscale results are broadcast to RGB
+        data, palette = quantize(np.broadcast_to(data, data.shape[: 2] + (3,)), *quantization)
+        row['colors'] = len(palette)
+    if outFile:
+        errMsg = writeBMP(outFile, data, palette=palette)
+        if errMsg:
+            row['error'] = errMsg
+    row['seconds'] = time.perf_counter() - start
+    return row
+
+'''
+Report row of a file whose worker raised instead of returning a row, e.g. a kernel failing or a crashed worker
+'''
+def failedRow(inFile: str, error: Exception) -> dict:
+    return {'input': inFile, 'output': '', 'error': "%s: %s" % (type(error).__name__, error)}
+
+def initWorker(threads: int):
+    setThreads(threads)
+
+def writeReport(fileName: str, rows: [dict]):
+    with open(fileName, 'w', newline='') as file:
+        if fileName.lower().endswith('.json'):
+            json.dump(rows, file, indent=2)
+        else:
+            writer = csv.DictWriter(file, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+'''
+Run the chain over all inputs with a bounded number of files in flight
+'''
+def runBatch(inFiles: [str], outDir: str, operations: [str], workers: int, inFlight: int, bandRows: int = 0,
+             quantization: tuple = None) -> [dict]:
+    rows = []
+    # split cores between worker processes so that parallel kernels do not oversubscribe them
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=initWorker, initargs=(threads,)) as executor:
+        pending, files = {}, iter(inFiles) # future: input file
+        while True:
+            for inFile in files:
+                outFile = os.path.join(outDir, os.path.basename(inFile)) if outDir else ''
+                try:
+                    pending[executor.submit(processFile, inFile, outFile, operations, bandRows, quantization)] = inFile
+                except BrokenProcessPool as e:
+                    rows.append(failedRow(inFile, e))
+                    continue
+                if len(pending) >= inFlight:
+                    break
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                inFile = pending.pop(future)
+                try:
+                    row = future.result()
+                except Exception as e:
+                    # recorded like the failures processFile reports itself, the other files still run
+                    row = failedRow(inFile, e)
+                rows.append(row)
+                print("%s: %s" % (row['input'], row.get('error') or "%.3f s" % row['seconds']), file=sys.stderr)
+    return rows
+
+def main(argv: [str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Homebrew Photoshop batch processing")
+    parser.add_argument('inputs', nargs='+', help="input BMP files or glob patterns")
+    parser.add_argument('-p', '--ops', required=True, help="comma separated operation chain: " + ", ".join(OPERATIONS))
+    parser.add_argument('-o', '--outdir', default='', help="directory for processed BMPs, nothing is written if omitted")
+    parser.add_argument('-r', '--report', default='', help="statistics report, .csv or .json")
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument('--band-rows', type=int, default=0,
+                        help="process images out-of-core in bands of this many rows (for images larger than RAM)")
+    parser.add_argument('--colors', type=int, default=0,
+                        help="write 8-bit indexed BMPs with an adaptive palette of at most this many colours (2-256)")
+    parser.add_argument('--kmeans', type=int, default=0, help="k-means iterations refining the median cut palettes")
+    parser.add_argument('--dither', default='none', choices=DITHER_METHODS, help="dithering of indexed output")
+    parser.add_argument('--in-flight', type=int, default=0, help="maximum files queued or being processed (default 2x workers)")
+    args = parser.parse_args(argv)
+
+    operations = [operation.strip().lower() for operation in args.ops.split(',') if operation.strip()]
+    unknown = [operation for operation in operations if operation not in OPERATIONS]
+    if unknown:
+        parser.error("unknown operations: " + ", ".join(unknown))
+    if args.colors and not 2 <= args.colors <= 256:
+        parser.error("--colors must be 2 to 256")
+    if args.colors and args.band_rows > 0:
+        parser.error("--colors needs whole images, it cannot be combined with --band-rows")
+    quantization = (args.colors, args.kmeans, args.dither) if args.colors else None
+    inFiles = sorted({fileName for pattern in args.inputs for fileName in (glob.glob(pattern) or [pattern])})
+    if args.outdir:
+        os.makedirs(args.outdir, exist_ok=True)
+        if any(os.path.samefile(os.path.dirname(os.path.abspath(inFile)), args.outdir) for inFile in inFiles
+               if os.path.exists(inFile)):
+            parser.error("output directory must differ from input directories")
+    workers = max(1, args.workers)
+    start = time.perf_counter()
+    rows = runBatch(inFiles, args.outdir, operations, workers, max(workers, args.in_flight or 2 * workers),
+                    args.band_rows, quantization)
+    elapsed = time.perf_counter() - start
+    rows.sort(key=lambda row: row['input'])
+    if args.report:
+        writeReport(args.report, rows)
+    failed = sum(1 for row in rows if row.get('error'))
+    print("%d files (%d failed) in %.2f s" % (len(rows), failed, elapsed), file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
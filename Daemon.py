@@ -0,0 +1,452 @@
+'''
+Local processing daemon: keeps the compiled kernels and recently decoded images warm for other processes
+Jobs arrive as length-prefixed JSON messages over a Unix socket, pixels never go through the socket: input and
+output images are passed as multiprocessing.shared_memory segments, named in the messages
+Jobs run on a pool of worker threads fed by a bounded queue, a connection stops being read while the queue is full,
+so that clients sending faster than the workers can process are slowed down instead of growing the queue
+Usage: python Daemon.py [--socket PATH] [-j WORKERS] [--queue N] [--cache-mb N]
+
+Request: {"id": 1, "op": "dither", "params": {"size": 8, "gray": true}, "input": INPUT, "key": "optional image key"}
+    INPUT is {"shm": segment name, "shape": [height, width, channels]} of a C-contiguous uint8 image,
+    or {"file": BMP path}, decoded by the daemon and kept warm
+    key identifies the image content of shared memory inputs, results of keyed and file inputs are cached
+Response: {"id": 1, "ok": true, "output": {"shm": name, "shape": [...]}, "result": {...}, "error": "", "seconds": s}
+    the client owns output segments and unlinks them, segments it did not unlink are removed when it disconnects
+Operations: see OPERATIONS; "ping", "stats" and "shutdown" are answered at once, without queueing
+'''
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import struct
+import argparse
+import tempfile
+import threading
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+import numba
+
+from Utils import readBMP, cvtGrayscale, cvtOrderedDithering, cvtBayerDithering, cvtErrorDiffusion, histogram
+from Utils import calEntropy, calHuffman, autolevel, applyLUT, buildLevelsLUT, setThreads, warmUp
+from ResultCache import ResultCache
+
+DEF_SOCKET = os.path.join(tempfile.gettempdir(), 'homebrew-photoshop-%d.sock' % os.getuid())
+DEF_WORKERS = 4
+DEF_QUEUE = 16 # jobs waiting for a worker, beyond which connections are not read
+DEF_CACHE_BUDGET = 512 * 2 ** 20 # bytes of decoded images and results kept warm
+HEADER = struct.Struct('!I') # byte length of the JSON message that follows
+MAX_MESSAGE = 2 ** 20
+ACCEPT_TIMEOUT = 0.5 # s between checks for shutdown
+TRACKER_LOCK = threading.Lock() # keeps the register/unregister pairs of concurrent jobs on a segment apart
+
+'''
+Send a message as a length-prefixed JSON object
+'''
+def sendMessage(sock: socket.socket, message: dict):
+    data = json.dumps(message).encode()
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+def recvExactly(sock: socket.socket, size: int) -> bytes:
+    ret = bytearray()
+    while len(ret) < size:
+        chunk = sock.recv(size - len(ret))
+        if not chunk:
+            return None
+        ret += chunk
+    return bytes(ret)
+
+'''
+Next message of the socket, None once the peer has closed it
+'''
+def recvMessage(sock: socket.socket) -> dict:
+    header = recvExactly(sock, HEADER.size)
+    if header is None:
+        return None
+    size = HEADER.unpack(header)[0]
+    assert size <= MAX_MESSAGE, str.format("Message too large")
+    data = recvExactly(sock, size)
+    return None if data is None else json.loads(data)
+
+'''
+Shared memory segment opened (or created with size) without registering it with the resource tracker of this
+process: before Python 3.13 every user of a segment registers it, and the tracker unlinks it when the process exits
+'''
+def openSharedMemory(name: str = None, size: int = 0) -> shared_memory.SharedMemory:
+    with TRACKER_LOCK:
+        ret = shared_memory.SharedMemory(name, create=name is None, size=size)
+        resource_tracker.unregister(ret._name, 'shared_memory')
+    return ret
+
+def grayscaleOf(data: np.ndarray) -> np.ndarray:
+    return cvtGrayscale(data) if data.shape[2] == 3 else data
+
+def opGrayscale(data: np.ndarray) -> (np.ndarray, dict):
+    return cvtGrayscale(data), {}
+
+def opDither(data: np.ndarray, size: int = 8, gray: bool = False) -> (np.ndarray, dict):
+    assert size >= 2 and size & (size - 1) == 0, str.format("Dithering matrix size must be a power of two")
+    data = grayscaleOf(data) if gray else data
+    # matrices up to 8x8 have a compiled kernel, larger ones are generated at runtime
+    if size <= 8:
+        return cvtOrderedDithering(data, {2: 0, 4: 1, 8: 2}[size]), {}
+    return cvtBayerDithering(data, size), {}
+
+def opDiffusion(data: np.ndarray, method: str = 'floyd-steinberg', levels: int = 2, gray: bool = False,
+                parallel: bool = False) -> (np.ndarray, dict):
+    return cvtErrorDiffusion(grayscaleOf(data) if gray else data, method, levels, True, parallel), {}
+
+def opLevels(data: np.ndarray, gammas: [float], inLevels: [(int, int)], outLevels: [(int, int)]) -> (np.ndarray, dict):
+    return applyLUT(data, buildLevelsLUT(gammas, inLevels, outLevels)), {}
+
+def opAutolevel(data: np.ndarray) -> (np.ndarray, dict):
+    ret, (low, gamma, high) = autolevel(data)
+    return ret, {'low': int(low), 'gamma': float(gamma), 'high': int(high)}
+
+def opEntropy(data: np.ndarray, gray: bool = True) -> (np.ndarray, dict):
+    hist = histogram(grayscaleOf(data) if gray else data)
+    return None, {'entropy': [float(value) for value in calEntropy(hist)[:, 0]],
+                  'huffman': [calHuffman(channel) for channel in hist]}
+
+def opHistogram(data: np.ndarray) -> (np.ndarray, dict):
+    return None, {'histogram': histogram(data).tolist()}
+
+# operation name: function(data, **params) -> (output image or None, result)
+OPERATIONS = {
+    'grayscale': opGrayscale,
+    'dither': opDither,
+    'diffusion': opDiffusion,
+    'levels': opLevels,
+    'autolevel': opAutolevel,
+    'entropy': opEntropy,
+    'histogram': opHistogram,
+}
+
+class Connection:
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.sendLock = threading.Lock()
+        self.idle = threading.Condition(self.sendLock)
+        self.pending = 0 # jobs queued or running
+        self.outputs = set() # names of output segments created for this client
+        self.closed = False
+
+    def begin(self):
+        with self.sendLock:
+            self.pending += 1
+
+    def finish(self):
+        with self.sendLock:
+            self.pending -= 1
+            self.idle.notify_all()
+
+    def send(self, message: dict):
+        with self.sendLock:
+            if not self.closed:
+                try:
+                    sendMessage(self.sock, message)
+                except OSError:
+                    self.closed = True
+
+    '''
+    Copy an image into a new shared memory segment handed over to the client
+    '''
+    def export(self, image: np.ndarray) -> dict:
+        segment = openSharedMemory(size=max(1, image.nbytes))
+        np.copyto(np.ndarray(image.shape, dtype=np.uint8, buffer=segment.buf), image)
+        segment.close()
+        with self.sendLock:
+            self.outputs.add(segment.name)
+        return {'shm': segment.name, 'shape': list(image.shape)}
+
+    '''
+    Unlink the output segments the client did not take, once it has gone and its last job has finished
+    '''
+    def close(self):
+        with self.sendLock:
+            self.idle.wait_for(lambda: self.pending == 0)
+            self.closed = True
+            outputs, self.outputs = self.outputs, set()
+        for name in outputs:
+            try:
+                segment = shared_memory.SharedMemory(name)
+            except FileNotFoundError:
+                continue
+            segment.close()
+            segment.unlink()
+        self.sock.close()
+
+class Job:
+    __slots__ = ('request', 'connection', 'received')
+
+    def __init__(self, request: dict, connection: Connection):
+        self.request, self.connection = request, connection
+        self.received = time.perf_counter()
+
+class Daemon:
+    def __init__(self, socketPath: str = DEF_SOCKET, workers: int = DEF_WORKERS, queueSize: int = DEF_QUEUE,
+                 cacheBudget: int = DEF_CACHE_BUDGET):
+        self.socketPath = socketPath
+        self.workers = workers
+        self.jobs = queue.Queue(queueSize)
+        self.cache = ResultCache(cacheBudget)
+        self.cacheLock = threading.Lock()
+        self.statsLock = threading.Lock()
+        self.done = self.failed = 0
+        self.running = False
+        self.threads = []
+
+    def serveForever(self):
+        if os.path.exists(self.socketPath):
+            # a stale socket of a daemon that did not exit cleanly
+            os.unlink(self.socketPath)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socketPath)
+        listener.listen()
+        listener.settimeout(ACCEPT_TIMEOUT)
+        self.running = True
+        self.threads = [threading.Thread(target=self.worker, daemon=True) for _ in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+        try:
+            while self.running:
+                try:
+                    sock, _ = listener.accept()
+                except socket.timeout:
+                    continue
+                sock.settimeout(None)
+                threading.Thread(target=self.serveConnection, args=(Connection(sock),), daemon=True).start()
+        finally:
+            listener.close()
+            os.unlink(self.socketPath)
+            for _ in self.threads:
+                self.jobs.put(None)
+
+    def shutdown(self):
+        self.running = False
+
+    def serveConnection(self, connection: Connection):
+        try:
+            while self.running:
+                request = recvMessage(connection.sock)
+                if request is None:
+                    break
+                operation = request.get('op')
+                if operation == 'ping':
+                    connection.send({'id': request.get('id'), 'ok': True})
+                elif operation == 'stats':
+                    connection.send({'id': request.get('id'), 'ok': True, 'result': self.stats()})
+                elif operation == 'shutdown':
+                    connection.send({'id': request.get('id'), 'ok': True})
+                    self.shutdown()
+                else:
+                    # blocks while the queue is full: backpressure on this client
+                    connection.begin()
+                    self.jobs.put(Job(request, connection))
+        except (OSError, ValueError, AssertionError):
+            pass
+        finally:
+            connection.close()
+
+    def worker(self):
+        # parallel kernels of concurrent workers share the cores, see setThreads
+        setThreads()
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            response = self.run(job.request)
+            response['queued'] = time.perf_counter() - job.received - response['seconds']
+            if response.get('output') is not None:
+                try:
+                    response['output'] = job.connection.export(response['output'])
+                except OSError as e:
+                    response.update(ok=False, output=None, error=str.format("Cannot export output: {}", e))
+            job.connection.send(response)
+            job.connection.finish()
+            with self.statsLock:
+                self.done += 1
+                self.failed += 0 if response['ok'] else 1
+
+    '''
+    Run a job request, returns its response with the output image as an array, exported by the caller
+    '''
+    def run(self, request: dict) -> dict:
+        start = time.perf_counter()
+        response = {'id': request.get('id'), 'ok': False, 'error': ""}
+        segment = data = None
+        try:
+            assert request.get('op') in OPERATIONS, str.format("Unknown operation: {}", request.get('op'))
+            params = request.get('params') or {}
+            source = request.get('input') or {}
+            if 'file' in source:
+                # decoding holds the cache lock, repeated files are then decoded once
+                with self.cacheLock:
+                    data, _, errMsg, key = self.cache.cachedFile(source['file'], readBMP)
+                assert data is not None, errMsg
+            else:
+                shape = tuple(source['shape'])
+                assert len(shape) == 3 and shape[2] in (1, 3), str.format("Input must be (height, width, 1 or 3)")
+                segment = openSharedMemory(source['shm'])
+                data = np.ndarray(shape, dtype=np.uint8, buffer=segment.buf)
+                key = request.get('key') or ""
+            cacheKey = (key, request['op'], json.dumps(params, sort_keys=True)) if key else None
+            with self.cacheLock:
+                ret = self.cache.get(cacheKey) if cacheKey else None
+            if ret is None:
+                ret = OPERATIONS[request['op']](data, **params)
+                if cacheKey:
+                    with self.cacheLock:
+                        self.cache.put(cacheKey, ret)
+            response.update(ok=True, output=ret[0], result=ret[1])
+        except KeyError as e:
+            response['error'] = str.format("Missing or unknown value: {}", e)
+        except (AssertionError, ValueError, TypeError, OSError) as e:
+            response['error'] = str(e) or type(e).__name__
+        finally:
+            # views of the segment go before closing it
+            data = None
+            if segment is not None:
+                segment.close()
+        response['seconds'] = time.perf_counter() - start
+        return response
+
+    def stats(self) -> dict:
+        with self.cacheLock:
+            cache = self.cache.stats()
+        with self.statsLock:
+            return {'done': self.done, 'failed': self.failed, 'queued': self.jobs.qsize(), 'workers': self.workers,
+                    'cache': cache}
+
+class SharedImage:
+    '''
+    Image copied once into a shared memory segment, usable as the input of any number of jobs
+    '''
+    def __init__(self, data: np.ndarray):
+        self.segment = shared_memory.SharedMemory(create=True, size=max(1, data.nbytes))
+        self.shape = data.shape
+        np.copyto(self.array(), data)
+
+    def array(self) -> np.ndarray:
+        return np.ndarray(self.shape, dtype=np.uint8, buffer=self.segment.buf)
+
+    def input(self) -> dict:
+        return {'shm': self.segment.name, 'shape': list(self.shape)}
+
+    def close(self):
+        self.segment.close()
+        self.segment.unlink()
+
+class DaemonClient:
+    '''
+    Connection to a daemon, one request at a time with run(), or several in flight with submit() and receive()
+    '''
+    def __init__(self, socketPath: str = DEF_SOCKET):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socketPath)
+        self.nextId = 0
+        self.uploads = {} # request id: SharedImage uploaded for that request only
+        self.lastResponse = {} # e.g. for the time the last job spent in the queue ('queued') and running ('seconds')
+
+    '''
+    Send a job, image: an array (copied to a temporary segment), a SharedImage or a BMP file name
+    Returns the request id
+    '''
+    def submit(self, operation: str, image, key: str = "", **params) -> int:
+        requestId, self.nextId = self.nextId, self.nextId + 1
+        if isinstance(image, str):
+            source = {'file': image}
+        elif isinstance(image, SharedImage):
+            source = image.input()
+        else:
+            self.uploads[requestId] = SharedImage(image)
+            source = self.uploads[requestId].input()
+        sendMessage(self.sock, {'id': requestId, 'op': operation, 'params': params, 'input': source, 'key': key})
+        return requestId
+
+    '''
+    Next response, as (request id, output image or None, result, errMsg), the image copied into out if given
+    '''
+    def receive(self, out: np.ndarray = None) -> (int, np.ndarray, dict, str):
+        response = recvMessage(self.sock)
+        if response is None:
+            raise ConnectionError("Processing daemon closed the connection")
+        self.lastResponse = response
+        upload = self.uploads.pop(response.get('id'), None)
+        if upload is not None:
+            upload.close()
+        image = None
+        if response.get('output'):
+            segment = shared_memory.SharedMemory(response['output']['shm'])
+            view = np.ndarray(tuple(response['output']['shape']), dtype=np.uint8, buffer=segment.buf)
+            if out is None:
+                image = view.copy()
+            else:
+                # grayscale results are broadcast to the channels of out
+                np.copyto(out, view)
+                image = out
+            del view
+            segment.close()
+            segment.unlink()
+        return response.get('id'), image, response.get('result') or {}, response.get('error', "")
+
+    def run(self, operation: str, image, key: str = "", out: np.ndarray = None, **params) -> (np.ndarray, dict, str):
+        self.submit(operation, image, key, **params)
+        return self.receive(out)[1:]
+
+    def request(self, operation: str) -> dict:
+        sendMessage(self.sock, {'id': -1, 'op': operation})
+        return recvMessage(self.sock) or {}
+
+    def ping(self) -> bool:
+        return self.request('ping').get('ok', False)
+
+    def stats(self) -> dict:
+        return self.request('stats').get('result') or {}
+
+    def close(self):
+        for upload in self.uploads.values():
+            upload.close()
+        self.uploads = {}
+        self.sock.close()
+
+'''
+Connect to a running daemon, returns (client, errMsg), the client is None on failure
+'''
+def connectDaemon(socketPath: str = DEF_SOCKET) -> (DaemonClient, str):
+    try:
+        return DaemonClient(socketPath), ""
+    except OSError:
+        return None, str.format("Processing daemon not running: {}", socketPath)
+
+def main(argv: [str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Homebrew Photoshop processing daemon")
+    parser.add_argument('--socket', default=DEF_SOCKET, help="Unix socket path")
+    parser.add_argument('-j', '--workers', type=int, default=DEF_WORKERS, help="worker threads running jobs")
+    parser.add_argument('--queue', type=int, default=DEF_QUEUE, help="jobs waiting for a worker before clients block")
+    parser.add_argument('--cache-mb', type=int, default=DEF_CACHE_BUDGET // 2 ** 20,
+                        help="memory for decoded images and cached results")
+    args = parser.parse_args(argv)
+    workers = max(1, args.workers)
+    if workers > 1:
+        # concurrent calls of parallel kernels need the TBB or OpenMP threading layer
+        numba.config.THREADING_LAYER = 'threadsafe'
+    # cores are split between workers, so that their parallel kernels do not oversubscribe them
+    setThreads(max(1, numba.config.NUMBA_NUM_THREADS // workers))
+    try:
+        warmUp()
+    except ValueError as e:
+        print("%s, run with -j 1" % e, file=sys.stderr)
+        return 1
+    daemon = Daemon(args.socket, workers, max(1, args.queue), args.cache_mb * 2 ** 20)
+    print("Listening on %s with %d workers (threading layer: %s)" % (args.socket, workers, numba.threading_layer()),
+          file=sys.stderr)
+    try:
+        daemon.serveForever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,274 @@
+'''
+Spatial filters: Gaussian and box blur, unsharp mask, Sobel edges and median, as row-parallel numba kernels
+Blurs run as two separable 1-D passes, box sums as running sums and the median from per-column histograms
+(Perreault & Hebert), so that box and median cost the same for any radius
+Each parallel task filters a band of rows, computing the horizontal pass of its rows plus radius rows above and
+below, so that no full size intermediate image is allocated
+Borders are mirrored without repeating the edge pixel (reflect-101), for any radius and image size
+'''
+import math
+import numpy as np
+import numba
+from numba import njit, prange
+
+from Profiler import profiled
+
+MIN_BAND_ROWS = 16 # bands are at least this high and 4 radii high, so that halo rows stay a small overhead
+BANDS_PER_THREAD = 4
+MEDIAN_COARSE_SHIFT = 4 # coarse median bins cover 16 values
+SOBEL_SCALE = 0.25 # gradient magnitude up to 4 * 255 * sqrt(2), scaled by the gain of the smoothing taps
+
+'''
+Index of pixel i of a line of n pixels, mirrored at both ends (reflect-101: -1 -> 1, n -> n - 2)
+'''
+@njit(nogil=True, cache=True, inline='always')
+def reflect(i: int, n: int) -> int:
+    if n == 1:
+        return 0
+    period = 2 * n - 2
+    i = abs(i) % period
+    return i if i < n else period - i
+
+'''
+Number of row bands filtered in parallel for a kernel of radius rows
+'''
+def bandCount(height: int, radius: int, perThread: int = BANDS_PER_THREAD) -> int:
+    return max(1, min(numba.get_num_threads() * perThread, height // max(MIN_BAND_ROWS, 4 * radius)))
+
+'''
+Padded row of (width + 2 * radius) pixels, flattened by channel, mirrored at both ends
+'''
+@njit(nogil=True, cache=True, inline='always')
+def padRow(data: np.ndarray, i: int, radius: int, row: np.ndarray):
+    width, channels = data.shape[1], data.shape[2]
+    for x in range(width + 2 * radius):
+        j = reflect(x - radius, width)
+        for k in range(channels):
+            row[x * channels + k] = data[i, j, k]
+
+'''
+Normalized 1-D Gaussian of radius ceil(3 sigma)
+'''
+def gaussianWeights(sigma: float) -> np.ndarray:
+    radius = max(1, int(math.ceil(3 * sigma)))
+    x = np.arange(-radius, radius + 1, dtype=np.float64)
+    weights = np.exp(-x * x / (2 * sigma * sigma))
+    return (weights / weights.sum()).astype(np.float32)
+
+@profiled()
+def gaussianBlur(data: np.ndarray, sigma: float = 2.0, out: np.ndarray = None) -> np.ndarray:
+    weights = gaussianWeights(sigma)
+    out = np.empty(data.shape, dtype=np.uint8) if out is None else out
+    return separableInto(data, weights, weights, bandCount(data.shape[0], weights.shape[0] // 2), out)
+
+'''
+Convolution with the outer product of colWeights (vertical) and rowWeights (horizontal), rounded to uint8
+'''
+@njit(parallel=True, nogil=True, cache=True)
+def separableInto(data: np.ndarray, rowWeights: np.ndarray, colWeights: np.ndarray, bands: int,
+                  ret: np.ndarray) -> np.ndarray:
+    height, width, channels = data.shape
+    rx, ry = rowWeights.shape[0] // 2, colWeights.shape[0] // 2
+    lineSize = width * channels
+    for band in prange(bands):
+        top, bottom = band * height // bands, (band + 1) * height // bands
+        # horizontal pass of the band and of its halo rows
+        rows = np.zeros((bottom - top + 2 * ry, lineSize), dtype=np.float32)
+        padded = np.empty((width + 2 * rx) * channels, dtype=np.float32)
+        for t in range(rows.shape[0]):
+            padRow(data, reflect(top - ry + t, height), rx, padded)
+            for d in range(2 * rx + 1):
+                weight, offset = rowWeights[d], d * channels
+                for x in range(lineSize):
+                    rows[t, x] += weight * padded[offset + x]
+        # vertical pass, one output row at a time
+        acc = np.empty(lineSize, dtype=np.float32)
+        for i in range(top, bottom):
+            acc[:] = 0
+            for d in range(2 * ry + 1):
+                weight, t = colWeights[d], i - top + d
+                for x in range(lineSize):
+                    acc[x] += weight * rows[t, x]
+            for j in range(width):
+                for k in range(channels):
+                    ret[i, j, k] = min(255, max(0, int(acc[j * channels + k] + 0.5)))
+    return ret
+
+@profiled()
+def boxBlur(data: np.ndarray, radius: int = 3, out: np.ndarray = None) -> np.ndarray:
+    out = np.empty(data.shape, dtype=np.uint8) if out is None else out
+    return boxBlurInto(data, radius, bandCount(data.shape[0], radius), out)
+
+'''
+Mean of (2 radius + 1)^2 windows: horizontal then vertical running sums, exact integer arithmetic
+'''
+@njit(parallel=True, nogil=True, cache=True)
+def boxBlurInto(data: np.ndarray, radius: int, bands: int, ret: np.ndarray) -> np.ndarray:
+    height, width, channels = data.shape
+    size = 2 * radius + 1
+    area = size * size
+    lineSize = width * channels
+    for band in prange(bands):
+        top, bottom = band * height // bands, (band + 1) * height // bands
+        rows = np.empty((bottom - top + 2 * radius, lineSize), dtype=np.int32)
+        padded = np.empty((width + 2 * radius) * channels, dtype=np.int32)
+        for t in range(rows.shape[0]):
+            padRow(data, reflect(top - radius + t, height), radius, padded)
+            for k in range(channels):
+                s = 0
+                for x in range(size):
+                    s += padded[x * channels + k]
+                rows[t, k] = s
+                for j in range(1, width):
+                    s += padded[(j + 2 * radius) * channels + k] - padded[(j - 1) * channels + k]
+                    rows[t, j * channels + k] = s
+        acc = np.zeros(lineSize, dtype=np.int32)
+        for t in range(size):
+            acc += rows[t]
+        for i in range(top, bottom):
+            t = i - top
+            if t > 0:
+                for x in range(lineSize):
+                    acc[x] += rows[t + 2 * radius, x] - rows[t - 1, x]
+            for j in range(width):
+                for k in range(channels):
+                    ret[i, j, k] = (acc[j * channels + k] + area // 2) // area
+    return ret
+
+'''
+Unsharp mask: data + amount * (data - Gaussian blur), where the difference is at least threshold
+'''
+@profiled()
+def unsharpMask(data: np.ndarray, sigma: float = 2.0, amount: float = 1.0, threshold: int = 0,
+                out: np.ndarray = None) -> np.ndarray:
+    out = np.empty(data.shape, dtype=np.uint8) if out is None else out
+    # the blur goes to out first, then is combined in place
+    gaussianBlur(data, sigma, out)
+    return unsharpInto(data, out, amount, threshold, out)
+
+@njit(parallel=True, nogil=True, cache=True)
+def unsharpInto(data: np.ndarray, blurred: np.ndarray, amount: float, threshold: int, ret: np.ndarray) -> np.ndarray:
+    for i in prange(data.shape[0]):
+        for j in range(data.shape[1]):
+            for k in range(data.shape[2]):
+                value = int(data[i, j, k])
+                diff = value - int(blurred[i, j, k])
+                if abs(diff) >= threshold:
+                    ret[i, j, k] = min(255, max(0, int(math.floor(value + amount * diff + 0.5))))
+                else:
+                    ret[i, j, k] = value
+    return ret
+
+@profiled()
+def sobel(data: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    out = np.empty(data.shape, dtype=np.uint8) if out is None else out
+    return sobelInto(data, bandCount(data.shape[0], 1), out)
+
+'''
+Sobel gradient magnitude per channel, as separable passes: vertical smoothing and difference of three rows, then
+horizontal difference and smoothing
+'''
+@njit(parallel=True, nogil=True, cache=True)
+def sobelInto(data: np.ndarray, bands: int, ret: np.ndarray) -> np.ndarray:
+    height, width, channels = data.shape
+    lineSize = (width + 2) * channels
+    for band in prange(bands):
+        above = np.empty(lineSize, dtype=np.int32)
+        center = np.empty(lineSize, dtype=np.int32)
+        below = np.empty(lineSize, dtype=np.int32)
+        for i in range(band * height // bands, (band + 1) * height // bands):
+            padRow(data, reflect(i - 1, height), 1, above)
+            padRow(data, i, 1, center)
+            padRow(data, reflect(i + 1, height), 1, below)
+            for j in range(width):
+                for k in range(channels):
+                    left, middle, right = j * channels + k, (j + 1) * channels + k, (j + 2) * channels + k
+                    gx = (above[right] + 2 * center[right] + below[right]) - \
+                         (above[left] + 2 * center[left] + below[left])
+                    gy = (below[left] + 2 * below[middle] + below[right]) - \
+                         (above[left] + 2 * above[middle] + above[right])
+                    ret[i, j, k] = min(255, int(math.sqrt(gx * gx + gy * gy) * SOBEL_SCALE + 0.5))
+    return ret
+
+@profiled()
+def medianFilter(data: np.ndarray, radius: int = 2, out: np.ndarray = None) -> np.ndarray:
+    out = np.empty(data.shape, dtype=np.uint8) if out is None else out
+    # every band keeps 256 bin histograms of all its columns, so bands are only split across threads
+    return medianInto(data, radius, bandCount(data.shape[0], radius, 1), out)
+
+'''
+Median of (2 radius + 1)^2 windows in O(1) per pixel for any radius: a histogram per column is moved down one row
+at a time, the window histogram is moved right by adding the entering column and subtracting the leaving one,
+and the median is found through 16 coarse bins, then the 16 fine bins of the coarse one holding it
+'''
+@njit(parallel=True, nogil=True, cache=True)
+def medianInto(data: np.ndarray, radius: int, bands: int, ret: np.ndarray) -> np.ndarray:
+    height, width, channels = data.shape
+    size = 2 * radius + 1
+    half = size * size // 2
+    columnCount = width + 2 * radius
+    coarseBins = 256 >> MEDIAN_COARSE_SHIFT
+    columnIndex = np.empty(columnCount, dtype=np.int64)
+    for x in range(columnCount):
+        columnIndex[x] = reflect(x - radius, width)
+    for band in prange(bands):
+        top, bottom = band * height // bands, (band + 1) * height // bands
+        columns = np.empty((columnCount, 256), dtype=np.int32)
+        coarseColumns = np.empty((columnCount, coarseBins), dtype=np.int32)
+        window = np.empty(256, dtype=np.int32)
+        coarse = np.empty(coarseBins, dtype=np.int32)
+        for k in range(channels):
+            columns[:] = 0
+            coarseColumns[:] = 0
+            for d in range(-radius, radius + 1):
+                source = reflect(top + d, height)
+                for x in range(columnCount):
+                    value = data[source, columnIndex[x], k]
+                    columns[x, value] += 1
+                    coarseColumns[x, value >> MEDIAN_COARSE_SHIFT] += 1
+            for i in range(top, bottom):
+                if i > top:
+                    leaving, entering = reflect(i - radius - 1, height), reflect(i + radius, height)
+                    for x in range(columnCount):
+                        value = data[leaving, columnIndex[x], k]
+                        columns[x, value] -= 1
+                        coarseColumns[x, value >> MEDIAN_COARSE_SHIFT] -= 1
+                        value = data[entering, columnIndex[x], k]
+                        columns[x, value] += 1
+                        coarseColumns[x, value >> MEDIAN_COARSE_SHIFT] += 1
+                window[:] = 0
+                coarse[:] = 0
+                for x in range(size):
+                    window += columns[x]
+                    coarse += coarseColumns[x]
+                for j in range(width):
+                    if j > 0:
+                        for b in range(256):
+                            window[b] += columns[j + 2 * radius, b] - columns[j - 1, b]
+                        for b in range(coarseBins):
+                            coarse[b] += coarseColumns[j + 2 * radius, b] - coarseColumns[j - 1, b]
+                    count, b = 0, 0
+                    while count + coarse[b] <= half:
+                        count += coarse[b]
+                        b += 1
+                    value = b << MEDIAN_COARSE_SHIFT
+                    while count + window[value] <= half:
+                        count += window[value]
+                        value += 1
+                    ret[i, j, k] = value
+    return ret
+
+'''
+Compile the filter kernels, for contiguous arrays and the strided rows of ImageBuffers, see Utils.warmUp
+'''
+def warmUp():
+    rgbData = np.zeros((4, 4, 3), dtype=np.uint8)
+    alignedRGB = np.zeros((4, 16), dtype=np.uint8)[:, : 12].reshape(4, 4, 3)
+    alignedGray = np.zeros((4, 8), dtype=np.uint8)[:, : 4, None]
+    for data, out in ((rgbData, None), (rgbData, alignedRGB), (alignedRGB, alignedRGB.copy()),
+                      (alignedGray, alignedGray.copy())):
+        gaussianBlur(data, 1.0, out=out)
+        boxBlur(data, 1, out=out)
+        unsharpMask(data, 1.0, 1.0, out=out)
+        sobel(data, out=out)
+        medianFilter(data, 1, out=out)
@@ -0,0 +1,68 @@
+'''
+Histogram display of the levels window: output histograms of the R, G, B channels filled, input ones outlined
+Output histograms are derived from the input ones through the levels lookup table, so updating them while sliders
+move costs a few 256 bin operations instead of a pass over the pixels
+'''
+import numpy as np
+from PyQt5.QtWidgets import QWidget
+from PyQt5.QtGui import QPainter, QColor, QPainterPath, QPolygonF
+from PyQt5.QtCore import QPointF
+
+from Utils import calEntropy, calHuffman, lutHistogram
+
+CHANNEL_COLORS = [QColor(255, 64, 64), QColor(64, 220, 64), QColor(80, 120, 255)]
+CHANNEL_NAMES = ['R', 'G', 'B']
+BACKGROUND = QColor(32, 32, 32)
+FILL_ALPHA = 110
+HIST_HEIGHT = 120
+
+class HistogramView(QWidget):
+    '''
+    hist: (channels, 256) histogram of the image before adjustment
+    '''
+    def __init__(self, hist: np.ndarray):
+        super().__init__()
+        self.inputHist = hist.astype(np.int64)
+        self.outputHist = self.inputHist
+        self.channel = None # shown channel, None for all of them
+        self.setMinimumSize(256, HIST_HEIGHT)
+
+    '''
+    Derive the output histogram from a (channels, 256) lookup table, returns per-channel (entropy, Huffman length)
+    '''
+    def setLUT(self, lut: np.ndarray) -> [(float, float)]:
+        self.outputHist = lutHistogram(self.inputHist, lut)
+        self.update()
+        entropy = calEntropy(self.outputHist)
+        return [(float(entropy[channel, 0]), calHuffman(self.outputHist[channel]))
+                for channel in range(self.outputHist.shape[0])]
+
+    def setChannel(self, channel: int):
+        self.channel = channel
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), BACKGROUND)
+        channels = range(self.outputHist.shape[0]) if self.channel is None else [self.channel]
+        # scaled to the highest bin apart from the extremes, clipped levels pile up there
+        peak = max(1, max(int(hist[channel, 1: 255].max()) for hist in (self.inputHist, self.outputHist)
+                          for channel in channels))
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        for channel in channels:
+            color = CHANNEL_COLORS[channel % len(CHANNEL_COLORS)]
+            fill = QColor(color)
+            fill.setAlpha(FILL_ALPHA)
+            painter.setPen(color.darker(150))
+            painter.drawPolyline(self.polygon(self.inputHist[channel], peak))
+            path = QPainterPath()
+            path.addPolygon(self.polygon(self.outputHist[channel], peak, closed=True))
+            painter.fillPath(path, fill)
+
+    def polygon(self, hist: np.ndarray, peak: int, closed: bool = False) -> QPolygonF:
+        width, height = self.width(), self.height()
+        heights = np.minimum(hist / peak, 1.0) * (height - 1)
+        points = [QPointF((value + 0.5) * width / 256, height - 1 - heights[value]) for value in range(256)]
+        if closed:
+            points = [QPointF(0, height)] + points + [QPointF(width, height)]
+        return QPolygonF(points)
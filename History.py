@@ -0,0 +1,273 @@
+'''
+Undo/redo history of an image edited in place
+Steps keep only what changed: changed tiles as compressed deltas (new - old, modulo 256), point-wise operations as
+their lookup table plus the few pixels the table cannot invert, whole images only when the image is replaced
+Unchanged tiles are never copied, so that undo and redo cost O(changed tiles)
+Compressed data beyond the memory budget is spilled to a temporary file, or dropped with the oldest steps
+'''
+import zlib
+import tempfile
+from collections import OrderedDict
+import numpy as np
+
+from Utils import histogram, applyLUT
+
+TILE_SIZE = 256 # pixels per side of a history tile, same as the viewer tiles
+COMPRESSION_LEVEL = 1 # zlib level, deltas are mostly zeros and compress well even at the fastest level
+DEF_BUDGET = 256 * 2 ** 20 # bytes of compressed steps kept in memory
+DEF_MAX_STEPS = 100
+
+'''
+Tiles of a (height, width, channels) image as (y, x, height, width) rectangles, row by row
+'''
+def tileRects(height: int, width: int) -> [(int, int, int, int)]:
+    return [(y, x, min(TILE_SIZE, height - y), min(TILE_SIZE, width - x))
+            for y in range(0, height, TILE_SIZE) for x in range(0, width, TILE_SIZE)]
+
+class BlobStore:
+    '''
+    Compressed blobs by id, the oldest ones moved to a temporary file once the in-memory ones exceed budget
+    spill=False keeps everything in memory and leaves eviction to the history
+    '''
+    def __init__(self, budget: int = DEF_BUDGET, spill: bool = True):
+        self.budget, self.spill = budget, spill
+        self.memory = OrderedDict() # id: bytes, oldest first
+        self.disk = {} # id: (offset, size) in the spill file
+        self.file = None
+        self.used = self.spilled = 0
+        self.nextId = 0
+
+    def put(self, data: bytes) -> int:
+        blobId, self.nextId = self.nextId, self.nextId + 1
+        self.memory[blobId] = data
+        self.used += len(data)
+        if self.spill:
+            while self.used > self.budget and self.memory:
+                self.spillOldest()
+        return blobId
+
+    def spillOldest(self):
+        blobId, data = self.memory.popitem(last=False)
+        if self.file is None:
+            self.file = tempfile.TemporaryFile(prefix='history')
+        # space of dropped blobs is not reused, the file goes away with the history
+        self.file.seek(0, 2)
+        self.disk[blobId] = (self.file.tell(), len(data))
+        self.file.write(data)
+        self.used -= len(data)
+        self.spilled += len(data)
+
+    def get(self, blobId: int) -> bytes:
+        if blobId in self.memory:
+            return self.memory[blobId]
+        offset, size = self.disk[blobId]
+        self.file.seek(offset)
+        return self.file.read(size)
+
+    def drop(self, blobId: int):
+        if blobId in self.memory:
+            self.used -= len(self.memory.pop(blobId))
+        elif blobId in self.disk:
+            self.spilled -= self.disk.pop(blobId)[1]
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        self.memory.clear()
+        self.disk.clear()
+        self.file, self.used, self.spilled = None, 0, 0
+
+class Step:
+    '''
+    name: shown in the Undo and Redo menu items
+    states: caller data of the image before and after the step, e.g. the image hash keying the result cache
+    '''
+    def __init__(self, name: str, states: tuple):
+        self.name = name
+        self.before, self.after = states
+        self.blobs = []
+
+    def compress(self, store: BlobStore, data: np.ndarray) -> int:
+        blobId = store.put(zlib.compress(np.ascontiguousarray(data), COMPRESSION_LEVEL))
+        self.blobs.append(blobId)
+        return blobId
+
+    def decompress(self, store: BlobStore, blobId: int, shape: tuple) -> np.ndarray:
+        return np.frombuffer(zlib.decompress(store.get(blobId)), dtype=np.uint8).reshape(shape)
+
+    def drop(self, store: BlobStore):
+        for blobId in self.blobs:
+            store.drop(blobId)
+        self.blobs = []
+
+class TileStep(Step):
+    '''
+    Changed tiles as compressed (new - old) deltas, applied in place: redo adds them, undo subtracts them
+    '''
+    def __init__(self, name: str, states: tuple, store: BlobStore, data: np.ndarray, result: np.ndarray):
+        super().__init__(name, states)
+        self.tiles = [] # (y, x, height, width, blob id)
+        for y, x, height, width in tileRects(data.shape[0], data.shape[1]):
+            tile = data[y: y + height, x: x + width]
+            # grayscale results are broadcast to the channels of the image
+            delta = np.subtract(result[y: y + height, x: x + width], tile, dtype=np.uint8)
+            if delta.any():
+                self.tiles.append((y, x, height, width, self.compress(store, delta)))
+                tile += delta
+
+    def apply(self, store: BlobStore, data: np.ndarray, sign: int) -> (np.ndarray, [tuple]):
+        for y, x, height, width, blobId in self.tiles:
+            tile = data[y: y + height, x: x + width]
+            delta = self.decompress(store, blobId, tile.shape)
+            if sign > 0:
+                tile += delta
+            else:
+                tile -= delta
+        return data, [rect[: 4] for rect in self.tiles]
+
+    def undo(self, store: BlobStore, data: np.ndarray) -> (np.ndarray, [tuple]):
+        return self.apply(store, data, -1)
+
+    def redo(self, store: BlobStore, data: np.ndarray) -> (np.ndarray, [tuple]):
+        return self.apply(store, data, 1)
+
+class LUTStep(Step):
+    '''
+    Point-wise operation kept as its (channels, 256) lookup table, replayed on redo
+    Undo applies an inverse table, mapping every output value back to its most frequent input value, and restores
+    the other input values of merged (e.g. clipped) outputs from compressed residual tiles
+    '''
+    def __init__(self, name: str, states: tuple, store: BlobStore, data: np.ndarray, lut: np.ndarray):
+        super().__init__(name, states)
+        self.lut = np.ascontiguousarray(lut, dtype=np.uint8)
+        hist = histogram(data)
+        self.inverse = np.zeros(self.lut.shape, dtype=np.uint8)
+        for channel in range(self.lut.shape[0]):
+            # ascending counts, so that the most frequent input of each output is written last
+            for value in np.argsort(hist[channel], kind='stable'):
+                self.inverse[channel, self.lut[channel, value]] = value
+        self.residuals = [] # (y, x, height, width, blob id)
+        # one band of tile rows at a time, so that only a band of the old image is copied
+        for top in range(0, data.shape[0], TILE_SIZE):
+            band = data[top: top + TILE_SIZE]
+            old = band.copy()
+            applyLUT(old, self.lut, band)
+            residual = np.subtract(old, applyLUT(band, self.inverse), dtype=np.uint8)
+            for y, x, height, width in tileRects(band.shape[0], band.shape[1]):
+                tile = residual[y: y + height, x: x + width]
+                if tile.any():
+                    self.residuals.append((top + y, x, height, width, self.compress(store, tile)))
+
+    def undo(self, store: BlobStore, data: np.ndarray) -> (np.ndarray, [tuple]):
+        applyLUT(data, self.inverse, data)
+        for y, x, height, width, blobId in self.residuals:
+            tile = data[y: y + height, x: x + width]
+            tile += self.decompress(store, blobId, tile.shape)
+        return data, [(0, 0, data.shape[0], data.shape[1])]
+
+    def redo(self, store: BlobStore, data: np.ndarray) -> (np.ndarray, [tuple]):
+        applyLUT(data, self.lut, data)
+        return data, [(0, 0, data.shape[0], data.shape[1])]
+
+class ImageStep(Step):
+    '''
+    Image replaced by another one, possibly of another size: the replaced image is compressed tile by tile,
+    the new one only once it is undone
+    '''
+    def __init__(self, name: str, states: tuple, store: BlobStore, data: np.ndarray):
+        super().__init__(name, states)
+        self.images = {-1: self.compressImage(store, data), 1: None}
+
+    def compressImage(self, store: BlobStore, data: np.ndarray) -> (tuple, list):
+        return data.shape, [self.compress(store, data[y: y + height, x: x + width])
+                            for y, x, height, width in tileRects(data.shape[0], data.shape[1])]
+
+    def decompressImage(self, store: BlobStore, image: (tuple, list)) -> np.ndarray:
+        shape, blobs = image
+        ret = np.empty(shape, dtype=np.uint8)
+        for (y, x, height, width), blobId in zip(tileRects(shape[0], shape[1]), blobs):
+            ret[y: y + height, x: x + width] = self.decompress(store, blobId, (height, width, shape[2]))
+        return ret
+
+    def undo(self, store: BlobStore, data: np.ndarray) -> (np.ndarray, [tuple]):
+        if self.images[1] is None:
+            self.images[1] = self.compressImage(store, data)
+        ret = self.decompressImage(store, self.images[-1])
+        return ret, [(0, 0, ret.shape[0], ret.shape[1])]
+
+    def redo(self, store: BlobStore, data: np.ndarray) -> (np.ndarray, [tuple]):
+        ret = self.decompressImage(store, self.images[1])
+        return ret, [(0, 0, ret.shape[0], ret.shape[1])]
+
+class History:
+    def __init__(self, budget: int = DEF_BUDGET, spill: bool = True, maxSteps: int = DEF_MAX_STEPS):
+        self.store = BlobStore(budget, spill)
+        self.budget, self.maxSteps = budget, maxSteps
+        self.undoSteps, self.redoSteps = [], []
+
+    '''
+    Write result (same size as data, 1 or all of its channels) into data, recording the changed tiles
+    Returns the changed (y, x, height, width) rectangles
+    '''
+    def applyResult(self, name: str, data: np.ndarray, result: np.ndarray, states: tuple = (None, None)) -> [tuple]:
+        assert result.shape[: 2] == data.shape[: 2], str.format("Result size differs from the image size")
+        step = TileStep(name, states, self.store, data, result)
+        self.push(step)
+        return [rect[: 4] for rect in step.tiles]
+
+    '''
+    Apply a (channels, 256) lookup table to data in place, recording the table instead of pixels
+    '''
+    def applyLUT(self, name: str, data: np.ndarray, lut: np.ndarray, states: tuple = (None, None)) -> [tuple]:
+        self.push(LUTStep(name, states, self.store, data, lut))
+        return [(0, 0, data.shape[0], data.shape[1])]
+
+    '''
+    Record that data is about to be replaced by another image, e.g. by opening another file
+    '''
+    def replace(self, name: str, data: np.ndarray, states: tuple = (None, None)):
+        self.push(ImageStep(name, states, self.store, data))
+
+    def push(self, step: Step):
+        for redoStep in self.redoSteps:
+            redoStep.drop(self.store)
+        self.redoSteps = []
+        self.undoSteps.append(step)
+        # without spilling, the oldest steps are dropped to stay within budget
+        while len(self.undoSteps) > self.maxSteps or (not self.store.spill and self.store.used > self.budget
+                                                      and len(self.undoSteps) > 1):
+            self.undoSteps.pop(0).drop(self.store)
+
+    '''
+    Undo the last step on data, in place unless the image size changes
+    Returns (image data, changed rectangles, undone step), data itself and no step if there is nothing to undo
+    '''
+    def undo(self, data: np.ndarray) -> (np.ndarray, [tuple], Step):
+        if not self.undoSteps:
+            return data, [], None
+        step = self.undoSteps.pop()
+        data, rects = step.undo(self.store, data)
+        self.redoSteps.append(step)
+        return data, rects, step
+
+    def redo(self, data: np.ndarray) -> (np.ndarray, [tuple], Step):
+        if not self.redoSteps:
+            return data, [], None
+        step = self.redoSteps.pop()
+        data, rects = step.redo(self.store, data)
+        self.undoSteps.append(step)
+        return data, rects, step
+
+    def undoName(self) -> str:
+        return self.undoSteps[-1].name if self.undoSteps else ""
+
+    def redoName(self) -> str:
+        return self.redoSteps[-1].name if self.redoSteps else ""
+
+    def clear(self):
+        self.undoSteps, self.redoSteps = [], []
+        self.store.close()
+
+    def stats(self) -> str:
+        return "History: %d steps, %.1f MB in memory, %.1f MB spilled" % (
+            len(self.undoSteps) + len(self.redoSteps), self.store.used / 2 ** 20, self.store.spilled / 2 ** 20)
@@ -0,0 +1,194 @@
+'''
+Huffman codec: canonical, length-limited codes per channel, compiled bit packing and table-lookup decoding
+Container layout (little endian):
+    magic 'HPSH', version (u8), channels (u8), width (u32), height (u32), chunk pixels (u32)
+    per channel: 256 code lengths (u8) and byte size of each chunk (u64)
+    chunk streams, channel after channel
+Each channel is split in chunks of pixels coded independently, so that chunks are packed and unpacked in parallel
+'''
+import struct
+import numpy as np
+from numba import njit, prange
+from heapq import heappush, heappop
+
+from Utils import histogram
+from Profiler import profiled
+
+MAGIC = b'HPSH'
+VERSION = 1
+MAX_CODE_LENGTH = 16 # decoding table has 2 ** MAX_CODE_LENGTH entries
+CHUNK_PIXELS = 1 << 18
+
+'''
+Huffman code lengths of the 256 values of a histogram, limited to maxLength bits
+Counts are halved until the optimal code fits, which only happens for extremely skewed histograms
+'''
+def huffmanCodeLengths(hist: np.ndarray, maxLength: int = MAX_CODE_LENGTH) -> np.ndarray:
+    counts = hist.astype(np.int64)
+    while True:
+        lengths = np.zeros(256, dtype=np.uint8)
+        # heap nodes: (count, smallest value as tie break, values in subtree)
+        nodes = []
+        for value in np.flatnonzero(counts):
+            heappush(nodes, (int(counts[value]), int(value), [int(value)]))
+        if len(nodes) == 1:
+            lengths[nodes[0][1]] = 1
+        while len(nodes) > 1:
+            (countA, keyA, valuesA), (countB, keyB, valuesB) = heappop(nodes), heappop(nodes)
+            lengths[valuesA + valuesB] += 1
+            heappush(nodes, (countA + countB, min(keyA, keyB), valuesA + valuesB))
+        if lengths.max() <= maxLength:
+            return lengths
+        counts = (counts + 1) // 2
+
+'''
+Canonical codes of given code lengths: values sorted by (length, value) get consecutive codes
+'''
+def canonicalCodes(lengths: np.ndarray) -> np.ndarray:
+    codes = np.zeros(256, dtype=np.uint32)
+    code, prevLength = 0, 0
+    for value in sorted(np.flatnonzero(lengths), key=lambda value: (lengths[value], value)):
+        code <<= int(lengths[value]) - prevLength
+        codes[value], prevLength = code, int(lengths[value])
+        code += 1
+    return codes
+
+'''
+Decoding table indexed by the next MAX_CODE_LENGTH bits of the stream: (value, code length)
+'''
+def decodingTable(lengths: np.ndarray) -> (np.ndarray, np.ndarray):
+    codes = canonicalCodes(lengths)
+    tableValues = np.zeros(1 << MAX_CODE_LENGTH, dtype=np.uint8)
+    tableLengths = np.zeros(1 << MAX_CODE_LENGTH, dtype=np.uint8)
+    for value in np.flatnonzero(lengths):
+        shift = MAX_CODE_LENGTH - int(lengths[value])
+        tableValues[int(codes[value]) << shift: (int(codes[value]) + 1) << shift] = value
+        tableLengths[int(codes[value]) << shift: (int(codes[value]) + 1) << shift] = lengths[value]
+    return tableValues, tableLengths
+
+'''
+Byte size of every coded chunk of one channel of interleaved data (flat, channels values per pixel)
+'''
+@njit(parallel=True, nogil=True, cache=True)
+def chunkSizes(flat: np.ndarray, channels: int, channel: int, lengths: np.ndarray, chunkPixels: int) -> np.ndarray:
+    pixels = flat.shape[0] // channels
+    chunks = (pixels + chunkPixels - 1) // chunkPixels
+    ret = np.zeros(chunks, dtype=np.int64)
+    for chunk in prange(chunks):
+        bits = 0
+        for i in range(chunk * chunkPixels, min((chunk + 1) * chunkPixels, pixels)):
+            bits += lengths[flat[i * channels + channel]]
+        ret[chunk] = (bits + 7) // 8
+    return ret
+
+'''
+Pack the codes of one channel into out, each chunk starting at its byte offset, most significant bit first
+'''
+@njit(parallel=True, nogil=True, cache=True)
+def packChunks(flat: np.ndarray, channels: int, channel: int, codes: np.ndarray, lengths: np.ndarray,
+               chunkPixels: int, offsets: np.ndarray, out: np.ndarray):
+    pixels = flat.shape[0] // channels
+    for chunk in prange(offsets.shape[0] - 1):
+        pos = offsets[chunk]
+        acc, accBits = np.uint64(0), 0
+        for i in range(chunk * chunkPixels, min((chunk + 1) * chunkPixels, pixels)):
+            value = flat[i * channels + channel]
+            acc = (acc << np.uint64(lengths[value])) | np.uint64(codes[value])
+            accBits += lengths[value]
+            while accBits >= 8:
+                accBits -= 8
+                out[pos] = np.uint8((acc >> np.uint64(accBits)) & np.uint64(0xFF))
+                pos += 1
+        if accBits > 0:
+            out[pos] = np.uint8((acc << np.uint64(8 - accBits)) & np.uint64(0xFF))
+
+'''
+Decode the chunks of one channel into flat interleaved data with a MAX_CODE_LENGTH-bit lookup table
+'''
+@njit(parallel=True, nogil=True, cache=True)
+def unpackChunks(stream: np.ndarray, offsets: np.ndarray, tableValues: np.ndarray, tableLengths: np.ndarray,
+                 chunkPixels: int, flat: np.ndarray, channels: int, channel: int):
+    pixels = flat.shape[0] // channels
+    for chunk in prange(offsets.shape[0] - 1):
+        pos, end = offsets[chunk], offsets[chunk + 1]
+        acc, accBits = np.uint64(0), 0
+        for i in range(chunk * chunkPixels, min((chunk + 1) * chunkPixels, pixels)):
+            while accBits < MAX_CODE_LENGTH:
+                byte = stream[pos] if pos < end else 0
+                acc = (acc << np.uint64(8)) | np.uint64(byte)
+                accBits += 8
+                pos += 1
+            peek = (acc >> np.uint64(accBits - MAX_CODE_LENGTH)) & np.uint64((1 << MAX_CODE_LENGTH) - 1)
+            flat[i * channels + channel] = tableValues[peek]
+            accBits -= tableLengths[peek]
+
+'''
+Encode (height, width, channels) uint8 data into container bytes
+'''
+@profiled()
+def encodeHuffman(data: np.ndarray, chunkPixels: int = CHUNK_PIXELS) -> bytes:
+    height, width, channels = data.shape
+    flat = np.ascontiguousarray(data).reshape(-1)
+    hist = histogram(data)
+    header = [struct.pack('<4sBBIII', MAGIC, VERSION, channels, width, height, chunkPixels)]
+    streams = []
+    for channel in range(channels):
+        lengths = huffmanCodeLengths(hist[channel])
+        sizes = chunkSizes(flat, channels, channel, lengths, chunkPixels)
+        offsets = np.zeros(sizes.shape[0] + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        stream = np.zeros(int(offsets[-1]), dtype=np.uint8)
+        packChunks(flat, channels, channel, canonicalCodes(lengths), lengths, chunkPixels, offsets, stream)
+        header += [lengths.tobytes(), sizes.astype('<u8').tobytes()]
+        streams.append(stream.tobytes())
+    return b''.join(header + streams)
+
+'''
+Decode container bytes, returns (data, errMsg)
+'''
+@profiled()
+def decodeHuffman(buffer) -> (np.ndarray, str):
+    try:
+        magic, version, channels, width, height, chunkPixels = struct.unpack_from('<4sBBIII', buffer, 0)
+        assert magic == MAGIC and version == VERSION, str.format("Not a Huffman file")
+        assert channels > 0 and width > 0 and height > 0 and chunkPixels > 0, str.format("Huffman file not valid")
+        chunks = (width * height + chunkPixels - 1) // chunkPixels
+        pos, tables = struct.calcsize('<4sBBIII'), []
+        for channel in range(channels):
+            lengths = np.frombuffer(buffer, dtype=np.uint8, count=256, offset=pos)
+            assert lengths.max() <= MAX_CODE_LENGTH, str.format("Huffman file not valid")
+            sizes = np.frombuffer(buffer, dtype='<u8', count=chunks, offset=pos + 256).astype(np.int64)
+            tables.append((lengths, sizes))
+            pos += 256 + 8 * chunks
+        assert pos + sum(int(sizes.sum()) for _, sizes in tables) <= len(buffer), str.format("Huffman file not valid")
+    except (struct.error, ValueError):
+        return None, str.format("Huffman file not valid")
+    except AssertionError as e:
+        return None, str(e)
+    flat = np.zeros(width * height * channels, dtype=np.uint8)
+    for channel, (lengths, sizes) in enumerate(tables):
+        offsets = np.zeros(chunks + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        stream = np.frombuffer(buffer, dtype=np.uint8, count=int(offsets[-1]), offset=pos)
+        unpackChunks(stream, offsets, *decodingTable(lengths), chunkPixels, flat, channels, channel)
+        pos += int(offsets[-1])
+    return flat.reshape(height, width, channels), ""
+
+def saveHuffman(fileName: str, data: np.ndarray) -> str:
+    try:
+        with open(fileName, 'wb') as file:
+            file.write(encodeHuffman(data))
+    except IOError:
+        return str.format("Cannot write file")
+    return ""
+
+def loadHuffman(fileName: str) -> (np.ndarray, (int, int), str):
+    try:
+        with open(fileName, 'rb') as file:
+            buffer = file.read()
+    except IOError:
+        return None, (0, 0), str.format("File not found")
+    data, errMsg = decodeHuffman(buffer)
+    if data is None:
+        return None, (-1, -1), errMsg
+    return data, (data.shape[1], data.shape[0]), ""
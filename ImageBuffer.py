@@ -0,0 +1,76 @@
+'''
+Image storage shared by the kernels and Qt: rows are allocated 4-byte aligned up front, so that kernels write
+straight into memory a QImage can use without conversion or padding copies
+The buffer owns the storage and every QImage built on it, so that no QImage outlives the pixels it points to
+'''
+import sys
+import numpy as np
+from PyQt5 import sip
+from PyQt5.QtGui import QImage
+
+from Utils import writeBMP
+
+BYTES_PER_PIXEL = {QImage.Format_Grayscale8: 1, QImage.Format_RGB888: 3, QImage.Format_RGB32: 4}
+
+class ImageBuffer:
+    '''
+    Grayscale8 is viewed as (height, width, 1), RGB888 and RGB32 as (height, width, 3) in RGB order
+    RGB32 stores 0xffRRGGBB words, its fourth byte is kept at 255
+    '''
+    def __init__(self, width: int, height: int, format: QImage.Format = QImage.Format_RGB888):
+        self.width, self.height, self.format = width, height, format
+        self.bytesPerPixel = BYTES_PER_PIXEL[format]
+        self.bytesPerLine = (width * self.bytesPerPixel + 3) // 4 * 4
+        self.storage = np.zeros((height, self.bytesPerLine), dtype=np.uint8)
+        pixels = self.storage[:, : width * self.bytesPerPixel].reshape(height, width, self.bytesPerPixel)
+        if format == QImage.Format_RGB32:
+            # words are stored B, G, R, 0xff on little endian machines and 0xff, R, G, B on big endian ones
+            if sys.byteorder == 'little':
+                pixels[:, :, 3], pixels = 255, pixels[:, :, 2:: -1]
+            else:
+                pixels[:, :, 0], pixels = 255, pixels[:, :, 1:]
+        # strided view written by the kernels, rows start bytesPerLine apart in storage
+        self.array = pixels
+        self.image = QImage(self.storage, width, height, self.bytesPerLine, format)
+
+    '''
+    Buffer holding a copy of (height, width, 1 or 3) data, format defaults to Grayscale8 or RGB888 by channels
+    '''
+    @classmethod
+    def fromArray(cls, data: np.ndarray, format: QImage.Format = None):
+        if format is None:
+            format = QImage.Format_Grayscale8 if data.shape[2] == 1 else QImage.Format_RGB888
+        ret = cls(data.shape[1], data.shape[0], format)
+        ret.array[...] = data
+        return ret
+
+    '''
+    Empty buffer of the same size and format
+    '''
+    def like(self):
+        return ImageBuffer(self.width, self.height, self.format)
+
+    @property
+    def nbytes(self) -> int:
+        return self.storage.nbytes
+
+    def __array__(self, dtype=None, copy=None):
+        return self.array if dtype is None else self.array.astype(dtype)
+
+    '''
+    QImage of a rectangle of the buffer, pointing into the storage without copying
+    x * bytes per pixel should be a multiple of 4 to keep rows aligned, e.g. x a multiple of 4
+    The QImage is only valid while this buffer is alive
+    '''
+    def subImage(self, x: int, y: int, width: int, height: int) -> QImage:
+        address = self.storage.ctypes.data + y * self.bytesPerLine + x * self.bytesPerPixel
+        return QImage(sip.voidptr(address), width, height, self.bytesPerLine, self.format)
+
+    '''
+    Write as BMP, 8-bit grayscale rows are already in BMP layout and written without a copy
+    Returns an error message, empty on success
+    '''
+    def save(self, fileName: str) -> str:
+        if self.format == QImage.Format_Grayscale8:
+            return writeBMP(fileName, self.storage[:, :, None], self.width)
+        return writeBMP(fileName, self.array)
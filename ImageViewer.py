@@ -0,0 +1,185 @@
+'''
+Zoomable image viewer: a multi-resolution pyramid built lazily and drawn tile by tile
+Only the tiles visible at the current zoom are drawn, each one a QImage pointing into the ImageBuffer of its level,
+so that repaint time depends on the viewport size instead of the image size
+'''
+import math
+from PyQt5.QtWidgets import QWidget, QHBoxLayout
+from PyQt5.QtGui import QImage, QPainter, QColor
+from PyQt5.QtCore import Qt, QPointF, QRectF, pyqtSignal
+
+from Utils import downsample
+from ImageBuffer import ImageBuffer
+from Profiler import profiled
+
+TILE_SIZE = 256 # pixels per side of a tile, at every pyramid level
+MIN_ZOOM = 1 / 256
+MAX_ZOOM = 64
+ZOOM_STEP = 1.25 # zoom factor of one mouse wheel notch
+BACKGROUND = QColor(64, 64, 64)
+
+class ImagePyramid:
+    '''
+    sampling: image pixels per buffer pixel, for downscaled proxies shown at the size of the full image
+    '''
+    def __init__(self, buffer: ImageBuffer, sampling: int = 1):
+        # level 0 is the buffer itself, level n averages 2**n x 2**n buffer pixels and is built on first use
+        self.levels = [buffer]
+        self.sampling = sampling
+        self.width, self.height = buffer.width * sampling, buffer.height * sampling
+        self.maxLevel = max(0, math.ceil(math.log2(max(buffer.width, buffer.height) / TILE_SIZE)))
+
+    def level(self, n: int) -> ImageBuffer:
+        while len(self.levels) <= n:
+            previous = self.levels[-1]
+            level = ImageBuffer((previous.width + 1) // 2, (previous.height + 1) // 2, previous.format)
+            downsample(previous.array, out=level.array)
+            self.levels.append(level)
+        return self.levels[n]
+
+    '''
+    Rebuild the parts of the built levels covering rectangles (y, x, height, width) of level 0 changed in place
+    '''
+    def update(self, rects: [(int, int, int, int)]):
+        for n in range(1, len(self.levels)):
+            previous, level = self.levels[n - 1].array, self.levels[n].array
+            for y, x, height, width in rects:
+                # level n pixels covering the rectangle, and the level n - 1 pixels they average
+                top, left = y >> n, x >> n
+                bottom, right = (y + height - 1 >> n) + 1, (x + width - 1 >> n) + 1
+                downsample(previous[2 * top: 2 * bottom, 2 * left: 2 * right], out=level[top: bottom, left: right])
+
+    '''
+    Coarsest level with at least one data pixel per screen pixel at zoom
+    '''
+    def levelFor(self, zoom: float) -> int:
+        return min(self.maxLevel, int(math.log2(max(1.0, 1.0 / (zoom * self.sampling)))))
+
+    '''
+    Image pixels covered by one pixel of level n
+    '''
+    def pixelSpan(self, n: int) -> int:
+        return self.sampling << n
+
+    '''
+    Tile (tx, ty) of level n, a QImage on the level storage, valid while the pyramid is alive
+    '''
+    def tile(self, n: int, tx: int, ty: int) -> QImage:
+        level = self.level(n)
+        x, y = tx * TILE_SIZE, ty * TILE_SIZE
+        return level.subImage(x, y, min(TILE_SIZE, level.width - x), min(TILE_SIZE, level.height - y))
+
+    @property
+    def nbytes(self) -> int:
+        return sum(level.nbytes for level in self.levels)
+
+class ImageView(QWidget):
+    # emitted on user pan and zoom: (zoom, center x, center y) in image pixels, None when fitted to the window
+    viewChanged = pyqtSignal(object)
+
+    def __init__(self, pyramid: ImagePyramid = None):
+        super().__init__()
+        self.pyramid = pyramid
+        # fitted to the window until the user pans or zooms, double click fits again
+        self.fitted = True
+        self.zoom, self.center = 1.0, QPointF()
+        self.dragStart = self.dragCenter = None
+        self.setMinimumSize(64, 64)
+        self.setCursor(Qt.CursorShape.OpenHandCursor)
+
+    '''
+    Show another pyramid, keepView keeps zoom and pan, e.g. for another rendering of the same image
+    '''
+    def setPyramid(self, pyramid: ImagePyramid, keepView: bool = False):
+        self.fitted = self.fitted or not keepView or self.pyramid is None
+        self.pyramid = pyramid
+        self.update()
+
+    def setView(self, view: (float, float, float)):
+        if view is None:
+            self.fitted = True
+        else:
+            self.fitted = False
+            self.zoom, self.center = view[0], QPointF(view[1], view[2])
+        self.update()
+
+    def view(self) -> (float, float, float):
+        return None if self.fitted else (self.zoom, self.center.x(), self.center.y())
+
+    def fitZoom(self) -> float:
+        # never enlarge small images when fitting
+        return min(1.0, self.width() / self.pyramid.width, self.height() / self.pyramid.height)
+
+    @profiled(category='paint', skipArgs=2)
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), BACKGROUND)
+        if self.pyramid is None:
+            return
+        pyramid = self.pyramid
+        if self.fitted:
+            self.zoom, self.center = self.fitZoom(), QPointF(pyramid.width / 2, pyramid.height / 2)
+        # widget pixel = (image pixel - center) * zoom + widget center
+        painter.translate(self.width() / 2 - self.center.x() * self.zoom, self.height() / 2 - self.center.y() * self.zoom)
+        painter.scale(self.zoom, self.zoom)
+        painter.setClipRect(QRectF(0, 0, pyramid.width, pyramid.height))
+        # magnified pixels stay sharp, minified levels are filtered
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, self.zoom * pyramid.sampling < 1)
+        n = pyramid.levelFor(self.zoom)
+        span = pyramid.pixelSpan(n)
+        tileSpan = TILE_SIZE * span
+        left, top = self.center.x() - self.width() / 2 / self.zoom, self.center.y() - self.height() / 2 / self.zoom
+        right, bottom = left + self.width() / self.zoom, top + self.height() / self.zoom
+        for ty in range(max(0, int(top // tileSpan)), min(int(bottom // tileSpan), (pyramid.height - 1) // tileSpan) + 1):
+            for tx in range(max(0, int(left // tileSpan)), min(int(right // tileSpan), (pyramid.width - 1) // tileSpan) + 1):
+                image = pyramid.tile(n, tx, ty)
+                painter.drawImage(QRectF(tx * tileSpan, ty * tileSpan, image.width() * span, image.height() * span), image)
+
+    def userChangedView(self):
+        self.update()
+        self.viewChanged.emit(self.view())
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.MouseButton.LeftButton and self.pyramid is not None:
+            self.dragStart, self.dragCenter = event.pos(), QPointF(self.center)
+            self.setCursor(Qt.CursorShape.ClosedHandCursor)
+
+    def mouseMoveEvent(self, event):
+        if self.dragStart is not None:
+            self.fitted = False
+            self.center = self.dragCenter - QPointF(event.pos() - self.dragStart) / self.zoom
+            self.userChangedView()
+
+    def mouseReleaseEvent(self, event):
+        self.dragStart = None
+        self.setCursor(Qt.CursorShape.OpenHandCursor)
+
+    def mouseDoubleClickEvent(self, event):
+        self.fitted = True
+        self.userChangedView()
+
+    def wheelEvent(self, event):
+        if self.pyramid is None:
+            return
+        # zoom around the cursor, fractional notches of touchpads give smooth zooming
+        zoom = min(MAX_ZOOM, max(MIN_ZOOM, self.zoom * ZOOM_STEP ** (event.angleDelta().y() / 120)))
+        offset = event.position() - QPointF(self.width() / 2, self.height() / 2)
+        self.center += offset / self.zoom - offset / zoom
+        self.zoom, self.fitted = zoom, False
+        self.userChangedView()
+
+'''
+Side-by-side before/after views of images of the same size, panning and zooming together
+'''
+class CompareView(QWidget):
+    def __init__(self, before: ImagePyramid, after: ImagePyramid):
+        super().__init__()
+        self.views = [ImageView(before), ImageView(after)]
+        # setView does not emit viewChanged, so syncing does not loop
+        self.views[0].viewChanged.connect(self.views[1].setView)
+        self.views[1].viewChanged.connect(self.views[0].setView)
+        layout = QHBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        for view in self.views:
+            layout.addWidget(view)
+        self.setLayout(layout)
@@ -8,14 +8,29 @@ from PyQt5.QtWidgets import (
     QLabel,
     QHBoxLayout,
     QVBoxLayout,
-    QTabWidget
+    QTabWidget,
+    QPushButton
 )
-from PyQt5.QtGui import QIcon, QPixmap, QImage
-from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QIcon, QImage
+from PyQt5.QtCore import Qt, QObject, QRunnable, QThreadPool, QTimer, pyqtSignal, pyqtSlot
 from superqt import QLabeledRangeSlider, QLabeledDoubleSlider
 
-from Utils import readBMP, cvtGrayscale, cvtAlignedData, cvtOrderedDithering, colorAdjustment, normalize, calEntropy
-from Utils import histogram, calHuffman
+from Utils import mapBMP, cvtBMPRows, cvtGrayscale, cvtOrderedDithering, normalize, calEntropy
+from Utils import histogram, calHuffman, autolevel, autolevelParameters, levelsLUT, buildLevelsLUT
+from Utils import cvtBayerDithering, cvtErrorDiffusion, writeBMP
+from Filters import gaussianBlur, boxBlur, unsharpMask, sobel, medianFilter
+from Quantize import quantize, cvtPalette
+from ResultCache import ResultCache
+from History import History
+from ImageBuffer import ImageBuffer
+from ImageViewer import ImagePyramid, ImageView, CompareView
+from HistogramView import HistogramView, CHANNEL_NAMES
+from Pipeline import Pipeline, Node, Levels
+from Huffman import loadHuffman, saveHuffman
+from Daemon import connectDaemon
+from Profiler import PROFILER, profiled
+from ProfilerPanel import ProfilerPanel
+import os
 import numpy as np
 
 # Global consts
@@ -23,7 +38,26 @@ DEF_WIDTH = 300
 DEF_HEIGHT = 100
 INIT_WINDOW_WIDTH = 1024
 INIT_WINDOW_HEIGHT = 768
+MAX_POPUP_WIDTH = 1600 # before/after popups start at the image size, up to this size
+MAX_POPUP_HEIGHT = 900
 ICON = 'icon.png'
+CACHE_BUDGET = 512 * 2 ** 20 # bytes of processed results kept by the result cache
+CACHE_RECENT_FILES = 3 # recently opened images kept decoded in the result cache
+DITHER_SIZES = [2, 4, 8, 16, 32] # ordered dithering matrices offered, opt n of orderedDithering is 2 ** (n + 1)
+DIFFUSION_PARALLEL_PIXELS = 4 * 2 ** 20 # images larger than this use the parallel wavefront error diffusion
+DIFFUSION_METHODS = [('&Floyd-Steinberg', 'floyd-steinberg'), ('&Atkinson', 'atkinson'),
+                     ('&Jarvis-Judice-Ninke', 'jarvis-judice-ninke'), ('&Stucki', 'stucki')]
+PREVIEW_SIZE = 512 # longest side of the downscaled proxy rendered while sliders are dragged
+PREVIEW_DELAY = 150 # ms without slider changes before rendering at full resolution
+LEVELS_IDENTITY = ([1.0] * 4, [(0, 255)] * 4, [(0, 255)] * 4)
+PROFILE = True # record timings of actions and kernels from startup
+HISTORY_BUDGET = 256 * 2 ** 20 # bytes of compressed undo steps kept in memory, older ones spill to a temporary file
+GAUSSIAN_SIGMAS = [1.0, 2.0, 4.0, 8.0]
+BOX_RADII = [1, 3, 7, 15]
+UNSHARP_PRESETS = [(1.0, 1.0), (2.0, 0.75), (4.0, 0.5)] # (sigma, amount)
+MEDIAN_RADII = [1, 2, 4, 8]
+QUANTIZE_COLORS = [256, 64, 16, 4]
+QUANTIZE_KMEANS = 8 # k-means iterations refining median cut palettes, when enabled
 QSS = """
     QRangeSlider{
         background-color: none;
@@ -46,30 +80,94 @@ class PSWindow(QMainWindow):
         self.menuCoreOps.addAction(QAction("&Exit", self, shortcut="Ctrl+Q", triggered=self.close))
         self.menuCoreOps.addSeparator()
         self.menuCoreOps.addAction(QAction("&Grayscale", self, shortcut="Alt+G", triggered=self.grayScale))
-        orderedOpts = [QAction("&2x2 matrix", self), QAction("&4x4 matrix", self), QAction("&8x8 matrix", self)]
-        orderedOpts[0].triggered.connect(lambda: self.orderedDithering(0))
-        orderedOpts[1].triggered.connect(lambda: self.orderedDithering(1))
-        orderedOpts[2].triggered.connect(lambda: self.orderedDithering(2))
         ordDitMenu = self.menuCoreOps.addMenu("&Ordered Dithering")
-        ordDitMenu.addActions(orderedOpts)
+        for opt, size in enumerate(DITHER_SIZES):
+            ordDitMenu.addAction(QAction("&%dx%d matrix" % (size, size), self,
+                                         triggered=lambda _, opt=opt: self.orderedDithering(opt)))
+        diffusionMenu = self.menuCoreOps.addMenu("&Error Diffusion")
+        for name, method in DIFFUSION_METHODS:
+            diffusionMenu.addAction(QAction(name, self, triggered=lambda _, method=method: self.errorDiffusion(method)))
         self.menuCoreOps.addAction(QAction("&Auto Level", self, shortcut="Alt+A", triggered=self.autolevel))
         self.menuCoreOps.addAction(QAction("&Huffman", self, shortcut="Alt+H", triggered=self.huffman))
+        self.menuCoreOps.addSeparator()
+        self.daemonAction = QAction("Use Processing &Daemon", self, checkable=True, toggled=self.useDaemon)
+        self.menuCoreOps.addAction(self.daemonAction)
+
+        # Menu bar: edit, results are applied to the image from their popups
+        self.menuEdit = QMenu("&Edit", self)
+        self.undoAction = QAction("&Undo", self, shortcut="Ctrl+Z", triggered=self.undo, enabled=False)
+        self.redoAction = QAction("&Redo", self, shortcut="Ctrl+Shift+Z", triggered=self.redo, enabled=False)
+        self.menuEdit.addActions([self.undoAction, self.redoAction])
 
         # Menu bar: optional ops
         self.menuOptOps = QMenu("&Optional Operations", self)
-        coloredorderdOpts = [QAction("&2x2 matrix", self), QAction("&4x4 matrix", self), QAction("&8x8 matrix", self)]
-        coloredorderdOpts[0].triggered.connect(lambda: self.orderedDithering(0, True))
-        coloredorderdOpts[1].triggered.connect(lambda: self.orderedDithering(1, True))
-        coloredorderdOpts[2].triggered.connect(lambda: self.orderedDithering(2, True))
         coloredOrdDitMenu = self.menuOptOps.addMenu("&Colored Ordered Dithering")
-        coloredOrdDitMenu.addActions(coloredorderdOpts)
+        for opt, size in enumerate(DITHER_SIZES):
+            coloredOrdDitMenu.addAction(QAction("&%dx%d matrix" % (size, size), self,
+                                                triggered=lambda _, opt=opt: self.orderedDithering(opt, True)))
+        coloredDiffusionMenu = self.menuOptOps.addMenu("Colored &Error Diffusion")
+        for name, method in DIFFUSION_METHODS:
+            coloredDiffusionMenu.addAction(QAction(name, self,
+                                                   triggered=lambda _, method=method: self.errorDiffusion(method, True)))
         self.menuOptOps.addAction(QAction("&Color Adjustment", self, shortcut="Alt+L", triggered=self.levelAdjustment))
+        quantizeMenu = self.menuOptOps.addMenu("Color &Quantization")
+        for colors in QUANTIZE_COLORS:
+            quantizeMenu.addAction(QAction("&%d colors" % colors, self,
+                                           triggered=lambda _, colors=colors: self.colorQuantization(colors)))
+        quantizeMenu.addSeparator()
+        self.kmeansAction = QAction("&K-Means Refinement", self, checkable=True)
+        self.quantizeDitherAction = QAction("&Dithering (Floyd-Steinberg)", self, checkable=True)
+        quantizeMenu.addActions([self.kmeansAction, self.quantizeDitherAction])
+
+        # Menu bar: filters
+        self.menuFilters = QMenu("&Filters", self)
+        gaussianMenu = self.menuFilters.addMenu("&Gaussian Blur")
+        for sigma in GAUSSIAN_SIGMAS:
+            gaussianMenu.addAction(QAction("Sigma &%g" % sigma, self, triggered=lambda _, sigma=sigma: self.spatialFilter(
+                "Gaussian Blur: sigma %g" % sigma, gaussianBlur, (sigma,))))
+        boxMenu = self.menuFilters.addMenu("&Box Blur")
+        for radius in BOX_RADII:
+            boxMenu.addAction(QAction("Radius &%d" % radius, self, triggered=lambda _, radius=radius: self.spatialFilter(
+                "Box Blur: radius %d" % radius, boxBlur, (radius,))))
+        unsharpMenu = self.menuFilters.addMenu("&Unsharp Mask")
+        for sigma, amount in UNSHARP_PRESETS:
+            unsharpMenu.addAction(QAction("Sigma &%g, amount %d%%" % (sigma, amount * 100), self,
+                                          triggered=lambda _, sigma=sigma, amount=amount: self.spatialFilter(
+                                              "Unsharp Mask: sigma %g, amount %d%%" % (sigma, amount * 100),
+                                              unsharpMask, (sigma, amount))))
+        medianMenu = self.menuFilters.addMenu("&Median")
+        for radius in MEDIAN_RADII:
+            medianMenu.addAction(QAction("Radius &%d" % radius, self, triggered=lambda _, radius=radius: self.spatialFilter(
+                "Median: radius %d" % radius, medianFilter, (radius,))))
+        self.menuFilters.addAction(QAction("&Sobel Edges", self,
+                                           triggered=lambda: self.spatialFilter("Sobel Edges", sobel, (), True)))
+
+        # Profiler: timing breakdown of the last action in the status bar, all recent ones in a dock panel
+        PROFILER.enable(PROFILE)
+        self.profilerPanel = ProfilerPanel(self)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.profilerPanel)
+        self.profilerPanel.hide()
+        self.timingLabel = QLabel()
+        self.statusBar().addPermanentWidget(self.timingLabel)
+        self.profilerPanel.actionFinished.connect(self.timingLabel.setText)
+        self.menuProfiler = QMenu("&Profiler", self)
+        showPanel = self.profilerPanel.toggleViewAction()
+        showPanel.setText("&Show Panel")
+        showPanel.setShortcut("Ctrl+P")
+        self.menuProfiler.addAction(showPanel)
+        self.menuProfiler.addAction(QAction("&Record Timings", self, checkable=True, checked=PROFILE,
+                                            toggled=PROFILER.enable))
+        self.menuProfiler.addAction(QAction("&Export Chrome Trace ...", self, triggered=self.profilerPanel.exportTrace))
+        self.menuProfiler.addAction(QAction("&Clear", self, triggered=self.profilerPanel.clear))
 
         self.menuBar().addMenu(self.menuCoreOps)
+        self.menuBar().addMenu(self.menuEdit)
         self.menuBar().addMenu(self.menuOptOps)
+        self.menuBar().addMenu(self.menuFilters)
+        self.menuBar().addMenu(self.menuProfiler)
 
         # Image view
-        self.rawImgView = QLabel()
+        self.rawImgView = ImageView()
         layout = QHBoxLayout()
         layout.addWidget(self.rawImgView)
         mainView = QWidget()
@@ -77,172 +175,418 @@ class PSWindow(QMainWindow):
         self.setCentralWidget(mainView)
 
         # Post-processing view (sub window, unique)
-        self.popupView = None
+        self.currentPopup = None
+        # Image data lives in stride-aligned ImageBuffers, xxxData are their arrays used by the kernels
+        self.rawBuffer = self.grayBuffer = None
         self.grayData = None
 
-        # Pixmap caches
-        self.rawPix = None
-        self.grayPix = None
+        # Pyramid caches, shared by the views of the current image
+        self.rawPyramid = None
+        self.grayPyramid = None
+
+        # Processed result cache, shared by all opened images
+        self.cache = ResultCache(CACHE_BUDGET, CACHE_RECENT_FILES)
+        self.imageKey = ""
+
+        # Undo/redo history; the image is edited in place once copied from the decoded file (shared with the cache)
+        self.history = History(HISTORY_BUDGET)
+        self.ownsBuffer = False
+        self.edits = 0 # edited images are keyed by the file hash and an edit number instead of being hashed again
 
+        # Client of a running processing daemon (Daemon.py), core operations run there while connected
+        self.daemon = None
+
+    @pyqtSlot()
+    @profiled(category='action', skipArgs=1)
     def openFile(self):
-        # Reset previous Pixmap caches if present
-        self.rawPix = None
-        self.grayPix = None
         # Open new file
-        fileName, _ = QFileDialog.getOpenFileName(self, 'Open File', '', 'BMP Files (*.bmp)')
-        rawData, (width, height), errMsg = readBMP(fileName)
+        fileName, _ = QFileDialog.getOpenFileName(self, 'Open File', '',
+                                                  'Images (*.bmp *.hph);;BMP Files (*.bmp);;Huffman Files (*.hph)')
+        rawBuffer, (width, height), errMsg, imageKey = self.cache.cachedFile(fileName, readImage)
         if width <= 0 or height <= 0:
             if width < 0 or height < 0:
                 QMessageBox.information(self, "Homebrew Photoshop", errMsg + ": %s"%fileName)
             return
-        # reset processed data
-        if self.grayData is not None:
-            self.grayData = None
-        if self.popupView is not None:
-            self.popupView = None
+        # opening another file can be undone too
+        if self.rawBuffer is not None:
+            QThreadPool.globalInstance().waitForDone()
+            self.history.replace("Open " + os.path.basename(fileName), self.rawData, (self.imageKey, imageKey))
         # show opened file
-        self.rawData = rawData
-        self.width = width
-        self.height = height
-        img = QImage(self.rawData, self.width, self.height, self.width * 3, QImage.Format_RGB888)
-        self.rawPix = QPixmap.fromImage(img)
-        self.rawImgView.setPixmap(self.rawPix)
-        if self.width > 0 and self.height > 0:
-            self.setMinimumSize(max(self.width + 20, DEF_WIDTH), max(self.height + 48, DEF_HEIGHT))
-            self.resize(max(self.width + 20, DEF_WIDTH), max(self.height + 48, DEF_HEIGHT))
-        else:
-            self.setMinimumSize(INIT_WINDOW_WIDTH, INIT_WINDOW_HEIGHT)
+        self.setImage(rawBuffer, imageKey, False)
+        self.statusBar().showMessage(self.cache.stats())
         self.show()
 
+    '''
+    Show another image, owned: whether it may be edited in place
+    '''
+    def setImage(self, buffer: ImageBuffer, imageKey: str, owned: bool):
+        # reset processed data and pyramids of the previous image
+        self.grayBuffer = self.grayData = None
+        self.grayPyramid = None
+        self.popupView = None
+        self.rawBuffer, self.rawData = buffer, buffer.array
+        self.ownsBuffer = owned
+        self.imageKey = imageKey
+        self.width, self.height = buffer.width, buffer.height
+        self.rawPyramid = ImagePyramid(self.rawBuffer)
+        self.rawImgView.setPyramid(self.rawPyramid)
+        self.updateHistoryActions()
+
+    '''
+    Run edit(states) on the image in place, edit records itself in the history and returns the changed rectangles
+    '''
+    def editImage(self, edit):
+        # renders of the levels window may still be reading the image
+        QThreadPool.globalInstance().waitForDone()
+        if not self.ownsBuffer:
+            # copy on first write, the decoded file is shared with the result cache
+            self.rawBuffer = ImageBuffer.fromArray(self.rawData)
+            self.rawData, self.ownsBuffer = self.rawBuffer.array, True
+            self.rawPyramid = ImagePyramid(self.rawBuffer)
+            self.rawImgView.setPyramid(self.rawPyramid, keepView=True)
+        self.edits += 1
+        imageKey = "%s~%d" % (self.imageKey.split('~')[0], self.edits)
+        self.imageChanged(edit((self.imageKey, imageKey)), imageKey)
+
+    def imageChanged(self, rects: [(int, int, int, int)], imageKey: str):
+        self.imageKey = imageKey
+        self.grayBuffer = self.grayData = None
+        self.grayPyramid = None
+        self.popupView = None
+        self.rawPyramid.update(rects)
+        self.rawImgView.update()
+        self.updateHistoryActions()
+
+    def updateHistoryActions(self):
+        self.undoAction.setEnabled(bool(self.history.undoName()))
+        self.undoAction.setText("&Undo " + self.history.undoName())
+        self.redoAction.setEnabled(bool(self.history.redoName()))
+        self.redoAction.setText("&Redo " + self.history.redoName())
+        self.statusBar().showMessage(self.history.stats())
+
+    '''
+    Write a processed result into the image, grayscale results into all channels
+    '''
+    @profiled(category='action', skipArgs=1)
+    def applyResult(self, name: str, buffer: ImageBuffer):
+        self.editImage(lambda states: self.history.applyResult(name, self.rawData, buffer.array, states))
+
+    '''
+    Apply a point-wise operation given by its (3, 256) lookup table, the history keeps the table instead of pixels
+    '''
+    @profiled(category='action', skipArgs=1)
+    def applyLUT(self, name: str, lut: np.ndarray):
+        self.editImage(lambda states: self.history.applyLUT(name, self.rawData, lut, states))
+
+    @pyqtSlot()
+    @profiled(category='action', skipArgs=1)
+    def undo(self):
+        self.stepHistory(self.history.undo, lambda step: step.before)
+
+    @pyqtSlot()
+    @profiled(category='action', skipArgs=1)
+    def redo(self):
+        self.stepHistory(self.history.redo, lambda step: step.after)
+
+    def stepHistory(self, func, state):
+        QThreadPool.globalInstance().waitForDone()
+        if self.rawBuffer is None:
+            return
+        data, rects, step = func(self.rawData)
+        if step is None:
+            return
+        if data is not self.rawData:
+            # replaced image, e.g. another file opened
+            buffer = ImageBuffer.fromArray(data)
+            self.setImage(buffer, state(step), True)
+        else:
+            self.imageChanged(rects, state(step))
+
+    '''
+    Result of func(*args) for the current image, looked up in the result cache by (image, operation, parameters)
+    '''
+    def cached(self, operation: str, parameters: tuple, func, *args):
+        ret = self.cache.cached((self.imageKey, operation, parameters), func, *args)
+        self.statusBar().showMessage(self.cache.stats())
+        return ret
+
+    '''
+    Grayscale of the current image, computed once per image
+    '''
+    def grayscaleData(self) -> np.ndarray:
+        if self.grayData is None:
+            self.grayBuffer = self.cached('grayscale', (), self.process, ('grayscale', {}), cvtGrayscale, self.rawData, 1)
+            self.grayData = self.grayBuffer.array
+            self.grayPyramid = ImagePyramid(self.grayBuffer)
+        return self.grayData
+
+    '''
+    processInto(kernel, data, channels, *args), run by the daemon as remote: (operation, params) while connected
+    The image is sent without a key, edit numbers only identify images within this session
+    '''
+    def process(self, remote: (str, dict), kernel, data: np.ndarray, channels: int = -1, *args) -> ImageBuffer:
+        if self.daemon is not None:
+            ret = newBuffer(data, channels)
+            try:
+                _, _, errMsg = self.daemon.run(remote[0], data, out=ret.array, **remote[1])
+                if not errMsg:
+                    return ret
+            except OSError as e:
+                QMessageBox.information(self, "Homebrew Photoshop", "Processing daemon disconnected: %s" % e)
+                self.daemonAction.setChecked(False)
+        return processInto(kernel, data, channels, *args)
+
+    '''
+    Connect to the processing daemon, or disconnect from it
+    '''
+    def useDaemon(self, enabled: bool):
+        if self.daemon is not None:
+            self.daemon.close()
+            self.daemon = None
+        if enabled:
+            self.daemon, errMsg = connectDaemon()
+            if self.daemon is None:
+                QMessageBox.information(self, "Homebrew Photoshop", errMsg + "\nStart it with: python Daemon.py")
+                self.daemonAction.setChecked(False)
+
+    '''
+    Before/after popup of the current image, views zoom and pan together
+    '''
+    def showComparison(self, title: str, prePyramid: ImagePyramid, postBuffer: ImageBuffer, applyFunc=None,
+                       saveFunc=None):
+        postView = CompareView(prePyramid, ImagePyramid(postBuffer))
+        applyFunc = applyFunc or (lambda: self.applyResult(title, postBuffer))
+        self.popupView = PopupWindow([postView], title, saveData=postBuffer, applyFunc=applyFunc, saveFunc=saveFunc)
+        self.popupView.setMinimumSize(DEF_WIDTH, DEF_HEIGHT)
+        self.popupView.resize(min(self.width * 2 + 40, MAX_POPUP_WIDTH), min(self.height + 48, MAX_POPUP_HEIGHT))
+        self.popupView.show()
+
+    '''
+    Post-processing popup, a replaced popup is closed and deleted at once: signal connections keep popups in
+    reference cycles, which the garbage collector could otherwise free while they are painting
+    '''
+    @property
+    def popupView(self) -> QWidget:
+        return self.currentPopup
+
+    @popupView.setter
+    def popupView(self, popup: QWidget):
+        if self.currentPopup is not None and self.currentPopup is not popup:
+            self.currentPopup.close()
+            self.currentPopup.deleteLater()
+        self.currentPopup = popup
+
     def close(self):
         if self.popupView:
             self.popupView = None
+        self.useDaemon(False)
+        self.profilerPanel.detach()
+        self.history.clear()
         super().close()
 
+    @pyqtSlot()
+    @profiled(category='action', skipArgs=1)
     def grayScale(self):
         if self.width <= 0 or self.height <= 0:
             return
         if self.popupView is not None:
             if self.popupView.windowTitle() == 'Grayscale':
                 return
-        if self.grayData is None:
-            self.grayData = cvtGrayscale(self.rawData)
-        # Grayscale needs to be 32-aligned as per required by Qt API
-        alignedData = cvtAlignedData(self.grayData)
-        if self.rawPix is None:
-            self.rawPix = QPixmap(QImage(self.rawData, self.width, self.height, self.width * 3, QImage.Format_RGB888))
-        if self.grayPix is None:
-            self.grayPix = QPixmap(QImage(alignedData, self.width, self.height, QImage.Format_Grayscale8))
+        self.grayscaleData()
         # Set up popup view
-        preView, postView = QLabel(), QLabel()
-        preView.setPixmap(self.rawPix)
-        postView.setPixmap(self.grayPix)
-        self.popupView = PopupWindow([preView, postView], "Grayscale", vertical=False)
-        self.popupView.setMinimumSize(max(self.width * 2 + 40, DEF_WIDTH), max(self.height + 48, DEF_HEIGHT))
-        self.popupView.resize(max(self.width * 2 + 40, DEF_WIDTH), max(self.height + 48, DEF_HEIGHT))
-        self.popupView.show()
+        self.showComparison("Grayscale", self.rawPyramid, self.grayBuffer)
 
+    @profiled(category='action', skipArgs=1)
     def orderedDithering(self, opt: int = 0, colored: bool = False):
         if self.width <= 0 or self.height <= 0:
             return
-        title = ["Ordered Dithering: 2x2 matrix",
-                 "Ordered Dithering: 4x4 matrix",
-                 "Ordered Dithering: 8x8 matrix"][opt]
+        size = 2 ** (opt + 1)
+        title = "Ordered Dithering: %dx%d matrix" % (size, size)
+        # matrices up to 8x8 have a compiled kernel, larger ones are generated at runtime
+        dither = cvtOrderedDithering if opt <= 2 else lambda data, opt, out: cvtBayerDithering(data, size, out)
         if not colored:
             # Grayscale ordered dithering
-            if self.grayData is None:
-                self.grayData = cvtGrayscale(self.rawData)
-            alignedData = cvtAlignedData(self.grayData)
-            posData = cvtOrderedDithering(alignedData, opt)
-            if self.grayPix is None:
-                self.grayPix = QPixmap(QImage(alignedData, self.width, self.height, QImage.Format_Grayscale8))
-            prePix = self.grayPix
-            postPix = QPixmap(QImage(posData, self.width, self.height, QImage.Format_Grayscale8))
+            posBuffer = self.cached('orderedDithering', (opt, colored), self.process, ('dither', {'size': size}), dither,
+                                    self.grayscaleData(), -1, opt)
+            prePyramid = self.grayPyramid
         else:
             # Colored ordered dithering
-            posData = cvtOrderedDithering(self.rawData, opt)
-            if self.rawPix is None:
-                self.rawPix = QPixmap(QImage(self.rawData, self.width, self.height, self.width * 3, QImage.Format_RGB888))
-            prePix = self.rawPix
-            postPix = QPixmap(QImage(posData, self.width, self.height, self.width * 3, QImage.Format_RGB888))
+            posBuffer = self.cached('orderedDithering', (opt, colored), self.process, ('dither', {'size': size}), dither,
+                                    self.rawData, -1, opt)
+            prePyramid = self.rawPyramid
             title = "Colored " + title
 
         # Set up popup view
-        preView, postView = QLabel(), QLabel()
-        preView.setPixmap(prePix)
-        postView.setPixmap(postPix)
-        self.popupView = PopupWindow([preView, postView], title, vertical=False)
-        self.popupView.setMinimumSize(max(self.width * 2 + 40, DEF_WIDTH), max(self.height + 48, DEF_HEIGHT))
-        self.popupView.resize(max(self.width * 2 + 40, DEF_WIDTH), max(self.height + 48, DEF_HEIGHT))
-        self.popupView.show()
+        self.showComparison(title, prePyramid, posBuffer)
+
+    @profiled(category='action', skipArgs=1)
+    def errorDiffusion(self, method: str, colored: bool = False):
+        if self.width <= 0 or self.height <= 0:
+            return
+        title = ("Colored " if colored else "") + "Error Diffusion: " + method.replace('-', ' ').title()
+        parallel = self.width * self.height > DIFFUSION_PARALLEL_PIXELS
+        remote = ('diffusion', {'method': method, 'parallel': parallel})
+        if not colored:
+            # Grayscale error diffusion
+            posBuffer = self.cached('errorDiffusion', (method, colored), self.process, remote, cvtErrorDiffusion,
+                                    self.grayscaleData(), -1, method, 2, True, parallel)
+            prePyramid = self.grayPyramid
+        else:
+            # Colored error diffusion, each channel to 0 or 255
+            posBuffer = self.cached('errorDiffusion', (method, colored), self.process, remote, cvtErrorDiffusion,
+                                    self.rawData, -1, method, 2, True, parallel)
+            prePyramid = self.rawPyramid
+
+        # Set up popup view
+        self.showComparison(title, prePyramid, posBuffer)
+
+    '''
+    Spatial filter kernel(data, *parameters) of the image, or of its grayscale
+    '''
+    @profiled(category='action', skipArgs=1)
+    def spatialFilter(self, title: str, kernel, parameters: tuple, gray: bool = False):
+        if self.width <= 0 or self.height <= 0:
+            return
+        data, prePyramid = (self.grayscaleData(), self.grayPyramid) if gray else (self.rawData, self.rawPyramid)
+        posBuffer = self.cached(kernel.__name__, parameters + (gray,), processInto, kernel, data, -1, *parameters)
+
+        # Set up popup view
+        self.showComparison(title, prePyramid, posBuffer)
+
+    '''
+    Reduce the image to an adaptive palette of at most colors colours, saved as an 8-bit indexed BMP
+    '''
+    @profiled(category='action', skipArgs=1)
+    def colorQuantization(self, colors: int):
+        if self.width <= 0 or self.height <= 0:
+            return
+        kmeans = QUANTIZE_KMEANS if self.kmeansAction.isChecked() else 0
+        dither = 'floyd-steinberg' if self.quantizeDitherAction.isChecked() else 'none'
+        parameters = (colors, kmeans, dither)
+        indices, palette = self.cached('quantize', parameters, quantize, self.rawData, *parameters)
+        posBuffer = self.cached('quantizeRGB', parameters, processInto, cvtPalette, indices, 3, palette)
+        title = "Color Quantization: %d colors" % len(palette) + (", k-means" if kmeans else "") + \
+                (", dithered" if dither != 'none' else "")
+
+        # Set up popup view
+        self.showComparison(title, self.rawPyramid, posBuffer,
+                            saveFunc=lambda fileName: writeBMP(fileName, indices, palette=palette))
 
     '''
     Autolevel: approaching the effect of the algorithm "Enhance brightness and contrast" in Photoshop
     '''
+    @pyqtSlot()
+    @profiled(category='action', skipArgs=1)
     def autolevel(self):
         if self.width <= 0 or self.height <= 0:
             return
         if self.popupView is not None:
             if self.popupView.windowTitle() == 'Auto Level':
                 return
-        if self.grayData is None:
-            self.grayData = cvtGrayscale(self.rawData)
-        # Normalize grayscale to (0-255)
-        grayData = normalize(self.grayData, (0, 255))
-        flattened = np.sort(grayData[:, :, 0], axis=None)
-        # Cut off lowest and highest values, by 0.1% of total number of values respectively
-        cuttingRate = 0.001
-        low, high = flattened[int(len(flattened) * cuttingRate)], flattened[-(1 + int(len(flattened) * cuttingRate))]
-        # Gamma adjustment determined by median (half of cut range) against 128 (half of 255)
-        med = (flattened[(len(flattened) - 1) // 2] + flattened[len(flattened) // 2]) / 2
-        # Gamma is forced to fall in range (0.01, 9.99)
-        gamma = min(max(np.emath.logn(0.5, max(med - low, 1) / max(high - low, 1)), 0.01), 9.99)
-        # Apply adjustment on RGB channels respectively
-        leveledData = self.rawData
-        for channel in range(3):
-            leveledData = colorAdjustment(leveledData, channel, inSlider=(low, gamma, high))
-        # Set up popup view
-        rawView, postView = QLabel(), QLabel()
-        if self.rawPix is None:
-            self.rawPix = QPixmap(QImage(self.rawData, self.width, self.height, self.width * 3, QImage.Format_RGB888))
-        rawView.setPixmap(self.rawPix)
-        postView.setPixmap((QPixmap(QImage(leveledData, self.width, self.height, self.width * 3, QImage.Format_RGB888))))
-        self.popupView = PopupWindow([rawView, postView], "Auto Level", vertical=False)
-        self.popupView.setMinimumSize(max(self.width * 2 + 40, DEF_WIDTH), max(self.height + 48, DEF_HEIGHT))
-        self.popupView.resize(max(self.width * 2 + 40, DEF_WIDTH), max(self.height + 48, DEF_HEIGHT))
-        self.popupView.show()
+        leveledBuffer = self.cached('autolevel', (), processInto, lambda data, gray, out: autolevel(data, gray, out)[0],
+                                    self.rawData, -1, self.grayscaleData())
+        # Set up popup view, applied as a lookup table
+        self.showComparison("Auto Level", self.rawPyramid, leveledBuffer, lambda: self.applyLUT("Auto Level", np.stack(
+            [levelsLUT(autolevelParameters(histogram(self.grayscaleData())[0]), (0, 255))] * 3)))
 
+    @pyqtSlot()
+    @profiled(category='action', skipArgs=1)
     def huffman(self):
         if self.width <= 0 or self.height <= 0:
             return
         if self.popupView is not None:
             if self.popupView.windowTitle() == 'Huffman':
                 return
-        if self.grayData is None:
-            self.grayData = cvtGrayscale(self.rawData)
         # text of entropy and Huffman code length
-        hist = histogram(self.grayData)
-        entropy = calEntropy(hist)[0, 0]
-        avgLength = calHuffman(hist[0])
+        hist = self.cached('histogram', (), histogram, self.grayscaleData())
+        entropy, avgLength = self.cached('huffman', (), lambda: (calEntropy(hist)[0, 0], calHuffman(hist[0])))
         # Set up popup view
+        saveButton = QPushButton("Save Compressed ...")
+        saveButton.clicked.connect(self.saveCompressed)
         self.popupView = PopupWindow([QLabel("Entropy (bps): <b>%.3f</b>" % entropy),
-                                      QLabel("Average Huffman Code Length (bps): <b>%.3f</b>" % avgLength)],
+                                      QLabel("Average Huffman Code Length (bps): <b>%.3f</b>" % avgLength),
+                                      saveButton],
                                      "Huffman")
         self.popupView.setMinimumSize(DEF_WIDTH, DEF_HEIGHT)
         self.popupView.show()
 
+    @pyqtSlot()
+    @profiled(category='action', skipArgs=1)
+    def saveCompressed(self):
+        fileName, _ = QFileDialog.getSaveFileName(self, 'Save File', '', 'Huffman Files (*.hph)')
+        if not fileName:
+            return
+        errMsg = saveHuffman(fileName, self.rawData)
+        if errMsg:
+            QMessageBox.information(self, "Homebrew Photoshop", errMsg + ": %s" % fileName)
+
+    @pyqtSlot()
+    @profiled(category='action', skipArgs=1)
     def levelAdjustment(self):
         if self.width <= 0 or self.height <= 0:
             return
         if self.popupView is not None:
             if self.popupView.windowTitle() == 'Color Adjustment':
                 return
-        self.popupView = LevelAdjWindow(self.rawData)
+        self.popupView = LevelAdjWindow(self.rawBuffer,
+                                        applyFunc=lambda parameters: self.applyLUT("Color Adjustment",
+                                                                                   buildLevelsLUT(*parameters)))
         self.popupView.show()
 
 
+'''
+Read a BMP or Huffman compressed (.hph) image as RGB data, decoded straight into an ImageBuffer
+'''
+def readImage(fileName: str) -> (ImageBuffer, (int, int), str):
+    if not fileName.lower().endswith('.hph'):
+        rows, size, errMsg, palette = mapBMP(fileName)
+        if rows is None:
+            return None, size, errMsg
+        ret = ImageBuffer(*size)
+        cvtBMPRows(rows, palette, ret.array)
+        return ret, size, ""
+    data, size, errMsg = loadHuffman(fileName)
+    if data is None:
+        return None, size, errMsg
+    ret = ImageBuffer(*size)
+    # grayscale data is broadcast to the 3 channels
+    ret.array[...] = data
+    return ret, size, ""
+
+'''
+Run kernel(data, *args, out=...) writing into a new ImageBuffer of the size of data
+channels of the result default to those of data, 1 gives a Grayscale8 buffer and 3 an RGB888 one
+'''
+def processInto(kernel, data: np.ndarray, channels: int = -1, *args) -> ImageBuffer:
+    ret = newBuffer(data, channels)
+    kernel(data, *args, out=ret.array)
+    return ret
+
+'''
+Empty buffer of the size of data, with its channels unless given
+'''
+def newBuffer(data: np.ndarray, channels: int = -1) -> ImageBuffer:
+    channels = data.shape[2] if channels < 0 else channels
+    return ImageBuffer(data.shape[1], data.shape[0], QImage.Format_Grayscale8 if channels == 1 else QImage.Format_RGB888)
+
+'''
+Ask for a file name and write an image buffer as BMP, or call saveFunc(fileName) -> errMsg instead if given
+'''
+def saveBMP(parent: QWidget, buffer: ImageBuffer, saveFunc=None):
+    fileName, _ = QFileDialog.getSaveFileName(parent, 'Save File', '', 'BMP Files (*.bmp)')
+    if not fileName:
+        return
+    errMsg = (saveFunc or buffer.save)(fileName)
+    if errMsg:
+        QMessageBox.information(parent, "Homebrew Photoshop", errMsg + ": %s" % fileName)
+
 class PopupWindow(QWidget):
-    def __init__(self, widgetList: [QWidget], type: str, vertical: bool = True):
+    '''
+    applyFunc, if given, writes the result into the image; it is queued, as it closes this window
+    saveFunc(fileName) -> errMsg, if given, saves the result instead of writing saveData, e.g. as an indexed BMP
+    '''
+    def __init__(self, widgetList: [QWidget], type: str, vertical: bool = True, saveData: ImageBuffer = None,
+                 applyFunc=None, saveFunc=None):
         # Window init
         super().__init__()
         self.setWindowTitle(type)
@@ -251,8 +595,47 @@ class PopupWindow(QWidget):
         layout = QVBoxLayout() if vertical else QHBoxLayout()
         for wid in widgetList:
             layout.addWidget(wid)
+        # Save action for processed data, if any
+        self.saveData, self.saveFunc = saveData, saveFunc
+        if saveData is not None:
+            self.addAction(QAction("&Save ...", self, shortcut="Ctrl+S", triggered=self.save))
+            saveButton = QPushButton("Save ...")
+            saveButton.clicked.connect(self.save)
+            buttons = QHBoxLayout()
+            buttons.addStretch()
+            if applyFunc is not None:
+                applyButton = QPushButton("Apply")
+                applyButton.clicked.connect(lambda: applyFunc(), Qt.QueuedConnection)
+                buttons.addWidget(applyButton)
+            buttons.addWidget(saveButton)
+            outerLayout = QVBoxLayout()
+            outerLayout.addLayout(layout)
+            outerLayout.addLayout(buttons)
+            layout = outerLayout
         self.setLayout(layout)
 
+    @pyqtSlot()
+    @profiled(category='action', skipArgs=1)
+    def save(self):
+        saveBMP(self, self.saveData, self.saveFunc)
+
+class RenderJob(QRunnable):
+    class Signals(QObject):
+        rendered = pyqtSignal(object, bool)
+
+    def __init__(self, pipeline: Pipeline, node: Node, preview: bool):
+        super().__init__()
+        self.pipeline, self.node, self.preview = pipeline, node, preview
+        self.signals = self.Signals()
+
+    def run(self):
+        # rendered into RGB32, the format Qt draws without conversion
+        with PROFILER.span("render levels", 'render', "preview" if self.preview else "full resolution"):
+            height, width = self.pipeline.size()
+            ret = ImageBuffer(width, height, QImage.Format_RGB32)
+            self.pipeline.evaluate(self.node, ret.array)
+        self.signals.rendered.emit(ret, self.preview)
+
 class LevelAdjWindow(QWidget):
 
     class CustomSlider(QLabeledDoubleSlider):
@@ -278,15 +661,33 @@ class LevelAdjWindow(QWidget):
         def connect(self, *args):
             super().valueChanged.connect(*args)
 
-    def __init__(self, data: np.ndarray):
+    '''
+    applyFunc(parameters), if given, applies the adjustment to the image; it is queued, as it closes this window
+    '''
+    def __init__(self, buffer: ImageBuffer, fastPreview: bool = True, applyFunc=None):
         super().__init__()
         self.setWindowTitle('Color Adjustment')
         self.setWindowIcon(QIcon(ICON))
-        self.rawData = data
-        # Image view
-        pix = QPixmap(QImage(self.rawData, data.shape[1], data.shape[0], data.shape[1] * 3, QImage.Format_RGB888))
-        self.imgView = QLabel()
-        self.imgView.setPixmap(pix)
+        self.rawData = data = buffer.array
+        # Downscaled proxy rendered while sliders are being dragged, None if the image is small enough
+        step = -(-max(data.shape[0], data.shape[1]) // PREVIEW_SIZE)
+        self.previewData = np.ascontiguousarray(data[:: step, :: step]) if fastPreview and step > 1 else None
+        # Edits go to a levels node of the full resolution and proxy graphs; a node is only edited while no job renders it
+        self.pipelines = {False: Pipeline(self.rawData)}
+        if self.previewData is not None:
+            self.pipelines[True] = Pipeline(self.previewData)
+        self.levelsNodes = {preview: pipeline.add(Levels(*LEVELS_IDENTITY)) for preview, pipeline in self.pipelines.items()}
+        # Render requests run one at a time on the thread pool; only the latest pending request is kept
+        self.pendingJob = None
+        self.rendering = False
+        self.fullResTimer = QTimer(self)
+        self.fullResTimer.setSingleShot(True)
+        self.fullResTimer.setInterval(PREVIEW_DELAY)
+        self.fullResTimer.timeout.connect(lambda: self.requestRender(False))
+        # Image view, the proxy is shown at the size of the full image so that zoom and pan are kept
+        self.previewSampling = step
+        self.imgView = ImageView(ImagePyramid(buffer))
+        self.imgView.setMinimumSize(min(data.shape[1], PREVIEW_SIZE), min(data.shape[0], PREVIEW_SIZE))
 
         # Adjustment parameters: [[gamma], [in Level], [out Level]]
         # gamma: [all, R, G, B]
@@ -315,6 +716,10 @@ class LevelAdjWindow(QWidget):
                 slider.setTracking(True)
                 self.sliders[-1].append(slider)
 
+        # Live histogram and statistics of the adjusted image, derived from the histogram of the full resolution image
+        self.histView = HistogramView(histogram(self.rawData))
+        self.statsLabel = QLabel()
+
         # Tab control view
         self.tabViews = []
         tabNames = ['All Channels', 'Red', 'Green', 'Blue']
@@ -329,35 +734,91 @@ class LevelAdjWindow(QWidget):
             tabView.setLayout(tabLayout)
             tabView.setFixedSize(300, 300)
             tabViews.addTab(tabView, tabNames[channel])
+        # the histogram shows the channel of the selected tab, or all of them
+        tabViews.currentChanged.connect(lambda index: self.histView.setChannel(index - 1 if index > 0 else None))
+
+        # Save action for the adjusted image
+        self.addAction(QAction("&Save ...", self, shortcut="Ctrl+S", triggered=self.save))
+        saveButton = QPushButton("Save ...")
+        saveButton.clicked.connect(self.save)
+        buttons = QHBoxLayout()
+        buttons.addStretch()
+        if applyFunc is not None:
+            applyButton = QPushButton("Apply")
+            applyButton.clicked.connect(lambda: applyFunc([list(values) for values in self.parameters]),
+                                        Qt.QueuedConnection)
+            buttons.addWidget(applyButton)
+        buttons.addWidget(saveButton)
 
         # Set up popup view
+        controlLayout = QVBoxLayout()
+        controlLayout.addWidget(self.histView)
+        controlLayout.addWidget(self.statsLabel)
+        controlLayout.addWidget(tabViews)
+        controlLayout.addLayout(buttons)
         layout = QHBoxLayout()
         layout.addWidget(self.imgView)
-        layout.addWidget(tabViews)
+        layout.addLayout(controlLayout)
         self.setLayout(layout)
+        self.updateStats()
 
 
     # All-in-one handler for sliders
     def sliderChanged(self, data):
         channel, sliderId = self.sender().channel, self.sender().sliderId
         self.parameters[sliderId][channel] = data
-        if channel == 0:
-            for channelId in range(1, 4):
-                self.sliders[channelId][sliderId].setValue(data)
-        else:
-            self.updateImage()
+        self.updateImage()
 
     def updateImage(self):
-        data = self.rawData
-        for channel in range(1, 4):
-            data = colorAdjustment(data,
-                                   channel - 1,
-                                   (self.parameters[1][channel][0],
-                                    self.parameters[0][channel],
-                                    self.parameters[1][channel][1]),
-                                   (self.parameters[2][channel][0],
-                                    self.parameters[2][channel][1])
-                                   )
-        pix = QPixmap(QImage(data, data.shape[1], data.shape[0], data.shape[1] * 3, QImage.Format_RGB888))
-        self.imgView.setPixmap(pix)
+        self.updateStats()
+        if self.previewData is not None:
+            self.requestRender(True)
+            self.fullResTimer.start()
+        else:
+            self.requestRender(False)
+
+    def updateStats(self):
+        stats = self.histView.setLUT(buildLevelsLUT(*self.parameters))
+        cells = lambda values: "".join("<td align=right>&nbsp;%.3f</td>" % value for value in values)
+        self.statsLabel.setText("<table><tr><td></td>" + "".join("<td align=right><b>%s</b></td>" % name
+                                                               for name in CHANNEL_NAMES) + "</tr>" +
+                                "<tr><td>Entropy (bps)</td>" + cells(entropy for entropy, _ in stats) + "</tr>" +
+                                "<tr><td>Huffman (bps)</td>" + cells(length for _, length in stats) + "</tr></table>")
+
+    def requestRender(self, preview: bool):
+        # Master and per-channel settings are combined into one lookup table, applied in a single pass
+        self.pendingJob = (Levels(*[list(values) for values in self.parameters]), preview)
+        if not self.rendering:
+            self.startRender()
+
+    def startRender(self):
+        levels, preview = self.pendingJob
+        self.pendingJob = None
+        self.rendering = True
+        self.levelsNodes[preview].edit(levels)
+        job = RenderJob(self.pipelines[preview], self.levelsNodes[preview], preview)
+        job.signals.rendered.connect(self.renderFinished)
+        QThreadPool.globalInstance().start(job)
+
+    def renderFinished(self, buffer: ImageBuffer, preview: bool):
+        self.rendering = False
+        self.imgView.setPyramid(ImagePyramid(buffer, self.previewSampling if preview else 1), keepView=True)
+        # Requests that arrived meanwhile were coalesced into the latest one
+        if self.pendingJob is not None:
+            self.startRender()
+
+    @pyqtSlot()
+    @profiled(category='action', skipArgs=1)
+    def save(self):
+        # Always save at full resolution, regardless of the preview currently shown
+        # A node of its own, since the full resolution node may be rendering
+        pipeline = self.pipelines[False]
+        node = pipeline.add(Levels(*[list(values) for values in self.parameters]))
+        saveBMP(self, processInto(lambda data, out: pipeline.evaluate(node, out), self.rawData))
+        pipeline.remove(node)
+
+    def closeEvent(self, event):
+        self.fullResTimer.stop()
+        self.pendingJob = None
+        super().closeEvent(event)
 
@@ -0,0 +1,394 @@
+'''
+Non-destructive editing: an image is a graph of operation nodes evaluated lazily, on demand
+Runs of point-wise operations between materialized nodes are fused into one compiled pass, with consecutive lookup
+tables composed into one; statistics (autolevel, normalize, huffman) are histograms of the fused pass, so that they
+need no intermediate image either
+Results are cached only where they have to be materialized: at branch points (nodes with several children) and at
+outputs of area operations (error diffusion); editing a node invalidates itself and its descendants only
+'''
+from abc import ABC, abstractmethod
+import numpy as np
+from numba import njit, prange
+
+from Utils import HIST_BANDS, bayerMatrix, levelsLUT, buildLevelsLUT, normalizeLUT, autolevelParameters
+from Utils import calEntropy, calHuffman, cvtErrorDiffusion
+from Profiler import profiled
+
+# Step codes of a fused program
+STEP_LUT = 0 # per-channel lookup table
+STEP_GRAY = 1 # RGB to grayscale, same rounding as cvtGrayscale
+STEP_THRESHOLD = 2 # ordered dithering against a tiled threshold matrix
+
+'''
+Run the steps of a program on one pixel, v holding channels values (1 or 3)
+'''
+@njit(nogil=True, cache=True, inline='always')
+def runSteps(v0: int, v1: int, v2: int, channels: int, i: int, j: int, codes: np.ndarray, luts: np.ndarray,
+             thresholds: np.ndarray, sizes: np.ndarray) -> (int, int, int, int):
+    for step in range(codes.shape[0]):
+        if codes[step] == STEP_LUT:
+            v0 = luts[step, 0, v0]
+            if channels == 3:
+                v1, v2 = luts[step, 1, v1], luts[step, 2, v2]
+        elif codes[step] == STEP_GRAY:
+            # (299 r + 587 g + 114 b) / 1000, rounding halves up
+            v0 = (299 * v0 + 587 * v1 + 114 * v2 + 500) // 1000
+            channels = 1
+        else:
+            threshold = thresholds[step, i % sizes[step], j % sizes[step]]
+            v0 = 255 if v0 > threshold else 0
+            if channels == 3:
+                v1, v2 = 255 if v1 > threshold else 0, 255 if v2 > threshold else 0
+    return v0, v1, v2, channels
+
+@njit(parallel=True, nogil=True, cache=True)
+def runProgram(data: np.ndarray, codes: np.ndarray, luts: np.ndarray, thresholds: np.ndarray, sizes: np.ndarray,
+               out: np.ndarray) -> np.ndarray:
+    for i in prange(data.shape[0]):
+        for j in range(data.shape[1]):
+            v0 = np.int64(data[i, j, 0])
+            v1, v2 = (np.int64(data[i, j, 1]), np.int64(data[i, j, 2])) if data.shape[2] == 3 else (v0, v0)
+            v0, v1, v2, channels = runSteps(v0, v1, v2, data.shape[2], i, j, codes, luts, thresholds, sizes)
+            out[i, j, 0] = v0
+            if out.shape[2] == 3:
+                out[i, j, 1], out[i, j, 2] = v1, v2
+    return out
+
+'''
+Histogram of the output of a program without materializing it, of its grayscale if gray is set
+'''
+@njit(parallel=True, nogil=True, cache=True)
+def programHistogram(data: np.ndarray, codes: np.ndarray, luts: np.ndarray, thresholds: np.ndarray,
+                     sizes: np.ndarray, channels: int, gray: bool) -> np.ndarray:
+    outChannels = 1 if gray else channels
+    bands = min(HIST_BANDS, max(data.shape[0], 1))
+    partial = np.zeros((bands, outChannels, 256), dtype=np.uint32)
+    for band in prange(bands):
+        for i in range(band * data.shape[0] // bands, (band + 1) * data.shape[0] // bands):
+            for j in range(data.shape[1]):
+                v0 = np.int64(data[i, j, 0])
+                v1, v2 = (np.int64(data[i, j, 1]), np.int64(data[i, j, 2])) if data.shape[2] == 3 else (v0, v0)
+                v0, v1, v2, c = runSteps(v0, v1, v2, data.shape[2], i, j, codes, luts, thresholds, sizes)
+                if gray and c == 3:
+                    v0 = (299 * v0 + 587 * v1 + 114 * v2 + 500) // 1000
+                partial[band, 0, v0] += 1
+                if outChannels == 3:
+                    partial[band, 1, v1] += 1
+                    partial[band, 2, v2] += 1
+    ret = np.zeros((outChannels, 256), dtype=np.uint32)
+    for band in range(bands):
+        ret += partial[band]
+    return ret
+
+class Program:
+    '''
+    Fused point-wise steps applied to data with a given number of channels
+    '''
+    def __init__(self, channels: int):
+        self.inChannels = self.channels = channels
+        self.steps = [] # (code, lookup table or threshold matrix)
+
+    def lut(self, lut: np.ndarray):
+        # lut has one row per channel, or one row for all of them; consecutive tables are composed
+        lut = np.broadcast_to(lut.reshape(-1, 256), (3, 256))
+        if self.steps and self.steps[-1][0] == STEP_LUT:
+            previous = self.steps[-1][1]
+            lut = np.stack([lut[k][previous[k]] for k in range(3)])
+            self.steps.pop()
+        self.steps.append((STEP_LUT, np.ascontiguousarray(lut)))
+
+    def gray(self):
+        if self.channels == 3:
+            self.steps.append((STEP_GRAY, None))
+            self.channels = 1
+
+    def threshold(self, matrix: np.ndarray):
+        self.steps.append((STEP_THRESHOLD, matrix))
+
+    '''
+    Arrays of the steps passed to the compiled kernels: codes, tables, threshold matrices and their sizes
+    '''
+    def arrays(self) -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray):
+        size = max([matrix.shape[0] for code, matrix in self.steps if code == STEP_THRESHOLD] + [1])
+        codes = np.array([code for code, _ in self.steps], dtype=np.int64)
+        luts = np.zeros((len(self.steps), 3, 256), dtype=np.uint8)
+        thresholds = np.zeros((len(self.steps), size, size), dtype=np.int64)
+        sizes = np.ones(len(self.steps), dtype=np.int64)
+        for step, (code, table) in enumerate(self.steps):
+            if code == STEP_LUT:
+                luts[step] = table
+            elif code == STEP_THRESHOLD:
+                thresholds[step, : table.shape[0], : table.shape[0]] = table
+                sizes[step] = table.shape[0]
+        return codes, luts, thresholds, sizes
+
+    @profiled('Program.run', skipArgs=1)
+    def run(self, data: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        if out is None:
+            out = np.empty((data.shape[0], data.shape[1], self.channels), dtype=np.uint8)
+        return runProgram(data, *self.arrays(), out)
+
+    @profiled('Program.histogram', skipArgs=1)
+    def histogram(self, data: np.ndarray, gray: bool = False) -> np.ndarray:
+        return programHistogram(data, *self.arrays(), self.channels, gray)
+
+class Operation(ABC):
+    '''
+    Operations that are not point-wise compute a full image from their materialized input
+    '''
+    pointWise = False
+    histogram = None
+
+    def __init__(self, **parameters):
+        self.parameters = parameters
+
+    @abstractmethod
+    def apply(self, data: np.ndarray) -> np.ndarray:
+        pass
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ", ".join("%s=%r" % item for item in self.parameters.items()))
+
+class PointOperation(Operation):
+    '''
+    Point-wise operations append steps to a program, statistics operations first get the histogram of their input
+    (of its grayscale if histogram is 'gray')
+    '''
+    pointWise = True
+
+    '''
+    Append the steps of the operation to program, returns collected statistics
+    '''
+    @abstractmethod
+    def append(self, program: Program, hist: np.ndarray = None) -> dict:
+        pass
+
+    '''
+    The operation alone as a program over data
+    '''
+    def apply(self, data: np.ndarray) -> np.ndarray:
+        program = Program(data.shape[2])
+        self.append(program, program.histogram(data, self.histogram == 'gray') if self.histogram else None)
+        return program.run(data)
+
+class Grayscale(PointOperation):
+    def append(self, program: Program, hist: np.ndarray = None) -> dict:
+        program.gray()
+        return {}
+
+class Levels(PointOperation):
+    '''
+    gammas, inLevels, outLevels laid out as [all, R, G, B] like buildLevelsLUT, grayscale data gets the master only
+    '''
+    def __init__(self, gammas: [float], inLevels: [(int, int)], outLevels: [(int, int)]):
+        super().__init__(gammas=gammas, inLevels=inLevels, outLevels=outLevels)
+
+    def append(self, program: Program, hist: np.ndarray = None) -> dict:
+        gammas, inLevels, outLevels = self.parameters['gammas'], self.parameters['inLevels'], self.parameters['outLevels']
+        if program.channels == 3:
+            program.lut(buildLevelsLUT(gammas, inLevels, outLevels))
+        else:
+            program.lut(levelsLUT((int(inLevels[0][0]), float(gammas[0]), int(inLevels[0][1])),
+                                  (int(outLevels[0][0]), int(outLevels[0][1]))))
+        return {}
+
+class Dither(PointOperation):
+    '''
+    Ordered dithering with a size x size Bayer matrix, same rule as cvtOrderedDithering
+    '''
+    def __init__(self, size: int = 8):
+        super().__init__(size=size)
+
+    def append(self, program: Program, hist: np.ndarray = None) -> dict:
+        size = self.parameters['size']
+        program.threshold(bayerMatrix(size) * 255 // (size * size - 1))
+        return {}
+
+class Autolevel(PointOperation):
+    histogram = 'gray'
+
+    def append(self, program: Program, hist: np.ndarray = None) -> dict:
+        low, gamma, high = autolevelParameters(hist[0])
+        program.lut(levelsLUT((low, gamma, high), (0, 255)))
+        return {'low': low, 'gamma': gamma, 'high': high}
+
+class Normalize(PointOperation):
+    histogram = 'channels'
+
+    def __init__(self, targetRange: (int, int) = (0, 255)):
+        super().__init__(targetRange=targetRange)
+
+    def append(self, program: Program, hist: np.ndarray = None) -> dict:
+        luts = []
+        for channel in range(hist.shape[0]):
+            values = np.flatnonzero(hist[channel])
+            if values.size == 0:
+                # empty image, left unchanged
+                luts.append(np.arange(256, dtype=np.uint8))
+            else:
+                luts.append(normalizeLUT(int(values[0]), int(values[-1]), self.parameters['targetRange']))
+        program.lut(np.stack(luts))
+        return {}
+
+class Huffman(PointOperation):
+    '''
+    Entropy and average Huffman code length of the grayscale input, data passes through unchanged
+    '''
+    histogram = 'gray'
+
+    def append(self, program: Program, hist: np.ndarray = None) -> dict:
+        return {'entropy': float(calEntropy(hist)[0, 0]), 'huffman': float(calHuffman(hist[0]))}
+
+class ErrorDiffusion(Operation):
+    def __init__(self, method: str = 'floyd-steinberg', levels: int = 2, serpentine: bool = True,
+                 parallel: bool = False):
+        super().__init__(method=method, levels=levels, serpentine=serpentine, parallel=parallel)
+
+    def apply(self, data: np.ndarray) -> np.ndarray:
+        return cvtErrorDiffusion(data, **self.parameters)
+
+class Node:
+    def __init__(self, operation: Operation = None, parent = None):
+        self.operation, self.parent = operation, parent
+        self.children = []
+        self.version = 0
+        # statistics collected by the operation at the last evaluation
+        self.stats = {}
+        # (revision, result) of a materialized node, (revision, program, stats) of a statistics node
+        self.cache = self.statsCache = None
+
+    '''
+    Replace the operation (e.g. with new parameters), results of this node and its descendants become stale
+    '''
+    def edit(self, operation: Operation):
+        self.operation = operation
+        self.version += 1
+
+    '''
+    Identifies the state of the chain up to this node, changes when this node or an ancestor is edited
+    '''
+    def revision(self) -> tuple:
+        return (id(self), self.version, self.parent.revision() if self.parent is not None else None)
+
+    def isMaterialized(self) -> bool:
+        return self.parent is None or len(self.children) > 1 or not self.operation.pointWise
+
+class Pipeline:
+    def __init__(self, data: np.ndarray):
+        self.root = Node()
+        self.root.cache = (self.root.revision(), data)
+
+    '''
+    (height, width) of the source image, which every operation keeps
+    '''
+    def size(self) -> (int, int):
+        return self.root.cache[1].shape[0: 2]
+
+    def setSource(self, data: np.ndarray):
+        self.root.version += 1
+        self.root.cache = (self.root.revision(), data)
+
+    def add(self, operation: Operation, parent: Node = None) -> Node:
+        parent = self.root if parent is None else parent
+        node = Node(operation, parent)
+        parent.children.append(node)
+        return node
+
+    '''
+    Add a chain of operations below parent, returns the last node
+    '''
+    def chain(self, operations: [Operation], parent: Node = None) -> Node:
+        node = self.root if parent is None else parent
+        for operation in operations:
+            node = self.add(operation, node)
+        return node
+
+    def remove(self, node: Node):
+        # a node that stops being a branch point drops its cached result
+        assert not node.children, str.format("Only leaf nodes can be removed")
+        node.parent.children.remove(node)
+        if node.parent.parent is not None and not node.parent.isMaterialized():
+            node.parent.cache = None
+
+    '''
+    Output of node, written into out if given, e.g. into the storage of an ImageBuffer
+    '''
+    @profiled('Pipeline.evaluate', skipArgs=1)
+    def evaluate(self, node: Node, out: np.ndarray = None) -> np.ndarray:
+        if node.cache is not None and node.cache[0] == node.revision():
+            if out is None:
+                return node.cache[1]
+            np.copyto(out, node.cache[1])
+            return out
+        if node.operation.pointWise:
+            ret = self.runFused(node, out)
+        else:
+            ret = node.operation.apply(self.evaluate(node.parent))
+            if out is not None:
+                np.copyto(out, ret)
+        node.cache = (node.revision(), ret) if node.isMaterialized() else None
+        return ret
+
+    '''
+    Statistics of every node of the chain ending at node, evaluating statistics nodes if needed
+    '''
+    def stats(self, node: Node) -> dict:
+        if node.parent is not None:
+            self.program(node)
+        ret = {}
+        chain = []
+        while node is not None:
+            chain.append(node)
+            node = node.parent
+        for node in reversed(chain):
+            ret.update(node.stats)
+        return ret
+
+    '''
+    Fused program of the point-wise nodes from the nearest materialized ancestor down to node
+    Returns (input data, program)
+    '''
+    def program(self, node: Node) -> (np.ndarray, Program):
+        chain = [node]
+        while not chain[-1].parent.isMaterialized():
+            chain.append(chain[-1].parent)
+        chain.reverse()
+        if not node.operation.pointWise:
+            # nothing to fuse above an area operation
+            chain = []
+            data = self.evaluate(node)
+        else:
+            data = self.evaluate(chain[0].parent)
+        program = Program(data.shape[2])
+        for link in chain:
+            if link.operation.histogram is None:
+                link.stats = link.operation.append(program)
+                continue
+            # statistics depend only on the chain above, so they are kept until it changes
+            revision = link.revision()
+            if link.statsCache is None or link.statsCache[0] != revision:
+                hist = program.histogram(data, gray=link.operation.histogram == 'gray')
+                stats = link.operation.append(program, hist)
+                link.statsCache = (revision, list(program.steps), program.channels, stats)
+            else:
+                program.steps, program.channels = list(link.statsCache[1]), link.statsCache[2]
+            link.stats = link.statsCache[3]
+        return data, program
+
+    def runFused(self, node: Node, out: np.ndarray = None) -> np.ndarray:
+        data, program = self.program(node)
+        if not program.steps and out is None:
+            # nothing to do, e.g. a chain of statistics only
+            return data
+        return program.run(data, out)
+
+'''
+Compile the program kernels for the layouts used by Batch and the GUI, see Utils.warmUp
+'''
+def warmUp():
+    rgbData = np.zeros((4, 4, 3), dtype=np.uint8)
+    pipeline = Pipeline(rgbData)
+    node = pipeline.chain([Levels([1.0] * 4, [(0, 255)] * 4, [(0, 255)] * 4), Autolevel(), Grayscale(), Dither(2)])
+    pipeline.evaluate(node)
+    # the GUI renders into strided rows of ImageBuffers
+    pipeline.evaluate(pipeline.root.children[0], np.zeros((4, 16), dtype=np.uint8)[:, : 12].reshape(4, 4, 3))
@@ -0,0 +1,246 @@
+'''
+Instrumentation of kernel calls and GUI actions: wall time, CPU time, peak memory and numba compile time per call
+Spans nest (an action contains the kernels it calls), finished top level spans are passed to listeners with their
+children, and a session can be exported as a Chrome trace (chrome://tracing or https://ui.perfetto.dev)
+'''
+import os
+import json
+import time
+import threading
+import functools
+from collections import deque
+from numba.core import event
+
+MAX_RECORDS = 50000 # spans kept for the trace export, oldest dropped first
+PROC_STATUS = '/proc/self/status'
+PROC_CLEAR_REFS = '/proc/self/clear_refs'
+
+class Span:
+    __slots__ = ('name', 'category', 'detail', 'thread', 'start', 'wall', 'cpu', 'jit', 'peak', 'baseMemory',
+                 'children')
+
+    def __init__(self, name: str, category: str, detail: str = ""):
+        self.name, self.category, self.detail = name, category, detail
+        self.thread = threading.get_ident()
+        self.start = self.wall = self.cpu = self.jit = 0.0
+        self.peak = self.baseMemory = 0 # bytes of resident memory, peak while the span was open and at its start
+        self.children = []
+
+    '''
+    Peak resident memory above the start of the span, 0 where /proc is not available
+    '''
+    @property
+    def peakMemory(self) -> int:
+        return max(0, self.peak - self.baseMemory)
+
+    def summary(self) -> str:
+        ret = "%s: %.1f ms, CPU %.1f ms" % (self.name, self.wall * 1e3, self.cpu * 1e3)
+        if self.jit > 0:
+            ret += ", JIT %.1f ms" % (self.jit * 1e3)
+        if self.peakMemory > 0:
+            ret += ", peak +%.1f MB" % (self.peakMemory / 2 ** 20)
+        return ret
+
+    def __repr__(self):
+        return "Span(%s)" % self.summary()
+
+class CompileListener(event.Listener):
+    '''
+    Adds numba compile time to the open spans of the compiling thread, nested compilations are counted once
+    '''
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.local = threading.local()
+
+    def on_start(self, ev):
+        depth = getattr(self.local, 'depth', 0)
+        if depth == 0:
+            self.local.start = time.perf_counter()
+        self.local.depth = depth + 1
+
+    def on_end(self, ev):
+        self.local.depth -= 1
+        if self.local.depth == 0:
+            dispatcher = ev.data['dispatcher']
+            self.profiler.compiled(getattr(dispatcher, '__name__', str(dispatcher)), ev.data['args'], self.local.start)
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.epoch = time.perf_counter()
+        self.records = deque(maxlen=MAX_RECORDS)
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # spans open on any thread, memory peaks are process-wide
+        self.open = set()
+        self.compileListener = None
+        self.peakMemory = os.path.exists(PROC_CLEAR_REFS)
+
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+        if enabled and self.compileListener is None:
+            self.compileListener = CompileListener(self)
+            event.register("numba:compile", self.compileListener)
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+
+    def stack(self) -> list:
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    '''
+    Resident memory (VmRSS) and its peak since the last reset (VmHWM), in bytes
+    '''
+    def memory(self) -> (int, int):
+        rss = hwm = 0
+        with open(PROC_STATUS) as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith('VmHWM:'):
+                    hwm = int(line.split()[1]) * 1024
+        return rss, hwm
+
+    '''
+    Fold the peak since the last reset into every open span, then reset it so that the next span starts from here
+    '''
+    def samplePeak(self, reset: bool) -> int:
+        rss, hwm = self.memory()
+        for span in self.open:
+            span.peak = max(span.peak, hwm)
+        if reset:
+            try:
+                with open(PROC_CLEAR_REFS, 'w') as clearRefs:
+                    clearRefs.write('5')
+            except OSError:
+                self.peakMemory = False
+        return rss
+
+    def begin(self, span: Span):
+        self.stack().append(span)
+        if self.peakMemory:
+            with self.lock:
+                span.baseMemory = span.peak = self.samplePeak(reset=True)
+                self.open.add(span)
+        span.cpu = time.process_time()
+        span.start = time.perf_counter()
+
+    def end(self, span: Span):
+        span.wall = time.perf_counter() - span.start
+        # process time: parallel kernels run on numba worker threads
+        span.cpu = time.process_time() - span.cpu
+        stack = self.stack()
+        stack.pop()
+        with self.lock:
+            if self.peakMemory:
+                self.samplePeak(reset=False)
+                self.open.discard(span)
+            self.records.append(span)
+        if stack:
+            stack[-1].children.append(span)
+        else:
+            for listener in self.listeners:
+                listener(span)
+
+    def compiled(self, name: str, args: tuple, start: float):
+        if not self.enabled:
+            return
+        duration = time.perf_counter() - start
+        span = Span(name, 'jit', "(%s)" % ", ".join(str(arg) for arg in args))
+        span.start, span.wall = start, duration
+        stack = self.stack()
+        for parent in stack:
+            parent.jit += duration
+        with self.lock:
+            self.records.append(span)
+        if stack:
+            stack[-1].children.append(span)
+
+    '''
+    Context manager recording the enclosed block, a no-op while the profiler is disabled
+    '''
+    def span(self, name: str, category: str = 'kernel', detail: str = ""):
+        return SpanContext(self, name, category, detail)
+
+    '''
+    Chrome trace event format: complete ("X") events in microseconds, statistics in args
+    '''
+    def trace(self) -> dict:
+        with self.lock:
+            records = list(self.records)
+        threads = {}
+        events = []
+        for span in records:
+            tid = threads.setdefault(span.thread, len(threads))
+            args = {'cpu_ms': round(span.cpu * 1e3, 3), 'jit_ms': round(span.jit * 1e3, 3),
+                    'peak_mb': round(span.peakMemory / 2 ** 20, 3)}
+            if span.detail:
+                args['detail'] = span.detail
+            events.append({'name': span.name, 'cat': span.category, 'ph': 'X', 'pid': os.getpid(), 'tid': tid,
+                           'ts': round((span.start - self.epoch) * 1e6, 3), 'dur': round(span.wall * 1e6, 3),
+                           'args': args})
+        events.sort(key=lambda e: e['ts'])
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def exportTrace(self, fileName: str) -> str:
+        try:
+            with open(fileName, 'w') as file:
+                json.dump(self.trace(), file)
+        except OSError as e:
+            return "Cannot write file: %s" % e.strerror
+        return ""
+
+class SpanContext:
+    __slots__ = ('profiler', 'span')
+
+    def __init__(self, profiler: Profiler, name: str, category: str, detail: str):
+        self.profiler = profiler
+        self.span = Span(name, category, detail) if profiler.enabled else None
+
+    def __enter__(self) -> Span:
+        if self.span is not None:
+            self.profiler.begin(self.span)
+        return self.span
+
+    def __exit__(self, *exc):
+        if self.span is not None:
+            self.profiler.end(self.span)
+        return False
+
+# Profiler of the process, shared by all modules
+PROFILER = Profiler()
+
+'''
+Describe call arguments for the trace, arrays by shape and dtype
+'''
+def describeArgs(args: tuple) -> str:
+    ret = []
+    for arg in args:
+        if hasattr(arg, 'shape') and hasattr(arg, 'dtype'):
+            ret.append("%s%s" % (arg.dtype, list(arg.shape)))
+        elif isinstance(arg, (int, float, str, bool)) and len(str(arg)) <= 32:
+            ret.append(repr(arg))
+        else:
+            ret.append(type(arg).__name__)
+    return ", ".join(ret)
+
+'''
+Decorator recording every call of a function, name defaults to the function name
+Also wraps numba dispatchers, as long as they are only called from Python
+'''
+def profiled(name: str = None, category: str = 'kernel', skipArgs: int = 0):
+    def decorator(func):
+        spanName = name or getattr(func, '__name__', str(func))
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return func(*args, **kwargs)
+            with PROFILER.span(spanName, category, describeArgs(args[skipArgs:])):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,89 @@
+'''
+Dockable profiler panel: timing breakdown of the recent actions and renders, one row per span with its kernels below
+'''
+from PyQt5.QtWidgets import QDockWidget, QWidget, QTreeWidget, QTreeWidgetItem, QPushButton, QHBoxLayout, QVBoxLayout
+from PyQt5.QtWidgets import QFileDialog, QMessageBox
+from PyQt5.QtCore import Qt, pyqtSignal
+
+from Profiler import PROFILER, Span
+
+PANEL_CATEGORIES = ('action', 'render') # top level spans listed, paint spans go to the trace only
+PANEL_ROWS = 100 # top level spans kept in the panel
+COLUMNS = ["Span", "Wall ms", "CPU ms", "JIT ms", "Peak MB", "Arguments"]
+
+class ProfilerPanel(QDockWidget):
+    # finished top level spans, emitted from the thread that ran them and handled on the GUI thread
+    spanFinished = pyqtSignal(object)
+    actionFinished = pyqtSignal(str)
+
+    def __init__(self, parent: QWidget = None):
+        super().__init__("Profiler", parent)
+        self.tree = QTreeWidget()
+        self.tree.setColumnCount(len(COLUMNS))
+        self.tree.setHeaderLabels(COLUMNS)
+        self.tree.setColumnWidth(0, 220)
+        exportButton = QPushButton("Export Trace ...")
+        exportButton.clicked.connect(self.exportTrace)
+        clearButton = QPushButton("Clear")
+        clearButton.clicked.connect(self.clear)
+        buttons = QHBoxLayout()
+        buttons.addWidget(exportButton)
+        buttons.addWidget(clearButton)
+        buttons.addStretch()
+        layout = QVBoxLayout()
+        layout.addWidget(self.tree)
+        layout.addLayout(buttons)
+        widget = QWidget()
+        widget.setLayout(layout)
+        self.setWidget(widget)
+        self.spanFinished.connect(self.addSpan, Qt.QueuedConnection)
+        self.listener = self.spanFinished.emit
+        PROFILER.listeners.append(self.listener)
+
+    def addSpan(self, span: Span):
+        if span.category not in PANEL_CATEGORIES:
+            return
+        self.tree.insertTopLevelItem(0, spanItem(span))
+        while self.tree.topLevelItemCount() > PANEL_ROWS:
+            self.tree.takeTopLevelItem(self.tree.topLevelItemCount() - 1)
+        if span.category == 'action':
+            self.actionFinished.emit(breakdown(span))
+
+    def clear(self):
+        self.tree.clear()
+        PROFILER.clear()
+
+    def exportTrace(self):
+        fileName, _ = QFileDialog.getSaveFileName(self, 'Export Trace', 'trace.json', 'Chrome Trace Files (*.json)')
+        if not fileName:
+            return
+        errMsg = PROFILER.exportTrace(fileName)
+        if errMsg:
+            QMessageBox.information(self, "Homebrew Photoshop", errMsg + ": %s" % fileName)
+
+    '''
+    Stop listening to the profiler, spans finishing after the panel is deleted would have no receiver
+    '''
+    def detach(self):
+        if self.listener in PROFILER.listeners:
+            PROFILER.listeners.remove(self.listener)
+
+def spanItem(span: Span) -> QTreeWidgetItem:
+    item = QTreeWidgetItem([span.name, "%.1f" % (span.wall * 1e3), "%.1f" % (span.cpu * 1e3),
+                            "%.1f" % (span.jit * 1e3) if span.jit > 0 else "",
+                            "%.1f" % (span.peakMemory / 2 ** 20) if span.peakMemory > 0 else "", span.detail])
+    for column in range(1, 5):
+        item.setTextAlignment(column, Qt.AlignRight | Qt.AlignVCenter)
+    for child in span.children:
+        item.addChild(spanItem(child))
+    return item
+
+'''
+One line summary of a span and its slowest direct children, for the status bar
+'''
+def breakdown(span: Span, children: int = 3) -> str:
+    slowest = sorted(span.children, key=lambda child: child.wall, reverse=True)[: children]
+    ret = span.summary()
+    if slowest:
+        ret += " | " + ", ".join("%s %.1f ms" % (child.name, child.wall * 1e3) for child in slowest)
+    return ret
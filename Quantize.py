@@ -0,0 +1,267 @@
+'''
+Colour quantization: adaptive palettes of up to 256 colours and 8-bit indexed images
+Palettes come from median cut on a 3-D colour histogram (32 levels per channel), optionally refined by k-means on
+the histogram bins, so that both cost O(histogram bins) instead of O(pixels)
+Pixels are mapped to palette indices through an inverse colour map, a table holding the nearest palette colour of
+every 4x4x4 cell of the RGB cube, optionally with ordered or error diffusion dithering
+'''
+import numpy as np
+import numba
+from numba import njit, prange
+
+from Utils import bayerMatrix, DIFFUSION_KERNELS, DIFFUSION_PAD
+from Profiler import profiled
+
+HIST_BITS = 5 # bits per channel of the colour histogram median cut splits
+MAP_BITS = 6 # bits per channel of the inverse colour map, 64^3 cells
+MAX_COLORS = 256
+KMEANS_TOLERANCE = 0.5 # k-means stops once no palette colour moves further than this
+ORDERED_SIZE = 8 # Bayer matrix of ordered dithering
+DITHER_METHODS = ['none', 'ordered'] + list(DIFFUSION_KERNELS)
+
+'''
+Pixel counts and per-channel sums of the colours of RGB data falling into each (side, side, side) histogram bin
+'''
+@profiled()
+def colorHistogram(data: np.ndarray, bits: int = HIST_BITS) -> (np.ndarray, np.ndarray):
+    side = 1 << bits
+    # one partial histogram per thread, reduced at the end
+    bands = max(1, min(numba.get_num_threads(), data.shape[0]))
+    counts = np.zeros((bands, side, side, side), dtype=np.int64)
+    sums = np.zeros((bands, side, side, side, 3), dtype=np.int64)
+    colorHistogramInto(data, 8 - bits, counts, sums)
+    return counts.sum(axis=0), sums.sum(axis=0)
+
+@njit(parallel=True, cache=True)
+def colorHistogramInto(data: np.ndarray, shift: int, counts: np.ndarray, sums: np.ndarray):
+    bands = counts.shape[0]
+    for band in prange(bands):
+        for i in range(band * data.shape[0] // bands, (band + 1) * data.shape[0] // bands):
+            for j in range(data.shape[1]):
+                r, g, b = data[i, j, 0], data[i, j, 1], data[i, j, 2]
+                x, y, z = r >> shift, g >> shift, b >> shift
+                counts[band, x, y, z] += 1
+                sums[band, x, y, z, 0] += r
+                sums[band, x, y, z, 1] += g
+                sums[band, x, y, z, 2] += b
+
+'''
+Smallest box, as (low, high) bin ranges per channel, holding all the non-empty bins of box
+'''
+def shrinkBox(counts: np.ndarray, box: tuple) -> tuple:
+    inside = counts[box[0][0]: box[0][1], box[1][0]: box[1][1], box[2][0]: box[2][1]] > 0
+    ret = []
+    for axis in range(3):
+        occupied = np.flatnonzero(inside.any(axis=tuple(other for other in range(3) if other != axis)))
+        ret.append((box[axis][0] + occupied[0], box[axis][0] + occupied[-1] + 1))
+    return tuple(ret)
+
+def boxSlices(box: tuple) -> tuple:
+    return tuple(slice(low, high) for low, high in box)
+
+'''
+Median cut: the box with the largest pixel count times squared longest side is split across that side at the
+median pixel, until there are colors boxes or no box spans more than one bin
+Returns the (n, 3) mean colours of the boxes, n <= colors
+'''
+def medianCut(counts: np.ndarray, sums: np.ndarray, colors: int) -> np.ndarray:
+    if not counts.any():
+        return np.zeros((1, 3))
+    boxes = [shrinkBox(counts, ((0, counts.shape[0]),) * 3)]
+    boxCounts = [int(counts.sum())]
+    while len(boxes) < colors:
+        scores = [count * max(high - low for low, high in box) ** 2 if any(high - low > 1 for low, high in box) else -1
+                  for box, count in zip(boxes, boxCounts)]
+        n = int(np.argmax(scores))
+        if scores[n] < 0:
+            break
+        box = boxes[n]
+        axis = int(np.argmax([high - low for low, high in box]))
+        other = tuple(a for a in range(3) if a != axis)
+        cumulative = np.cumsum(counts[boxSlices(box)].sum(axis=other))
+        # first plane past the median, keeping at least one plane on each side
+        cut = min(max(int(np.searchsorted(cumulative, cumulative[-1] / 2)) + 1, 1), len(cumulative) - 1)
+        low, high = list(box), list(box)
+        low[axis], high[axis] = (box[axis][0], box[axis][0] + cut), (box[axis][0] + cut, box[axis][1])
+        boxes[n: n + 1] = [shrinkBox(counts, tuple(low)), shrinkBox(counts, tuple(high))]
+        boxCounts[n: n + 1] = [int(cumulative[cut - 1]), int(cumulative[-1] - cumulative[cut - 1])]
+    return np.array([sums[boxSlices(box)].sum(axis=(0, 1, 2)) / count for box, count in zip(boxes, boxCounts)])
+
+'''
+Index of the nearest palette colour of each point, in squared RGB distance
+Palette colours are scanned in red order outwards from the point, stopping once the red distance alone is too far
+'''
+@njit(parallel=True, cache=True)
+def nearestColors(points: np.ndarray, palette: np.ndarray) -> np.ndarray:
+    order = np.argsort(palette[:, 0])
+    reds = palette[order, 0]
+    ret = np.zeros(points.shape[0], dtype=np.int64)
+    for p in prange(points.shape[0]):
+        start = np.searchsorted(reds, points[p, 0])
+        best, down, up = np.inf, start - 1, start
+        while down >= 0 or up < reds.shape[0]:
+            # the closer in red of the next colours below and above
+            if up >= reds.shape[0] or (down >= 0 and points[p, 0] - reds[down] < reds[up] - points[p, 0]):
+                n, down = down, down - 1
+            else:
+                n, up = up, up + 1
+            diff = points[p, 0] - reds[n]
+            if diff * diff >= best:
+                break
+            c = order[n]
+            d = 0.0
+            for k in range(3):
+                diff = points[p, k] - palette[c, k]
+                d += diff * diff
+            if d < best:
+                best, ret[p] = d, c
+    return ret
+
+'''
+Weighted k-means (Lloyd) on the mean colours of the non-empty histogram bins, starting from palette
+'''
+def kmeansRefine(counts: np.ndarray, sums: np.ndarray, palette: np.ndarray, iterations: int) -> np.ndarray:
+    occupied = counts > 0
+    weights = counts[occupied].astype(np.float64)
+    points = sums[occupied] / weights[:, None]
+    centers = palette.astype(np.float64)
+    for _ in range(iterations):
+        nearest = nearestColors(points, centers)
+        totals = np.bincount(nearest, weights, minlength=centers.shape[0])
+        means = np.stack([np.bincount(nearest, weights * points[:, k], minlength=centers.shape[0])
+                          for k in range(3)], axis=1)
+        # colours left without points keep their place
+        moved = centers.copy()
+        moved[totals > 0] = means[totals > 0] / totals[totals > 0, None]
+        shift = np.abs(moved - centers).max()
+        centers = moved
+        if shift < KMEANS_TOLERANCE:
+            break
+    return centers
+
+'''
+Adaptive (n, 3) uint8 palette of RGB data, n <= colors, kmeans: refinement iterations
+'''
+@profiled()
+def buildPalette(data: np.ndarray, colors: int = MAX_COLORS, kmeans: int = 0) -> np.ndarray:
+    assert 1 <= colors <= MAX_COLORS, str.format("Palette size must be 1 to {}", MAX_COLORS)
+    counts, sums = colorHistogram(data)
+    palette = medianCut(counts, sums, colors)
+    if kmeans > 0:
+        palette = kmeansRefine(counts, sums, palette, kmeans)
+    return np.clip(np.floor(palette + 0.5), 0, 255).astype(np.uint8)
+
+'''
+Inverse colour map: (side, side, side) table of the nearest palette index of each cell center of the RGB cube
+'''
+@profiled()
+def inverseColorMap(palette: np.ndarray, bits: int = MAP_BITS) -> np.ndarray:
+    side = 1 << bits
+    centers = (np.arange(side) + 0.5) * (256 / side) - 0.5
+    cells = np.stack(np.meshgrid(centers, centers, centers, indexing='ij'), axis=-1).reshape(-1, 3)
+    return nearestColors(cells, palette.astype(np.float64)).astype(np.uint8).reshape(side, side, side)
+
+@njit(parallel=True, cache=True)
+def remapInto(data: np.ndarray, table: np.ndarray, shift: int, ret: np.ndarray) -> np.ndarray:
+    for i in prange(data.shape[0]):
+        for j in range(data.shape[1]):
+            ret[i, j, 0] = table[data[i, j, 0] >> shift, data[i, j, 1] >> shift, data[i, j, 2] >> shift]
+    return ret
+
+'''
+Ordered dithering: a Bayer offset, scaled to the palette spacing, is added to every pixel before the lookup
+'''
+@njit(parallel=True, cache=True)
+def remapOrderedInto(data: np.ndarray, table: np.ndarray, shift: int, offsets: np.ndarray,
+                     ret: np.ndarray) -> np.ndarray:
+    size = offsets.shape[0]
+    for i in prange(data.shape[0]):
+        for j in range(data.shape[1]):
+            offset = offsets[i % size, j % size]
+            r = min(255, max(0, int(data[i, j, 0] + offset)))
+            g = min(255, max(0, int(data[i, j, 1] + offset)))
+            b = min(255, max(0, int(data[i, j, 2] + offset)))
+            ret[i, j, 0] = table[r >> shift, g >> shift, b >> shift]
+    return ret
+
+'''
+Error diffusion to a palette, same scanning and error ring buffer as Utils.errorDiffusion
+The error of a pixel is its value (with accumulated error) minus its palette colour, per channel
+'''
+@njit(nogil=True, cache=True)
+def remapDiffusionInto(data: np.ndarray, table: np.ndarray, shift: int, palette: np.ndarray, kernel: np.ndarray,
+                       divisor: int, serpentine: bool, ret: np.ndarray) -> np.ndarray:
+    height, width = data.shape[0], data.shape[1]
+    depth = 1 + np.max(kernel[:, 0])
+    weights = (kernel[:, 2] / divisor).astype(np.float32)
+    err = np.zeros((depth, width + 2 * DIFFUSION_PAD, 3), dtype=np.float32)
+    rows = np.zeros(kernel.shape[0], dtype=np.int64)
+    dxs = np.zeros(kernel.shape[0], dtype=np.int64)
+    value = np.zeros(3, dtype=np.float32)
+    for i in range(height):
+        reverse = serpentine and i % 2 == 1
+        row = i % depth
+        for t in range(kernel.shape[0]):
+            rows[t] = (i + kernel[t, 0]) % depth
+            dxs[t] = DIFFUSION_PAD + (-kernel[t, 1] if reverse else kernel[t, 1])
+        for step in range(width):
+            j = width - 1 - step if reverse else step
+            for k in range(3):
+                value[k] = data[i, j, k] + err[row, j + DIFFUSION_PAD, k]
+            index = table[int(min(max(value[0], 0.0), 255.0)) >> shift, int(min(max(value[1], 0.0), 255.0)) >> shift,
+                          int(min(max(value[2], 0.0), 255.0)) >> shift]
+            ret[i, j, 0] = index
+            for k in range(3):
+                e = value[k] - palette[index, k]
+                for t in range(kernel.shape[0]):
+                    err[rows[t], j + dxs[t], k] += e * weights[t]
+        err[row] = 0.0
+    return ret
+
+'''
+Palette indices of RGB data as (height, width, 1) uint8, dither: one of DITHER_METHODS
+'''
+@profiled()
+def cvtQuantize(data: np.ndarray, palette: np.ndarray, dither: str = 'none', out: np.ndarray = None) -> np.ndarray:
+    assert dither in DITHER_METHODS, str.format("Unknown dithering method: {}", dither)
+    table = inverseColorMap(palette)
+    shift = 8 - MAP_BITS
+    out = np.empty((data.shape[0], data.shape[1], 1), dtype=np.uint8) if out is None else out
+    if dither == 'none':
+        return remapInto(data, table, shift, out)
+    if dither == 'ordered':
+        # offsets span about the distance between neighbouring palette colours
+        spread = 255 / palette.shape[0] ** (1 / 3)
+        offsets = ((bayerMatrix(ORDERED_SIZE) + 0.5) / ORDERED_SIZE ** 2 - 0.5) * spread
+        return remapOrderedInto(data, table, shift, offsets.astype(np.float32), out)
+    kernel, divisor = DIFFUSION_KERNELS[dither]
+    return remapDiffusionInto(data, table, shift, palette.astype(np.float32), kernel, divisor, True, out)
+
+'''
+RGB data of palette indices, written into out if given
+'''
+@profiled()
+def cvtPalette(indices: np.ndarray, palette: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    converted = palette[indices[:, :, 0]]
+    if out is None:
+        return converted
+    np.copyto(out, converted)
+    return out
+
+'''
+Reduce RGB data to at most colors colours, returns ((height, width, 1) palette indices, (n, 3) palette)
+'''
+def quantize(data: np.ndarray, colors: int = MAX_COLORS, kmeans: int = 0,
+             dither: str = 'none') -> (np.ndarray, np.ndarray):
+    palette = buildPalette(data, colors, kmeans)
+    return cvtQuantize(data, palette, dither), palette
+
+'''
+Compile the quantization kernels, for contiguous arrays and the strided rows of ImageBuffers, see Utils.warmUp
+'''
+def warmUp():
+    rgbData = np.zeros((4, 4, 3), dtype=np.uint8)
+    alignedRGB = np.zeros((4, 16), dtype=np.uint8)[:, : 12].reshape(4, 4, 3)
+    for data in (rgbData, alignedRGB):
+        for dither in ('none', 'ordered', 'floyd-steinberg'):
+            quantize(data, 4, 1, dither)
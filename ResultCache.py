@@ -0,0 +1,119 @@
+'''
+LRU cache of processed results keyed by (image content hash, operation, parameters), bounded by a memory budget
+Cached arrays are shared with callers and must not be modified in place
+'''
+import os
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+DEF_BUDGET = 512 * 2 ** 20 # bytes
+DEF_RECENT_FILES = 3 # decoded images kept warm
+
+'''
+Content hash of image data, used as the image part of cache keys
+'''
+def imageHash(data: np.ndarray) -> str:
+    data = np.asarray(data)
+    if data.flags.c_contiguous:
+        return hashlib.blake2b(data, digest_size=16).hexdigest() + str(data.shape)
+    # strided rows, e.g. of an ImageBuffer, are hashed one by one instead of copying the image
+    digest = hashlib.blake2b(digest_size=16)
+    for row in data:
+        digest.update(np.ascontiguousarray(row))
+    return digest.hexdigest() + str(data.shape)
+
+'''
+Approximate memory held by a cached value
+'''
+def sizeOf(value) -> int:
+    if hasattr(value, 'nbytes'):
+        # arrays and image buffers
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return 64 + sum(sizeOf(item) for item in value)
+    return 64
+
+class ResultCache:
+    def __init__(self, budget: int = DEF_BUDGET, recentFiles: int = DEF_RECENT_FILES):
+        self.budget, self.used = budget, 0
+        self.recentFiles = recentFiles
+        self.entries = OrderedDict() # key: (value, size)
+        self.files = OrderedDict() # file keys of decoded images, oldest first
+        self.hits = self.misses = 0
+
+    def get(self, key, default=None):
+        if key not in self.entries:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key][0]
+
+    def put(self, key, value):
+        self.discard(key)
+        size = sizeOf(value)
+        # values larger than the whole budget are never cached
+        if size > self.budget:
+            return
+        self.entries[key] = (value, size)
+        self.used += size
+        self.evict()
+
+    def discard(self, key):
+        if key in self.entries:
+            self.used -= self.entries.pop(key)[1]
+        self.files.pop(key, None)
+
+    def evict(self):
+        while self.used > self.budget and self.entries:
+            key, (_, size) = self.entries.popitem(last=False)
+            self.used -= size
+            self.files.pop(key, None)
+
+    def setBudget(self, budget: int):
+        self.budget = budget
+        self.evict()
+
+    def clear(self):
+        self.entries.clear()
+        self.files.clear()
+        self.used = 0
+
+    '''
+    Return the cached result of func(*args) under key, computing and caching it on a miss
+    '''
+    def cached(self, key, func, *args):
+        value = self.get(key, self)
+        if value is self:
+            value = func(*args)
+            self.put(key, value)
+        return value
+
+    '''
+    Return (data, (width, height), errMsg, hash) of a file decoded by reader, keeping the last recentFiles images warm
+    A file is identified by its path, size and modification time
+    '''
+    def cachedFile(self, fileName: str, reader) -> (np.ndarray, (int, int), str, str):
+        try:
+            stat = os.stat(fileName)
+            key = ('file', os.path.abspath(fileName), stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            key = None
+        entry = self.get(key) if key is not None and self.recentFiles > 0 else None
+        if entry is not None:
+            self.files.move_to_end(key)
+            return entry
+        data, size, errMsg = reader(fileName)
+        entry = (data, size, errMsg, imageHash(data) if data is not None else "")
+        if data is not None and key is not None and self.recentFiles > 0:
+            self.put(key, entry)
+            if key in self.entries:
+                self.files[key] = None
+            while len(self.files) > self.recentFiles:
+                self.discard(next(iter(self.files)))
+        return entry
+
+    def stats(self) -> str:
+        return "Cache: %d hits, %d misses, %.1f / %.1f MB" % (self.hits, self.misses, self.used / 2 ** 20,
+                                                              self.budget / 2 ** 20)
@@ -0,0 +1,122 @@
+'''
+Out-of-core processing: streams row bands of a memory-mapped BMP through the point-wise kernels
+and writes output bands incrementally, so that peak memory is bounded by the band size instead of the image size
+Operations that need whole-image statistics (autolevel, normalize, huffman) get a separate statistics pass
+'''
+import numpy as np
+
+from Utils import mapBMP, cvtBMPRows, cvtRowsBMP, bmpHeader, cvtGrayscale, cvtOrderedDithering
+from Utils import histogram, calEntropy, calHuffman, levelsLUT, normalizeLUT, applyLUT, autolevelParameters
+
+# Rows per band, kept a multiple of 8 so that every band starts on a period of the ordered dithering matrices
+DEF_BAND_ROWS = 256
+DITHERING = {'2': 0, '4': 1, '8': 2}
+POINT_OPERATIONS = ['grayscale'] + ['dither' + size for size in DITHERING] + ['colordither' + size for size in DITHERING]
+STATS_OPERATIONS = ['autolevel', 'normalize', 'huffman']
+
+'''
+Point-wise stage of an operation, mapping a band to a band
+'''
+def pointStage(operation: str):
+    if operation == 'grayscale':
+        return lambda band: cvtGrayscale(band) if band.shape[2] == 3 else band
+    if operation.startswith('dither'):
+        # same as the Ordered Dithering menu: grayscale first
+        ditType = DITHERING[operation[len('dither'):]]
+        return lambda band: cvtOrderedDithering(cvtGrayscale(band) if band.shape[2] == 3 else band, ditType)
+    if operation.startswith('colordither'):
+        ditType = DITHERING[operation[len('colordither'):]]
+        return lambda band: cvtOrderedDithering(band, ditType)
+    raise ValueError("Unknown operation: %s" % operation)
+
+'''
+Lookup table stage, applying a (channels, 256) table to every band
+'''
+def lutStage(lut: np.ndarray):
+    return lambda band: applyLUT(band, lut if lut.shape[0] == band.shape[2] else np.stack([lut[0]] * band.shape[2]))
+
+class TiledImage:
+    def __init__(self, fileName: str, bandRows: int = DEF_BAND_ROWS):
+        self.rows, (self.width, self.height), self.errMsg, self.palette = mapBMP(fileName)
+        self.bandRows = max(8, bandRows // 8 * 8)
+        self.stages = []
+
+    '''
+    Yield (first row, processed band) for every band, running the stages added so far
+    '''
+    def bands(self):
+        for top in range(0, self.height, self.bandRows):
+            band = cvtBMPRows(self.rows[top: top + self.bandRows], self.palette)
+            for stage in self.stages:
+                band = stage(band)
+            yield top, band
+
+    '''
+    Statistics pass: histogram of the processed image accumulated band by band
+    '''
+    def histogram(self, gray: bool) -> np.ndarray:
+        ret = None
+        for _, band in self.bands():
+            hist = histogram(cvtGrayscale(band) if gray and band.shape[2] == 3 else band).astype(np.int64)
+            ret = hist if ret is None else ret + hist
+        return ret
+
+    '''
+    Append an operation to the chain, running a statistics pass first if it needs one
+    Returns statistics collected by the operation
+    '''
+    def addOperation(self, operation: str) -> dict:
+        stats = {}
+        if operation == 'autolevel':
+            stats['low'], stats['gamma'], stats['high'] = autolevelParameters(self.histogram(gray=True)[0])
+            lut = levelsLUT((stats['low'], stats['gamma'], stats['high']), (0, 255))
+            self.stages.append(lutStage(lut[None, :]))
+        elif operation == 'normalize':
+            hist = self.histogram(gray=False)
+            luts = []
+            for channel in range(hist.shape[0]):
+                values = np.flatnonzero(hist[channel])
+                luts.append(normalizeLUT(int(values[0]), int(values[-1]), (0, 255)))
+            self.stages.append(lutStage(np.stack(luts)))
+        elif operation == 'huffman':
+            hist = self.histogram(gray=True)
+            stats['entropy'] = float(calEntropy(hist)[0, 0])
+            stats['huffman'] = float(calHuffman(hist[0]))
+        else:
+            self.stages.append(pointStage(operation))
+        return stats
+
+    '''
+    Output pass: write processed bands at their place in a bottom-up BMP as they are produced
+    Returns an error message, empty on success
+    '''
+    def write(self, fileName: str) -> str:
+        try:
+            with open(fileName, 'wb') as file:
+                pixelOffset = stride = 0
+                for top, band in self.bands():
+                    if not pixelOffset:
+                        header = bmpHeader(self.width, self.height, band.shape[2])
+                        pixelOffset, stride = len(header), (self.width * band.shape[2] + 3) // 4 * 4
+                        file.write(header)
+                        file.truncate(pixelOffset + stride * self.height)
+                    # rows of a band are stored from the bottom of the band up, ending at image row top
+                    file.seek(pixelOffset + (self.height - top - band.shape[0]) * stride)
+                    file.write(cvtRowsBMP(band))
+        except IOError:
+            return str.format("Cannot write file")
+        return ""
+
+'''
+Run an operation chain over a BMP of any size with bounded memory, writing the result to outFile if given
+Returns collected statistics and an error message, empty on success
+'''
+def processTiled(inFile: str, outFile: str, operations: [str], bandRows: int = DEF_BAND_ROWS) -> (dict, str):
+    image = TiledImage(inFile, bandRows)
+    if image.rows is None:
+        return {}, image.errMsg
+    stats = {'width': image.width, 'height': image.height}
+    for operation in operations:
+        stats.update(image.addOperation(operation))
+    errMsg = image.write(outFile) if outFile else ""
+    return stats, errMsg
@@ -1,8 +1,10 @@
-import os
+import struct
 import numpy as np
-from numba import njit
-from collections import defaultdict
-from heapq import heappush, heappop
+import numba
+from numba import njit, prange
+from heapq import heapify, heappush, heappop
+
+from Profiler import profiled
 
 # Const ordered dithering matrices
 # To use decorator numba.njit, matrices must be hard-coded separately
@@ -17,43 +19,98 @@ mat8 = np.asarray([[ 0, 32,  8, 40,  2, 34, 10, 42],
                    [15, 47,  7, 39, 13, 45,  5, 37],
                    [63, 31, 55, 23, 61, 29, 53, 21]])
 
-def readBMP(fileName: str) -> (np.ndarray, (int, int), str):
-    # read file and check validity
+# Number of threads used by parallel kernels, defaults to all cores (or NUMBA_NUM_THREADS)
+threadCount = numba.config.NUMBA_NUM_THREADS
+# Number of row bands (partial histograms) histogram splits its input into
+HIST_BANDS = 64
+
+'''
+Select the number of threads used by parallel kernels, 0 for all cores
+Numba keeps this setting per thread, so worker threads call setThreads() without argument to pick it up
+'''
+def setThreads(count: int = None):
+    global threadCount
+    if count is not None:
+        threadCount = min(count, numba.config.NUMBA_NUM_THREADS) if count > 0 else numba.config.NUMBA_NUM_THREADS
+    numba.set_num_threads(threadCount)
+
+'''
+Parse BMP file header and DIB header (BITMAPINFOHEADER)
+Returns (pixel data offset, width, height, bits per pixel, top-down flag, RGB palette for 8-bit files)
+'''
+def readBMPHeader(buffer) -> (int, int, int, int, bool, np.ndarray):
+    assert len(buffer) >= 54 and bytes(buffer[0: 2]) == b'BM', str.format("Not a BMP file")
+    fileSize, pixelOffset, dibSize = struct.unpack_from('<I4xII', buffer, 2)
+    width, height, _, bpp, compression = struct.unpack_from('<iiHHI', buffer, 18)
+    assert fileSize > 0 and width > 0 and height != 0 and bpp > 0, str.format("BMP file not valid")
+    assert bpp in (8, 24, 32), str.format("Unsupported BMP bit depth")
+    # BI_RGB, or BI_BITFIELDS with default BGRX masks for 32-bit files
+    assert compression == 0 or (compression == 3 and bpp == 32), str.format("Compressed BMP not supported")
+    palette = None
+    if bpp == 8:
+        numColors = struct.unpack_from('<I', buffer, 46)[0] or 256
+        assert numColors <= 256 and 14 + dibSize + numColors * 4 <= pixelOffset, str.format("BMP file not valid")
+        # palette entries are stored as BGRX, padded to 256 entries so that any index is safe
+        palette = np.zeros((256, 3), dtype=np.uint8)
+        entries = np.frombuffer(buffer, dtype=np.uint8, count=numColors * 4, offset=14 + dibSize)
+        palette[0: numColors] = entries.reshape(numColors, 4)[:, 2:: -1]
+    return pixelOffset, width, abs(height), bpp, height < 0, palette
+
+'''
+Memory-map a BMP file and view its pixel rows without copying
+Returned view has shape (height, width, bytes per pixel) in top-down order, holding raw BGR(X) or palette indices
+'''
+@profiled()
+def mapBMP(fileName: str) -> (np.ndarray, (int, int), str, np.ndarray):
     try:
-        file = open(fileName, 'rb')
-    except IOError:
-        return None, (0, 0), str.format("File not found")
+        buffer = np.memmap(fileName, dtype=np.uint8, mode='r')
+    except (IOError, ValueError):
+        return None, (0, 0), str.format("File not found"), None
     try:
-        bmpMarker = file.read(2)
-        fileSize = int.from_bytes(file.read(4), "little")
-        file.seek(12, os.SEEK_CUR)
-        width = int.from_bytes(file.read(4), "little")
-        height = int.from_bytes(file.read(4), "little")
-        file.seek(2, os.SEEK_CUR)
-        channel = int.from_bytes(file.read(2), "little")
-        assert bmpMarker == b'BM', str.format("Not a BMP file")
-        assert fileSize > 0 and width > 0 and height > 0 and channel > 0, str.format("BMP file not valid")
+        pixelOffset, width, height, bpp, topDown, palette = readBMPHeader(buffer)
+        # every row is padded to a multiple of 4 bytes
+        stride = (width * bpp + 31) // 32 * 4
+        assert pixelOffset + stride * (height - 1) + width * bpp // 8 <= len(buffer), str.format("BMP file not valid")
     except AssertionError as e:
-        return None, (-1, -1), str(e)
-    # read pixel data
-    file.seek(24, os.SEEK_CUR)
-    data = np.zeros((height, width, 3), dtype=np.uint8)
-    for i in range(height - 1, -1, -1):
-        for j in range(width):
-            bB = int.from_bytes(file.read(1), "little", signed=False)
-            bG = int.from_bytes(file.read(1), "little", signed=False)
-            bR = int.from_bytes(file.read(1), "little", signed=False)
-            data[i, j] = np.array([bR, bG, bB], dtype=np.uint8)
-        # eat up padding 0s in raw data
-        for k in range(width % 4):
-            r = int.from_bytes(file.read(1), "little", signed=False)
-    return data, (width, height), ""
-
-@njit
-def cvtGrayscale(data: np.ndarray) -> np.ndarray:
-    # returned gray data will not be 32-aligned
-    ret = np.zeros((data.shape[0], data.shape[1], 1), dtype=np.uint8)
-    for i in range(data.shape[0]):
+        return None, (-1, -1), str(e), None
+    rows = np.ndarray((height, width, bpp // 8), dtype=np.uint8, buffer=buffer, offset=pixelOffset,
+                      strides=(stride, bpp // 8, 1))
+    if not topDown:
+        rows = rows[:: -1]
+    return rows, (width, height), "", palette
+
+'''
+Convert raw rows viewed by mapBMP to contiguous RGB data, or into out if given
+'''
+@profiled()
+def cvtBMPRows(rows: np.ndarray, palette: np.ndarray = None, out: np.ndarray = None) -> np.ndarray:
+    # BGR(X) to RGB in a single strided copy
+    converted = palette[rows[:, :, 0]] if palette is not None else rows[:, :, 2:: -1]
+    if out is None:
+        return np.ascontiguousarray(converted)
+    np.copyto(out, converted)
+    return out
+
+@profiled()
+def readBMP(fileName: str) -> (np.ndarray, (int, int), str):
+    rows, (width, height), errMsg, palette = mapBMP(fileName)
+    if rows is None:
+        return None, (width, height), errMsg
+    return cvtBMPRows(rows, palette), (width, height), ""
+
+'''
+Grayscale of RGB data, written into out if given, e.g. into the stride-aligned storage of an ImageBuffer
+'''
+@profiled()
+def cvtGrayscale(data: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    # returned gray data will not be 32-aligned, unless out is
+    if out is None:
+        out = np.zeros((data.shape[0], data.shape[1], 1), dtype=np.uint8)
+    return cvtGrayscaleInto(data, out)
+
+@njit(parallel=True, cache=True)
+def cvtGrayscaleInto(data: np.ndarray, ret: np.ndarray) -> np.ndarray:
+    for i in prange(data.shape[0]):
         for j in range(data.shape[1]):
             # Use division to avoid deviated float issue
             val = (299 * data[i, j, 0] + 587 * data[i, j, 1] + 114 * data[i, j, 2]) / 1000.0
@@ -65,18 +122,43 @@ def cvtGrayscale(data: np.ndarray) -> np.ndarray:
             ret[i, j, 0] = int(val)
     return ret
 
-@njit
+@profiled()
+@njit(cache=True)
 def cvtAlignedData(data: np.ndarray) -> np.ndarray:
     # dealing with 32-alignment issue, padding (4 - width) % 4 0s
     ret = np.zeros((data.shape[0], data.shape[1] + (4 - data.shape[1]) % 4, 1), dtype=np.uint8)
     ret[0: data.shape[0], 0: data.shape[1]] = data
     return ret
 
-@njit
-def cvtOrderedDithering(data: np.ndarray, ditType: int = 0) -> np.ndarray:
+'''
+Half-size image averaging 2x2 blocks, the last row or column of odd sizes is averaged with itself
+'''
+@profiled()
+def downsample(data: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    if out is None:
+        out = np.empty(((data.shape[0] + 1) // 2, (data.shape[1] + 1) // 2, data.shape[2]), dtype=np.uint8)
+    return downsampleInto(data, out)
+
+@njit(parallel=True, cache=True)
+def downsampleInto(data: np.ndarray, ret: np.ndarray) -> np.ndarray:
+    height, width, channels = data.shape
+    for i in prange(ret.shape[0]):
+        top, bottom = 2 * i, min(2 * i + 1, height - 1)
+        for j in range(ret.shape[1]):
+            left, right = 2 * j, min(2 * j + 1, width - 1)
+            for k in range(channels):
+                ret[i, j, k] = (np.uint32(data[top, left, k]) + data[top, right, k] +
+                                data[bottom, left, k] + data[bottom, right, k] + 2) // 4
+    return ret
+
+@profiled()
+def cvtOrderedDithering(data: np.ndarray, ditType: int = 0, out: np.ndarray = None) -> np.ndarray:
+    return cvtOrderedDitheringInto(data, ditType, np.zeros(data.shape, dtype=np.uint8) if out is None else out)
+
+@njit(parallel=True, cache=True)
+def cvtOrderedDitheringInto(data: np.ndarray, ditType: int, ret: np.ndarray) -> np.ndarray:
     DIM = 2 ** (ditType + 1) # dimension of dithering matrix
     MAX = DIM ** 2 - 1 # maximum value of dithering matrix
-    ret = np.zeros(data.shape, dtype=np.uint8)
     match ditType:
         case 0:
             mat = mat2
@@ -84,59 +166,235 @@ def cvtOrderedDithering(data: np.ndarray, ditType: int = 0) -> np.ndarray:
             mat = mat4
         case _:
             mat = mat8
-    for i in range(data.shape[0]):
+    for i in prange(data.shape[0]):
         for j in range(data.shape[1]):
             for k in range(data.shape[2]):
                 x, y = i % DIM, j % DIM
                 ret[i, j, k] = 255 if data[i, j, k] * MAX / 255 > mat[x, y] else 0
     return ret
 
-@njit
+'''
+Bayer matrix of any power-of-two size, built recursively from the 2x2 matrix
+'''
+def bayerMatrix(size: int) -> np.ndarray:
+    assert size >= 2 and size & (size - 1) == 0, str.format("Bayer matrix size must be a power of two")
+    ret = np.zeros((1, 1), dtype=np.int64)
+    while ret.shape[0] < size:
+        ret = np.block([[4 * ret, 4 * ret + 2], [4 * ret + 3, 4 * ret + 1]])
+    return ret
+
+'''
+Ordered dithering with a runtime-generated size x size Bayer matrix, same rule as cvtOrderedDithering
+Pixels are compared against a threshold row tiled over the width, one broadcast comparison per matrix row
+'''
+@profiled()
+def cvtBayerDithering(data: np.ndarray, size: int = 8, out: np.ndarray = None) -> np.ndarray:
+    mat = bayerMatrix(size)
+    # value * MAX / 255 > mat  <=>  value > floor(mat * 255 / MAX) for integer values
+    thresholds = mat * 255 // (size * size - 1)
+    ret = np.empty(data.shape, dtype=np.uint8) if out is None else out
+    repeats = -(-data.shape[1] // size)
+    for row in range(min(size, data.shape[0])):
+        rowThresholds = np.repeat(np.tile(thresholds[row], repeats)[0: data.shape[1], None], data.shape[2], axis=1)
+        np.greater(data[row:: size], rowThresholds, out=ret[row:: size].view(np.bool_))
+    ret *= 255
+    return ret
+
+# Error diffusion kernels: rows of (row offset, column offset, weight) and the divisor of the weights
+DIFFUSION_KERNELS = {
+    'floyd-steinberg': (np.array([[0, 1, 7], [1, -1, 3], [1, 0, 5], [1, 1, 1]]), 16),
+    'atkinson': (np.array([[0, 1, 1], [0, 2, 1], [1, -1, 1], [1, 0, 1], [1, 1, 1], [2, 0, 1]]), 8),
+    'jarvis-judice-ninke': (np.array([[0, 1, 7], [0, 2, 5],
+                                      [1, -2, 3], [1, -1, 5], [1, 0, 7], [1, 1, 5], [1, 2, 3],
+                                      [2, -2, 1], [2, -1, 3], [2, 0, 5], [2, 1, 3], [2, 2, 1]]), 48),
+    'stucki': (np.array([[0, 1, 8], [0, 2, 4],
+                         [1, -2, 2], [1, -1, 4], [1, 0, 8], [1, 1, 4], [1, 2, 2],
+                         [2, -2, 1], [2, -1, 2], [2, 0, 4], [2, 1, 2], [2, 2, 1]]), 42),
+}
+DIFFUSION_PAD = 2 # largest column offset of the kernels
+
+'''
+Quantize one pixel value (with accumulated error) to the nearest of levels evenly spaced values
+Returns (output value, error to diffuse)
+'''
+@njit(nogil=True, cache=True, inline='always')
+def diffusePixel(value: float, levels: int) -> (int, float):
+    level = np.floor(min(max(value, 0.0), 255.0) * (levels - 1) / 255.0 + 0.5)
+    out = np.floor(level * 255.0 / (levels - 1) + 0.5)
+    return int(out), value - out
+
+'''
+Serial error diffusion, row by row with a ring buffer holding error terms of the rows below
+Serpentine scanning alternates the direction of every other row
+'''
+@njit(nogil=True, cache=True)
+def errorDiffusion(data: np.ndarray, kernel: np.ndarray, divisor: int, levels: int, serpentine: bool,
+                   ret: np.ndarray) -> np.ndarray:
+    height, width, channels = data.shape
+    depth = 1 + np.max(kernel[:, 0])
+    weights = (kernel[:, 2] / divisor).astype(np.float32)
+    err = np.zeros((depth, width + 2 * DIFFUSION_PAD, channels), dtype=np.float32)
+    rows = np.zeros(kernel.shape[0], dtype=np.int64)
+    dxs = np.zeros(kernel.shape[0], dtype=np.int64)
+    for i in range(height):
+        reverse = serpentine and i % 2 == 1
+        row = i % depth
+        for t in range(kernel.shape[0]):
+            rows[t] = (i + kernel[t, 0]) % depth
+            dxs[t] = DIFFUSION_PAD + (-kernel[t, 1] if reverse else kernel[t, 1])
+        for step in range(width):
+            j = width - 1 - step if reverse else step
+            for k in range(channels):
+                out, e = diffusePixel(data[i, j, k] + err[row, j + DIFFUSION_PAD, k], levels)
+                ret[i, j, k] = out
+                for t in range(kernel.shape[0]):
+                    err[rows[t], j + dxs[t], k] += e * weights[t]
+        err[row] = 0.0
+    return ret
+
+'''
+Parallel error diffusion over a wavefront: pixel (i, j) is processed at step j + LAG * i, so every row runs
+LAG pixels behind the row above, after all error it receives from above is known and without write conflicts
+'''
+@njit(parallel=True, nogil=True, cache=True)
+def errorDiffusionWavefront(data: np.ndarray, kernel: np.ndarray, divisor: int, levels: int,
+                            ret: np.ndarray) -> np.ndarray:
+    height, width, channels = data.shape
+    lag = 2 * DIFFUSION_PAD + 1
+    depth = 1 + np.max(kernel[:, 0])
+    weights = (kernel[:, 2] / divisor).astype(np.float32)
+    # ring of error rows, large enough for every row in flight plus the rows below them
+    ring = min(height, width // lag + 2) + depth
+    err = np.zeros((ring, width + 2 * DIFFUSION_PAD, channels), dtype=np.float32)
+    for t in range(width + lag * (height - 1)):
+        first, last = max(0, (t - width + lag) // lag), min(height - 1, t // lag)
+        for i in prange(first, last + 1):
+            j = t - lag * i
+            row = i % ring
+            for k in range(channels):
+                out, e = diffusePixel(data[i, j, k] + err[row, j + DIFFUSION_PAD, k], levels)
+                ret[i, j, k] = out
+                for n in range(kernel.shape[0]):
+                    err[(i + kernel[n, 0]) % ring, j + kernel[n, 1] + DIFFUSION_PAD, k] += e * weights[n]
+            if j == width - 1:
+                err[row] = 0.0
+    return ret
+
+'''
+Error diffusion dithering of grayscale or RGB data, each channel quantized to levels evenly spaced values
+parallel selects the wavefront kernel (raster order, no serpentine)
+'''
+@profiled()
+def cvtErrorDiffusion(data: np.ndarray, method: str = 'floyd-steinberg', levels: int = 2,
+                      serpentine: bool = True, parallel: bool = False, out: np.ndarray = None) -> np.ndarray:
+    kernel, divisor = DIFFUSION_KERNELS[method]
+    out = np.empty(data.shape, dtype=np.uint8) if out is None else out
+    if parallel:
+        return errorDiffusionWavefront(data, kernel, divisor, levels, out)
+    return errorDiffusion(data, kernel, divisor, levels, serpentine, out)
+
+@profiled()
+@njit(parallel=True, cache=True)
 def histogram(data: np.ndarray) -> np.ndarray:
+    # row bands are counted into their own partial histograms in parallel, reduced at the end
+    bands = min(HIST_BANDS, max(data.shape[0], 1))
+    partial = np.zeros((bands, data.shape[2], 256), dtype=np.uint32)
+    for band in prange(bands):
+        for i in range(band * data.shape[0] // bands, (band + 1) * data.shape[0] // bands):
+            for j in range(data.shape[1]):
+                for k in range(data.shape[2]):
+                    partial[band, k, data[i, j, k]] += 1
     ret = np.zeros((data.shape[2], 256), dtype=np.uint32)
-    for i in range(data.shape[0]):
-        for j in range(data.shape[1]):
-            for k in range(data.shape[2]):
-                ret[k, data[i, j, k]] += 1
+    for band in range(bands):
+        ret += partial[band]
     return ret
 
+'''
+Entropy in bits per symbol of each channel of a (channels, 256) histogram, as a (channels, 1) array
+'''
+@profiled()
 def calEntropy(histogram: np.ndarray) -> np.ndarray:
-    ret = np.zeros((histogram.shape[0], 1), dtype=np.float32)
-    total = np.sum(histogram[0])
+    total = np.maximum(np.sum(histogram, axis=1, keepdims=True, dtype=np.float64), 1)
+    p = histogram / total
+    # empty bins contribute 0 (p log p -> 0)
+    logs = np.log2(p, out=np.zeros_like(p), where=p > 0)
+    return (-np.sum(p * logs, axis=1, keepdims=True)).astype(np.float32)
+
+'''
+Histogram of data mapped by a (channels, 256) lookup table, derived from the histogram of data without its pixels
+'''
+def lutHistogram(histogram: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    ret = np.zeros(histogram.shape, dtype=np.int64)
     for channel in range(histogram.shape[0]):
-        for count in range(1, histogram.shape[1]):
-            p = float(histogram[channel, count] / total)
-            ret[channel] -= p * np.emath.log2(max(p, 1e-10))
+        np.add.at(ret[channel], lut[channel], histogram[channel])
+    return ret
+
+'''
+Lookup table of a levels adjustment, mapping each uint8 input value to its adjusted output value
+'''
+@njit(cache=True)
+def levelsLUT(inSlider: (int, float, int) = (0, 1.0, 255), # inSlider = (low level, gamma, high level)
+              outSlider: (int, int) = (0, 255), # outSlider = (low level, high level)
+              ) -> np.ndarray:
+    ret = np.zeros(256, dtype=np.uint8)
+    for value in range(256):
+        if value <= inSlider[0]:
+            pixel = 0.0
+        elif value >= inSlider[2]:
+            pixel = 1.0
+        else:
+            pixel = (value - inSlider[0]) / (inSlider[2] - inSlider[0])
+        corrected = np.power(pixel, 1.0 / inSlider[1])
+        ret[value] = int(corrected * (outSlider[1] - outSlider[0]) + outSlider[0])
     return ret
 
-@njit
+'''
+Combine master and per-channel levels settings into a single (3, 256) lookup table
+gammas, inLevels, outLevels are laid out as [all, R, G, B]; the master adjustment is applied after each channel's
+'''
+def buildLevelsLUT(gammas: [float], inLevels: [(int, int)], outLevels: [(int, int)]) -> np.ndarray:
+    luts = [levelsLUT((int(inLevels[channel][0]), float(gammas[channel]), int(inLevels[channel][1])),
+                      (int(outLevels[channel][0]), int(outLevels[channel][1]))) for channel in range(4)]
+    return np.stack([luts[0][luts[channel]] for channel in range(1, 4)])
+
+'''
+Apply a per-channel lookup table of shape (channels, 256) in a single pass
+Releases the GIL so that it can run on a background render thread
+'''
+@profiled()
+@njit(nogil=True, cache=True)
+def applyLUT(data: np.ndarray, lut: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    ret = np.empty(data.shape, dtype=np.uint8) if out is None else out
+    for i in range(data.shape[0]):
+        for j in range(data.shape[1]):
+            for k in range(data.shape[2]):
+                ret[i, j, k] = lut[k, data[i, j, k]]
+    return ret
+
+@profiled()
+@njit(parallel=True, cache=True)
 def colorAdjustment(rawData: np.ndarray,
                     channel: int = 0,
                     inSlider: (int, float, int) = (0, 1.0, 255), # inSlider = (low level, gamma, high level)
                     outSlider: (int, int) = (0, 255), # outSlider = (low level, high level)
                     ) -> np.ndarray:
+    lut = levelsLUT(inSlider, outSlider)
     ret = np.copy(rawData)
-    for i in range(rawData.shape[0]):
+    for i in prange(rawData.shape[0]):
         for j in range(rawData.shape[1]):
-            if rawData[i, j, channel] <= inSlider[0]:
-                pixel = 0.0
-            elif rawData[i, j, channel] >= inSlider[2]:
-                pixel = 1.0
-            else:
-                pixel = (rawData[i, j, channel] - inSlider[0]) / (inSlider[2] - inSlider[0])
-            corrected = np.power(pixel, 1.0 / inSlider[1])
-            ret[i, j, channel] = int(corrected * (outSlider[1] - outSlider[0]) + outSlider[0])
+            ret[i, j, channel] = lut[rawData[i, j, channel]]
     return ret
 
 '''
 Normalize values in data to given target range
 '''
-@njit
+@profiled()
+@njit(parallel=True, cache=True)
 def normalize(data: np.ndarray, targetRange: (int, int) = (0, 255)) -> np.ndarray:
     ret = np.zeros(data.shape, dtype=np.uint8)
     for k in range(data.shape[2]):
         low, high = np.min(data[:, :, k]), np.max(data[:, :, k])
-        for i in range(data.shape[0]):
+        for i in prange(data.shape[0]):
             for j in range(data.shape[1]):
                 if data[i, j, k] == low:
                     ret[i, j, k] = targetRange[0]
@@ -146,34 +404,160 @@ def normalize(data: np.ndarray, targetRange: (int, int) = (0, 255)) -> np.ndarra
                     ret[i, j, k] = int((data[i, j, k] - low) / (high - low) * (targetRange[1] - targetRange[0])) + targetRange[0]
     return ret
 
+'''
+Average Huffman code length in bits per symbol of a 256 bin histogram
+Every merge of the Huffman construction adds one bit to each symbol below it, so the total length of the code is
+the sum of the merged counts, no tree is needed
+'''
+@profiled()
 def calHuffman(hist: np.ndarray):
-    class Node:
-        def __init__(self, key=-1, left=None, right=None):
-            # for leaf node (raw values), key = value; for non-leaf node (merged values), key = -1
-            self.key, self.left, self.right = key, left, right
-        def __lt__(self, other):
-            return self.key < other.key
-    leaves = []
-    for value in range(0, 256):
-        if hist[value] > 0:
-            heappush(leaves, (hist[value], Node(value)))
-    while len(leaves) > 1:
-        (countA, nodeA), (countB, nodeB) = heappop(leaves), heappop(leaves)
-        heappush(leaves, (countA + countB, Node(left=nodeA, right=nodeB)))
-    coded, length = defaultdict(int), 0
-    total, toVisit = leaves[0][0], [leaves[0][1]]
-    while len(toVisit):
-        newVisit = []
-        for node in toVisit:
-            if node.key != -1:
-                coded[node.key] = length
-            if node.left is not None:
-                newVisit.append(node.left)
-            if node.right is not None:
-                newVisit.append(node.right)
-        toVisit = newVisit
-        length += 1
-    ret = 0
-    for value in coded:
-        ret += coded[value] * hist[value]
-    return ret / total
+    counts = [int(count) for count in hist if count > 0]
+    total = sum(counts)
+    heapify(counts)
+    length = 0
+    while len(counts) > 1:
+        merged = heappop(counts) + heappop(counts)
+        length += merged
+        heappush(counts, merged)
+    return length / total if total > 0 else 0.0
+
+'''
+Lookup table of normalize for data ranging from low to high
+'''
+@njit(cache=True)
+def normalizeLUT(low: int, high: int, targetRange: (int, int) = (0, 255)) -> np.ndarray:
+    ret = np.zeros(256, dtype=np.uint8)
+    for value in range(low, high + 1):
+        if value == low:
+            ret[value] = targetRange[0]
+        elif value == high:
+            ret[value] = targetRange[1]
+        else:
+            ret[value] = int((value - low) / (high - low) * (targetRange[1] - targetRange[0])) + targetRange[0]
+    return ret
+
+'''
+Auto level parameters (low level, gamma, high level) from the 256-bin histogram of grayscale data
+Cut points and median are read off the cumulative histogram of normalized data instead of sorting every pixel
+'''
+def autolevelParameters(hist: np.ndarray) -> (int, float, int):
+    hist = hist.astype(np.int64)
+    values = np.flatnonzero(hist)
+    if values.size == 0:
+        # empty image, left unchanged
+        return 0, 1.0, 255
+    # Normalize grayscale to (0-255): move every bin to its normalized value
+    normalized = np.bincount(normalizeLUT(int(values[0]), int(values[-1]), (0, 255)), weights=hist, minlength=256)
+    cumulative = np.cumsum(normalized)
+    total = int(cumulative[-1])
+    # value at a given position of the sorted data
+    sortedAt = lambda position: int(np.searchsorted(cumulative, position, side='right'))
+    # Cut off lowest and highest values, by 0.1% of total number of values respectively
+    cuttingRate = 0.001
+    low, high = sortedAt(int(total * cuttingRate)), sortedAt(total - 1 - int(total * cuttingRate))
+    # Gamma adjustment determined by median (half of cut range) against 128 (half of 255)
+    med = (sortedAt((total - 1) // 2) + sortedAt(total // 2)) / 2
+    # Gamma is forced to fall in range (0.01, 9.99)
+    gamma = float(min(max(np.emath.logn(0.5, max(med - low, 1) / max(high - low, 1)), 0.01), 9.99))
+    return low, gamma, high
+
+'''
+Autolevel: approaching the effect of the algorithm "Enhance brightness and contrast" in Photoshop
+Returns leveled data and the adjustment parameters (low level, gamma, high level)
+'''
+@profiled()
+def autolevel(data: np.ndarray, grayData: np.ndarray = None, out: np.ndarray = None) -> (np.ndarray, (int, float, int)):
+    if grayData is None:
+        grayData = cvtGrayscale(data) if data.shape[2] == 3 else data
+    low, gamma, high = autolevelParameters(histogram(grayData)[0])
+    # Apply the same adjustment on all channels in a single pass
+    lut = levelsLUT((low, gamma, high), (0, 255))
+    return applyLUT(data, np.stack([lut] * data.shape[2]), out), (low, gamma, high)
+
+'''
+BMP file header, DIB header and palette (gray ramp for 8-bit) of grayscale (1 channel) or RGB (3 channels) data
+'''
+def bmpHeader(width: int, height: int, channels: int, topDown: bool = False, palette: np.ndarray = None) -> bytes:
+    assert channels in (1, 3), str.format("Only grayscale and RGB data can be written")
+    assert palette is None or (channels == 1 and 1 <= len(palette) <= 256), str.format("Palette not valid")
+    bpp = 8 * channels
+    stride = (width * bpp + 31) // 32 * 4
+    numColors = 0 if channels == 3 else 256 if palette is None else len(palette)
+    if palette is not None:
+        # RGB entries stored as BGRX
+        entries = np.zeros((numColors, 4), dtype=np.uint8)
+        entries[:, 0: 3] = palette[:, :: -1]
+        palette = entries.tobytes()
+    else:
+        palette = np.repeat(np.arange(256, dtype=np.uint8), 4).tobytes() if channels == 1 else b''
+    pixelOffset = 54 + len(palette)
+    header = struct.pack('<2sIHHI', b'BM', pixelOffset + stride * height, 0, 0, pixelOffset)
+    header += struct.pack('<IiiHHIIiiII', 40, width, -height if topDown else height, 1, bpp, 0, stride * height,
+                          2835, 2835, numColors, 0)
+    return header + palette
+
+'''
+Convert RGB or grayscale data to padded BMP rows in bottom-up BGR order, the inverse of cvtBMPRows
+'''
+@profiled()
+def cvtRowsBMP(data: np.ndarray, width: int = -1) -> np.ndarray:
+    height, channels = data.shape[0], data.shape[2]
+    width = data.shape[1] if width < 0 else width
+    # every row is padded to a multiple of 4 bytes
+    stride = (width * channels + 3) // 4 * 4
+    rows = np.zeros((height, stride), dtype=np.uint8)
+    rows[:, 0: width * channels] = data[:: -1, 0: width, :: -1].reshape(height, width * channels)
+    return rows
+
+'''
+Write RGB (height, width, 3) or grayscale (height, width, 1) data as a 24-bit or 8-bit (gray palette) BMP
+width crops data to the real image width, e.g. for data padded by cvtAlignedData
+palette, (n, 3) RGB colours, makes (height, width, 1) data palette indices of an 8-bit indexed BMP
+Returns an error message, empty on success
+'''
+@profiled()
+def writeBMP(fileName: str, data: np.ndarray, width: int = -1, palette: np.ndarray = None) -> str:
+    height, channels = data.shape[0], data.shape[2]
+    width = data.shape[1] if width < 0 else width
+    # rows already in BMP layout (e.g. 4-aligned grayscale) are written straight from the buffer as a top-down BMP
+    zeroCopy = channels == 1 and data.shape[1] == (width + 3) // 4 * 4 and data.flags.c_contiguous
+    header = bmpHeader(width, height, channels, topDown=zeroCopy, palette=palette)
+    rows = data if zeroCopy else cvtRowsBMP(data, width)
+    try:
+        with open(fileName, 'wb') as file:
+            file.write(header)
+            file.write(rows)
+    except IOError:
+        return str.format("Cannot write file")
+    return ""
+
+'''
+Compile every kernel for the uint8 layouts used by the GUI, or load them from numba's on-disk cache
+Meant to run on a background thread at startup so that the first menu action does not pay for JIT compilation
+'''
+def warmUp():
+    rgbData = np.zeros((4, 4, 3), dtype=np.uint8)
+    grayData = cvtGrayscale(rgbData)
+    cvtOrderedDithering(cvtAlignedData(grayData), 0)
+    cvtOrderedDithering(rgbData, 0)
+    downsample(rgbData)
+    cvtErrorDiffusion(grayData)
+    cvtErrorDiffusion(rgbData, parallel=True)
+    histogram(grayData)
+    histogram(rgbData)
+    normalize(grayData, (0, 255))
+    normalizeLUT(0, 255, (0, 255))
+    colorAdjustment(rgbData, 0, (0, 1.0, 255), (0, 255))
+    lut = buildLevelsLUT([1.0] * 4, [(0, 255)] * 4, [(0, 255)] * 4)
+    applyLUT(rgbData, lut)
+    # the GUI reads and writes strided rows of ImageBuffers, compiled separately from contiguous arrays
+    alignedRGB = np.zeros((4, 16), dtype=np.uint8)[:, : 12].reshape(4, 4, 3)
+    alignedGray = np.zeros((4, 8), dtype=np.uint8)[:, : 4, None]
+    cvtGrayscale(alignedRGB, out=alignedGray)
+    cvtOrderedDithering(alignedGray, 0, out=alignedGray.copy())
+    downsample(alignedRGB, out=alignedRGB[: 2, : 2])
+    cvtErrorDiffusion(alignedGray, out=alignedGray.copy())
+    cvtErrorDiffusion(alignedGray, parallel=True, out=alignedGray.copy())
+    histogram(alignedGray)
+    applyLUT(alignedRGB, lut, alignedRGB.copy())
+    applyLUT(rgbData, lut, alignedRGB)
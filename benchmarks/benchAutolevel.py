@@ -0,0 +1,52 @@
+'''
+Benchmark: auto level statistics from the cumulative histogram against the original normalize + sort flow
+Usage: python -m benchmarks.benchAutolevel [width] [height]    (e.g. 12000 8400 for 100 MP)
+'''
+import sys
+import time
+import numpy as np
+
+from Utils import cvtGrayscale, normalize, histogram, autolevelParameters, autolevel
+
+def sortParameters(grayData: np.ndarray) -> (int, float, int):
+    # the original flow, kept as the baseline
+    flattened = np.sort(normalize(grayData, (0, 255))[:, :, 0], axis=None)
+    cut = int(len(flattened) * 0.001)
+    low, high = int(flattened[cut]), int(flattened[-(1 + cut)])
+    med = (int(flattened[(len(flattened) - 1) // 2]) + int(flattened[len(flattened) // 2])) / 2
+    gamma = float(min(max(np.emath.logn(0.5, max(med - low, 1) / max(high - low, 1)), 0.01), 9.99))
+    return low, gamma, high
+
+def histogramParameters(grayData: np.ndarray) -> (int, float, int):
+    return autolevelParameters(histogram(grayData)[0])
+
+def timeIt(func, *args, repeat: int = 3) -> (float, object):
+    best, ret = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ret = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, ret
+
+if __name__ == '__main__':
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 7680
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 4320
+    rng = np.random.default_rng(0)
+    # smooth gradient with noise, so that the cut points are not trivially 0 and 255
+    gradient = np.linspace(40, 200, width, dtype=np.float32)[None, :, None]
+    rgbData = np.clip(gradient + rng.normal(0, 20, (height, width, 3)), 0, 255).astype(np.uint8)
+    grayData = cvtGrayscale(rgbData)
+    # compile kernels before timing
+    sortParameters(grayData[: 8])
+    histogramParameters(grayData[: 8])
+    autolevel(rgbData[: 8])
+    tSort, pSort = timeIt(sortParameters, grayData)
+    tHist, pHist = timeIt(histogramParameters, grayData)
+    assert pSort == pHist, "parameters differ: %s vs %s" % (pSort, pHist)
+    tAuto, _ = timeIt(autolevel, rgbData, grayData)
+    mpix = width * height / 1e6
+    print("image: %dx%d (%.1f MP), parameters (low, gamma, high) = (%d, %.4f, %d)" % ((width, height, mpix) + pHist))
+    print("normalize + sort:        %8.3f s  %10.1f MP/s" % (tSort, mpix / tSort))
+    print("cumulative histogram:    %8.3f s  %10.1f MP/s" % (tHist, mpix / tHist))
+    print("speedup:                 %8.1fx" % (tSort / tHist))
+    print("autolevel (incl. apply): %8.3f s  %10.1f MP/s" % (tAuto, mpix / tAuto))
@@ -0,0 +1,121 @@
+'''
+Load test of the processing daemon: concurrent clients sending jobs, reporting jobs/s and latency percentiles
+A daemon is started on a temporary socket unless --socket names a running one
+Usage: python -m benchmarks.benchDaemon [--clients 8] [--jobs 50] [--size 1024] [--ops grayscale,dither,entropy]
+                                        [--workers 4] [--queue 16] [--upload] [--socket PATH]
+    --upload copies the image to a new shared memory segment per job instead of once per client
+'''
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+import numpy as np
+
+from Daemon import DaemonClient, SharedImage, connectDaemon
+from benchmarks.benchSuite import syntheticImage
+
+STARTUP_TIMEOUT = 120 # s for the daemon to compile or load its kernels
+# daemon operation and parameters of each benchmarked job type
+JOBS = {
+    'grayscale': ('grayscale', {}),
+    'dither': ('dither', {'size': 8, 'gray': True}),
+    'diffusion': ('diffusion', {'gray': True}),
+    'levels': ('levels', {'gammas': [1.0, 1.2, 0.8, 1.0], 'inLevels': [(0, 255), (10, 240), (0, 255), (5, 250)],
+                          'outLevels': [(0, 255)] * 4}),
+    'entropy': ('entropy', {}),
+}
+
+def startDaemon(socketPath: str, workers: int, queueSize: int) -> subprocess.Popen:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen([sys.executable, os.path.join(root, 'Daemon.py'), '--socket', socketPath,
+                                '-j', str(workers), '--queue', str(queueSize)], cwd=root)
+    deadline = time.perf_counter() + STARTUP_TIMEOUT
+    while time.perf_counter() < deadline and process.poll() is None:
+        client, _ = connectDaemon(socketPath)
+        if client is not None:
+            client.close()
+            return process
+        time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Processing daemon did not start")
+
+'''
+One client: jobs requests of the given types in turn, returns (latencies, server queue times, run times, errors)
+'''
+def runClient(socketPath: str, data: np.ndarray, jobTypes: [str], jobs: int, upload: bool) -> ([float], [float],
+                                                                                                 [float], int):
+    client = DaemonClient(socketPath)
+    image = data if upload else SharedImage(data)
+    latencies, queued, running, errors = [], [], [], 0
+    for n in range(jobs):
+        operation, params = JOBS[jobTypes[n % len(jobTypes)]]
+        start = time.perf_counter()
+        client.submit(operation, image, **params)
+        _, _, _, errMsg = client.receive()
+        latencies.append(time.perf_counter() - start)
+        queued.append(client.lastResponse.get('queued', 0.0))
+        running.append(client.lastResponse.get('seconds', 0.0))
+        errors += 1 if errMsg else 0
+    client.close()
+    if not upload:
+        image.close()
+    return latencies, queued, running, errors
+
+def main(argv: [str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Processing daemon load test")
+    parser.add_argument('--clients', type=int, default=8, help="concurrent client connections")
+    parser.add_argument('--jobs', type=int, default=50, help="jobs per client")
+    parser.add_argument('--size', type=int, default=1024, help="image side")
+    parser.add_argument('--ops', default='grayscale,dither,entropy', help="comma separated: " + ", ".join(JOBS))
+    parser.add_argument('--workers', type=int, default=4, help="worker threads of the started daemon")
+    parser.add_argument('--queue', type=int, default=16, help="job queue size of the started daemon")
+    parser.add_argument('--upload', action='store_true', help="copy the image to shared memory for every job")
+    parser.add_argument('--socket', default='', help="socket of a running daemon, none is started")
+    args = parser.parse_args(argv)
+    jobTypes = [job.strip() for job in args.ops.split(',') if job.strip()]
+    unknown = [job for job in jobTypes if job not in JOBS]
+    if unknown:
+        parser.error("unknown operations: " + ", ".join(unknown))
+
+    process = None
+    socketPath = args.socket or os.path.join(tempfile.mkdtemp(), 'daemon.sock')
+    if not args.socket:
+        process = startDaemon(socketPath, args.workers, args.queue)
+    try:
+        data = syntheticImage('photo', args.size, args.size)
+        # one round of every job type first, so that the daemon has compiled every kernel signature
+        runClient(socketPath, data, jobTypes, len(jobTypes), args.upload)
+        results = [None] * args.clients
+        def clientThread(n: int):
+            results[n] = runClient(socketPath, data, jobTypes, args.jobs, args.upload)
+        threads = [threading.Thread(target=clientThread, args=(n,)) for n in range(args.clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        if process is not None:
+            client, _ = connectDaemon(socketPath)
+            if client is not None:
+                client.request('shutdown')
+                client.close()
+            process.wait()
+    latencies, queued, running = [np.array([value for result in results for value in result[n]]) * 1e3
+                                  for n in range(3)]
+    errors = sum(result[3] for result in results)
+    print("%d clients x %d jobs (%s) on %dx%d RGB, %s" % (args.clients, args.jobs, ",".join(jobTypes), args.size,
+                                                        args.size, "uploaded per job" if args.upload else "shared once"))
+    print("throughput: %.1f jobs/s, %d errors" % (len(latencies) / elapsed, errors))
+    print("latency ms: mean %.2f, p50 %.2f, p95 %.2f, p99 %.2f, max %.2f" % (
+        latencies.mean(), *np.percentile(latencies, [50, 95, 99]), latencies.max()))
+    print("in the daemon, ms: queued p50 %.2f, p99 %.2f, running p50 %.2f, p99 %.2f" % (
+        *np.percentile(queued, [50, 99]), *np.percentile(running, [50, 99])))
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,40 @@
+'''
+Benchmark: throughput of ordered (compiled and runtime Bayer) and error diffusion dithering
+Usage: python -m benchmarks.benchDithering [width] [height]
+'''
+import sys
+import time
+import numpy as np
+
+from Utils import cvtGrayscale, cvtOrderedDithering, cvtBayerDithering, cvtErrorDiffusion, DIFFUSION_KERNELS
+
+def timeIt(func, *args, repeat: int = 3) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == '__main__':
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 3840
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 2160
+    rgbData = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    grayData = cvtGrayscale(rgbData)
+    cases = {}
+    for ditType in range(3):
+        size = 2 ** (ditType + 1)
+        cases['ordered %dx%d (compiled)' % (size, size)] = (cvtOrderedDithering, ditType)
+    for size in (2, 4, 8, 16, 32, 64):
+        cases['ordered %dx%d (Bayer)' % (size, size)] = (cvtBayerDithering, size)
+    for method in DIFFUSION_KERNELS:
+        cases[method + ' (serpentine)'] = (cvtErrorDiffusion, method, 2, True, False)
+        cases[method + ' (wavefront)'] = (cvtErrorDiffusion, method, 2, False, True)
+    print("image: %dx%d, MP/s" % (width, height))
+    print("%-40s%10s%10s" % ("", "gray", "RGB"))
+    mpix = width * height / 1e6
+    for name, (func, *args) in cases.items():
+        # first call compiles the kernel
+        func(grayData[: 8], *args)
+        func(rgbData[: 8], *args)
+        print("%-40s%10.1f%10.1f" % (name, mpix / timeIt(func, grayData, *args), mpix / timeIt(func, rgbData, *args)))
@@ -0,0 +1,40 @@
+'''
+Benchmark: throughput of the spatial filters across radii
+Box blur and median should run at about the same speed for every radius, Gaussian blur slows down linearly with it
+Usage: python -m benchmarks.benchFilters [width] [height] [radii]
+    radii are comma separated, Gaussian blurs use sigma = radius / 3
+'''
+import sys
+import time
+import numpy as np
+
+from Filters import gaussianBlur, boxBlur, unsharpMask, medianFilter, sobel, warmUp
+from benchmarks.benchSuite import syntheticImage
+
+DEF_RADII = [1, 2, 4, 8, 16, 32, 64]
+FILTERS = [('gaussian', lambda data, radius: gaussianBlur(data, radius / 3)),
+           ('box', boxBlur),
+           ('unsharp', lambda data, radius: unsharpMask(data, radius / 3, 1.0)),
+           ('median', medianFilter)]
+
+def timeIt(func, *args, repeat: int = 3) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == '__main__':
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+    radii = [int(radius) for radius in sys.argv[3].split(',')] if len(sys.argv) > 3 else DEF_RADII
+    data = syntheticImage('photo', width, height)
+    # compile kernels before timing
+    warmUp()
+    megapixels = width * height / 1e6
+    print("image: %dx%d RGB, throughput in megapixels per second" % (width, height))
+    print("%-10s" % "radius" + "".join("%10s" % name for name, _ in FILTERS))
+    for radius in radii:
+        print("%-10d" % radius + "".join("%10.1f" % (megapixels / timeIt(func, data, radius)) for _, func in FILTERS))
+    print("sobel: %.1f MP/s" % (megapixels / timeIt(sobel, data)))
@@ -0,0 +1,41 @@
+'''
+Benchmark: memory and undo/redo time of history steps against keeping a full copy of the image per step
+Usage: python -m benchmarks.benchHistory [width] [height]
+'''
+import sys
+import time
+import numpy as np
+
+from Utils import buildLevelsLUT, cvtGrayscale, cvtOrderedDithering
+from History import History
+from benchmarks.benchSuite import syntheticImage
+
+LEVELS = ([1.0, 1.2, 0.8, 1.0], [(0, 255), (10, 240), (0, 255), (5, 250)], [(0, 255)] * 4)
+
+def timeIt(func, *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+if __name__ == '__main__':
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 6000
+    data = syntheticImage('photo', width, height)
+    # compile kernels before timing
+    History().applyLUT('warm-up', data[: 8, : 8].copy(), buildLevelsLUT(*LEVELS))
+    local = data.copy()
+    local[height // 3: height // 3 + 400, width // 3: width // 3 + 600] //= 2
+    dithered = cvtOrderedDithering(cvtGrayscale(data), 2)
+    steps = [("local edit (400x600)", lambda history: history.applyResult('local', data, local)),
+             ("levels (lookup table)", lambda history: history.applyLUT('levels', data, buildLevelsLUT(*LEVELS))),
+             ("dithering (every pixel)", lambda history: history.applyResult('dither', data, dithered))]
+    print("image: %dx%d, a full copy is %.1f MB" % (width, height, data.nbytes / 2 ** 20))
+    print("%-26s%12s%12s%12s%12s" % ("step", "record s", "step MB", "undo s", "redo s"))
+    for name, step in steps:
+        history = History()
+        tRecord = timeIt(step, history)
+        stored = history.store.used + history.store.spilled
+        tUndo = timeIt(history.undo, data)
+        tRedo = timeIt(history.redo, data)
+        history.undo(data)
+        print("%-26s%12.3f%12.2f%12.4f%12.4f" % (name, tRecord, stored / 2 ** 20, tUndo, tRedo))
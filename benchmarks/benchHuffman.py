@@ -0,0 +1,47 @@
+'''
+Benchmark: Huffman codec throughput and compressed size against the entropy bound
+Usage: python -m benchmarks.benchHuffman [width] [height]
+'''
+import sys
+import time
+import numpy as np
+
+from Utils import cvtGrayscale, histogram, calEntropy, calHuffman
+from Huffman import encodeHuffman, decodeHuffman
+
+def photoLike(width: int, height: int) -> np.ndarray:
+    # smooth shading plus sensor-like noise, with a skewed value distribution like real photos
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0: height, 0: width].astype(np.float32)
+    base = 128 + 60 * np.sin(x / width * 7)[:, :, None] * np.cos(y / height * 5)[:, :, None]
+    tint = np.array([1.0, 0.9, 0.7], dtype=np.float32)
+    return np.clip(base * tint + rng.normal(0, 6, (height, width, 3)), 0, 255).astype(np.uint8)
+
+def timeIt(func, *args, repeat: int = 3) -> (float, object):
+    best, ret = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ret = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, ret
+
+if __name__ == '__main__':
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 4096
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 4096
+    rgbData = photoLike(width, height)
+    # compile kernels before timing
+    decodeHuffman(encodeHuffman(rgbData[: 4]))
+    decodeHuffman(encodeHuffman(cvtGrayscale(rgbData[: 4])))
+    print("image: %dx%d" % (width, height))
+    print("%-6s%12s%12s%10s%10s%10s%10s" % ("", "encode MB/s", "decode MB/s", "bpp", "huffman", "entropy", "ratio"))
+    for name, data in (('gray', cvtGrayscale(rgbData)), ('RGB', rgbData)):
+        tEncode, encoded = timeIt(encodeHuffman, data)
+        tDecode, (decoded, _) = timeIt(decodeHuffman, encoded)
+        assert np.array_equal(decoded, data), "round trip failed"
+        hist = histogram(data)
+        # bits per value (per channel sample), including the container overhead
+        bpp = len(encoded) * 8 / data.size
+        entropy = float(np.mean(calEntropy(hist)))
+        huffman = float(np.mean([calHuffman(hist[channel]) for channel in range(hist.shape[0])]))
+        print("%-6s%12.1f%12.1f%10.3f%10.3f%10.3f%10.2f" % (name, data.nbytes / tEncode / 1e6, data.nbytes / tDecode / 1e6,
+                                                             bpp, huffman, entropy, data.nbytes / len(encoded)))
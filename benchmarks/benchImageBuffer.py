@@ -0,0 +1,92 @@
+'''
+Benchmark: memory allocated to show a processed result, legacy flow (kernel output, cvtAlignedData copy,
+QPixmap conversion) against kernels writing into an ImageBuffer drawn as is
+Every flow runs in a fresh interpreter and reports its peak resident memory above the loaded input,
+in units of the displayed image size (1.0 means no copy beyond the result itself, 2.0 for dithering, which
+also keeps the grayscale image)
+Peak memory is reset and read through /proc, so this benchmark runs on Linux only
+Usage: python -m benchmarks.benchImageBuffer [width] [height]
+'''
+import sys
+import subprocess
+import numpy as np
+
+LUT = ([1.0, 1.2, 0.8, 1.0], [(0, 255), (10, 240), (0, 255), (5, 250)], [(0, 255)] * 4)
+
+def legacyFlow(action: str, data: np.ndarray):
+    from PyQt5.QtGui import QImage, QPixmap
+    from Utils import cvtGrayscale, cvtAlignedData, cvtOrderedDithering, applyLUT, buildLevelsLUT
+    height, width = data.shape[0], data.shape[1]
+    if action == 'levels':
+        result = applyLUT(data, buildLevelsLUT(*LUT))
+        return result, QPixmap(QImage(result, width, height, width * 3, QImage.Format_RGB888))
+    result = cvtAlignedData(cvtGrayscale(data))
+    if action == 'dithering':
+        result = cvtOrderedDithering(result, 2)
+    return result, QPixmap(QImage(result, width, height, QImage.Format_Grayscale8))
+
+def bufferFlow(action: str, data: np.ndarray):
+    from PyQt5.QtGui import QImage
+    from ImageBuffer import ImageBuffer
+    from Utils import cvtGrayscale, cvtOrderedDithering, applyLUT, buildLevelsLUT
+    height, width = data.shape[0], data.shape[1]
+    if action == 'levels':
+        ret = ImageBuffer(width, height, QImage.Format_RGB32)
+        applyLUT(data, buildLevelsLUT(*LUT), ret.array)
+        return ret
+    ret = ImageBuffer(width, height, QImage.Format_Grayscale8)
+    cvtGrayscale(data, out=ret.array)
+    if action == 'dithering':
+        # the grayscale buffer is kept, as the GUI shows it next to the dithered one
+        return ret, cvtOrderedDithering(ret.array, 2, out=ret.like().array)
+    return ret
+
+FLOWS = {'legacy': legacyFlow, 'buffer': bufferFlow}
+ACTIONS = {'grayscale': 1, 'dithering': 1, 'levels': 3} # bytes per pixel of the displayed result
+
+'''
+Resident memory in bytes, current (VmRSS) or peak since the last resetPeak (VmHWM)
+'''
+def residentMemory(field: str = 'VmRSS') -> int:
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+def resetPeak():
+    with open('/proc/self/clear_refs', 'w') as clearRefs:
+        clearRefs.write('5')
+
+def runChild(flow: str, action: str, width: int, height: int):
+    from PyQt5.QtWidgets import QApplication
+    from ImageBuffer import ImageBuffer
+    app = QApplication(['bench'])
+    # compile kernels on a small image, then load the input the way each flow holds it
+    small = np.zeros((8, 8, 3), dtype=np.uint8)
+    FLOWS[flow](action, small if flow == 'legacy' else ImageBuffer.fromArray(small).array)
+    data = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    if flow == 'buffer':
+        data = ImageBuffer.fromArray(data).array
+    resetPeak()
+    base = residentMemory()
+    result = FLOWS[flow](action, data)
+    print(residentMemory('VmHWM') - base)
+
+def measure(flow: str, action: str, width: int, height: int) -> int:
+    out = subprocess.run([sys.executable, '-m', 'benchmarks.benchImageBuffer', '--child', flow, action, str(width),
+                          str(height)], capture_output=True, text=True, check=True).stdout
+    return int(out.split()[-1])
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        runChild(sys.argv[2], sys.argv[3], int(sys.argv[4]), int(sys.argv[5]))
+        sys.exit(0)
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 6001
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 4000
+    print("peak memory above input, %dx%d image, in MB and in displayed image sizes" % (width, height))
+    print("%-12s%12s%10s%12s%10s" % ("action", "legacy MB", "x", "buffer MB", "x"))
+    for action, bytesPerPixel in ACTIONS.items():
+        size = width * height * bytesPerPixel
+        legacy, buffer = measure('legacy', action, width, height), measure('buffer', action, width, height)
+        print("%-12s%12.1f%10.2f%12.1f%10.2f" % (action, legacy / 2 ** 20, legacy / size, buffer / 2 ** 20, buffer / size))
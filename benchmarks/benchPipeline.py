@@ -0,0 +1,56 @@
+'''
+Benchmark: fused operation graph against running the kernels one after the other, and re-evaluation after an edit
+Usage: python -m benchmarks.benchPipeline [width] [height]
+'''
+import sys
+import time
+import numpy as np
+
+from Utils import cvtGrayscale, cvtOrderedDithering, autolevel, applyLUT, buildLevelsLUT
+from Pipeline import Pipeline, Grayscale, Levels, Dither, Autolevel, ErrorDiffusion
+
+LEVELS = ([1.0, 1.2, 0.8, 1.0], [(0, 255), (10, 240), (0, 255), (5, 250)], [(0, 255)] * 4)
+
+def sequential(data: np.ndarray) -> np.ndarray:
+    data = applyLUT(data, buildLevelsLUT(*LEVELS))
+    data, _ = autolevel(data)
+    return cvtOrderedDithering(cvtGrayscale(data), 2)
+
+def timeIt(func, *args, repeat: int = 3) -> (float, object):
+    best, ret = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ret = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, ret
+
+if __name__ == '__main__':
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+    rng = np.random.default_rng(0)
+    data = np.clip(np.linspace(30, 220, width)[None, :, None] + rng.normal(0, 20, (height, width, 3)), 0, 255).astype(np.uint8)
+    operations = lambda: [Levels(*LEVELS), Autolevel(), Grayscale(), Dither(8)]
+    # compile kernels before timing
+    small = data[: 8, : 8]
+    sequential(small)
+    Pipeline(small).evaluate(Pipeline(small).chain(operations()))
+    tSequential, expected = timeIt(sequential, data)
+    # a fresh graph each time, so that nothing is cached
+    tFused, fused = timeIt(lambda: (lambda pipeline: pipeline.evaluate(pipeline.chain(operations())))(Pipeline(data)))
+    assert np.array_equal(fused, expected), "fused output differs"
+    print("image: %dx%d, chain: levels, autolevel, grayscale, dither 8x8" % (width, height))
+    print("%-40s%10.3f s" % ("sequential kernels", tSequential))
+    print("%-40s%10.3f s" % ("fused graph", tFused))
+    # edits below a branch point only rerun what is downstream of it
+    pipeline = Pipeline(data)
+    diffused = pipeline.chain([Grayscale(), ErrorDiffusion('floyd-steinberg')])
+    branches = [pipeline.add(Dither(8), diffused), pipeline.add(Levels(*LEVELS), diffused)]
+    tFirst, _ = timeIt(pipeline.evaluate, branches[1], repeat=1)
+    levels = [list(LEVELS[0]), LEVELS[1], LEVELS[2]]
+    def edit():
+        levels[0][0] += 0.01
+        branches[1].edit(Levels(*levels))
+        return pipeline.evaluate(branches[1])
+    tEdit, _ = timeIt(edit)
+    print("%-40s%10.3f s" % ("grayscale, error diffusion, levels", tFirst))
+    print("%-40s%10.3f s" % ("same after editing levels", tEdit))
@@ -0,0 +1,59 @@
+'''
+Benchmark: colour quantization time, quality (PSNR) and file size of 8-bit indexed BMPs against 24-bit ones
+Also times the inverse colour map lookup against a nearest colour search per pixel, and reading both files back
+Usage: python -m benchmarks.benchQuantize [width] [height]
+'''
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+
+from Utils import readBMP, writeBMP
+from Quantize import quantize, buildPalette, cvtQuantize, cvtPalette, nearestColors, warmUp
+from benchmarks.benchSuite import syntheticImage
+
+COLORS = [256, 64, 16]
+SETTINGS = [(0, 'none'), (8, 'none'), (0, 'ordered'), (0, 'floyd-steinberg')] # (k-means iterations, dithering)
+SEARCH_PIXELS = 2 ** 18 # pixels of the per-pixel nearest colour search, extrapolated to the image
+
+def timeIt(func, *args, repeat: int = 3) -> (float, object):
+    best, ret = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ret = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, ret
+
+def psnr(data: np.ndarray, other: np.ndarray) -> float:
+    mse = np.mean((data.astype(np.float64) - other) ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+if __name__ == '__main__':
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+    data = syntheticImage('photo', width, height)
+    # compile kernels before timing
+    warmUp()
+    with tempfile.TemporaryDirectory() as directory:
+        fullFile, indexedFile = os.path.join(directory, 'full.bmp'), os.path.join(directory, 'indexed.bmp')
+        writeBMP(fullFile, data)
+        tReadFull, _ = timeIt(readBMP, fullFile)
+        print("image: %dx%d, 24-bit BMP %.1f MB, read in %.3f s" % (width, height, os.path.getsize(fullFile) / 2 ** 20,
+                                                                 tReadFull))
+        print("%-8s%-8s%-18s%12s%10s%12s%10s%12s" % ("colors", "k-means", "dithering", "quantize s", "PSNR dB",
+                                                    "size ratio", "write s", "read s"))
+        for colors in COLORS:
+            for kmeans, dither in SETTINGS:
+                tQuantize, (indices, palette) = timeIt(quantize, data, colors, kmeans, dither)
+                tWrite, _ = timeIt(writeBMP, indexedFile, indices, -1, palette)
+                tRead, _ = timeIt(readBMP, indexedFile)
+                print("%-8d%-8d%-18s%12.3f%10.2f%12.2f%10.3f%12.3f" % (
+                    colors, kmeans, dither, tQuantize, psnr(data, cvtPalette(indices, palette)),
+                    os.path.getsize(fullFile) / os.path.getsize(indexedFile), tWrite, tRead))
+    palette = buildPalette(data, 256)
+    tMap, _ = timeIt(cvtQuantize, data, palette)
+    pixels = data.reshape(-1, 3)[: SEARCH_PIXELS].astype(np.float64)
+    tSearch, _ = timeIt(nearestColors, pixels, palette.astype(np.float64), repeat=1)
+    print("256 colour lookup: inverse colour map %.3f s, nearest colour search per pixel %.3f s (extrapolated)" % (
+        tMap, tSearch * width * height / len(pixels)))
@@ -0,0 +1,73 @@
+'''
+Benchmark: vectorized readBMP against the original per-byte reader
+Usage: python -m benchmarks.benchReadBMP [width] [height]
+'''
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+
+from Utils import readBMP
+
+def legacyReadBMP(fileName: str) -> (np.ndarray, (int, int), str):
+    # the original per-byte reader, kept verbatim as the baseline
+    file = open(fileName, 'rb')
+    file.read(2)
+    int.from_bytes(file.read(4), "little")
+    file.seek(12, os.SEEK_CUR)
+    width = int.from_bytes(file.read(4), "little")
+    height = int.from_bytes(file.read(4), "little")
+    file.seek(2, os.SEEK_CUR)
+    int.from_bytes(file.read(2), "little")
+    file.seek(24, os.SEEK_CUR)
+    data = np.zeros((height, width, 3), dtype=np.uint8)
+    for i in range(height - 1, -1, -1):
+        for j in range(width):
+            bB = int.from_bytes(file.read(1), "little", signed=False)
+            bG = int.from_bytes(file.read(1), "little", signed=False)
+            bR = int.from_bytes(file.read(1), "little", signed=False)
+            data[i, j] = np.array([bR, bG, bB], dtype=np.uint8)
+        for k in range(width % 4):
+            file.read(1)
+    file.close()
+    return data, (width, height), ""
+
+def writeSyntheticBMP(fileName: str, width: int, height: int):
+    # 24-bit bottom-up BMP; width is a multiple of 4 so both readers agree on row padding
+    rng = np.random.default_rng(0)
+    stride = (width * 3 + 3) // 4 * 4
+    rows = np.zeros((height, stride), dtype=np.uint8)
+    rows[:, 0: width * 3] = rng.integers(0, 256, (height, width * 3), dtype=np.uint8)
+    header = b'BM' + (54 + rows.nbytes).to_bytes(4, "little") + bytes(4) + (54).to_bytes(4, "little")
+    header += (40).to_bytes(4, "little") + width.to_bytes(4, "little") + height.to_bytes(4, "little")
+    header += (1).to_bytes(2, "little") + (24).to_bytes(2, "little") + bytes(24)
+    with open(fileName, 'wb') as file:
+        file.write(header)
+        file.write(rows.tobytes())
+
+def timeIt(func, *args, repeat: int = 1) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == '__main__':
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 768
+    width -= width % 4
+    with tempfile.TemporaryDirectory() as tmpDir:
+        fileName = os.path.join(tmpDir, 'bench.bmp')
+        writeSyntheticBMP(fileName, width, height)
+        newData = readBMP(fileName)[0]
+        oldData = legacyReadBMP(fileName)[0]
+        assert np.array_equal(newData, oldData), "readers disagree"
+        tNew = timeIt(readBMP, fileName, repeat=5)
+        tOld = timeIt(legacyReadBMP, fileName)
+    mpix = width * height / 1e6
+    print("image: %dx%d (%.2f MP)" % (width, height, mpix))
+    print("legacy readBMP: %8.3f s  %10.2f MP/s" % (tOld, mpix / tOld))
+    print("readBMP:        %8.3f s  %10.2f MP/s" % (tNew, mpix / tNew))
+    print("speedup:        %8.1fx" % (tOld / tNew))
@@ -0,0 +1,78 @@
+'''
+Benchmark: time-to-first-result of each menu action, cold (empty numba cache) and warm (populated cache)
+Every action runs in a fresh interpreter so that JIT compilation is not shared between measurements
+Usage: python -m benchmarks.benchStartup [width] [height]
+'''
+import os
+import sys
+import time
+import tempfile
+import subprocess
+import numpy as np
+
+def grayscaleAction(data: np.ndarray):
+    from Utils import cvtGrayscale, cvtAlignedData
+    return cvtAlignedData(cvtGrayscale(data))
+
+def ditheringAction(data: np.ndarray):
+    from Utils import cvtGrayscale, cvtAlignedData, cvtOrderedDithering
+    return cvtOrderedDithering(cvtAlignedData(cvtGrayscale(data)), 2)
+
+def coloredDitheringAction(data: np.ndarray):
+    from Utils import cvtOrderedDithering
+    return cvtOrderedDithering(data, 2)
+
+def autolevelAction(data: np.ndarray):
+    from Utils import autolevel
+    return autolevel(data)
+
+def huffmanAction(data: np.ndarray):
+    from Utils import cvtGrayscale, histogram, calEntropy, calHuffman
+    hist = histogram(cvtGrayscale(data))
+    return calEntropy(hist), calHuffman(hist[0])
+
+def levelsAction(data: np.ndarray):
+    from Utils import buildLevelsLUT, applyLUT
+    return applyLUT(data, buildLevelsLUT([1.0, 1.2, 0.8, 1.0], [(0, 255), (10, 240), (0, 255), (5, 250)],
+                                         [(0, 255)] * 4))
+
+ACTIONS = {
+    'Grayscale': grayscaleAction,
+    'Ordered Dithering': ditheringAction,
+    'Colored Ordered Dithering': coloredDitheringAction,
+    'Auto Level': autolevelAction,
+    'Huffman': huffmanAction,
+    'Color Adjustment': levelsAction,
+}
+
+def runChild(action: str, width: int, height: int):
+    # prints time-to-first-result (including import of Utils) and steady-state time of the second call
+    data = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    start = time.perf_counter()
+    import Utils
+    ACTIONS[action](data)
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    ACTIONS[action](data)
+    print(first, time.perf_counter() - start)
+
+def measure(action: str, width: int, height: int, cacheDir: str) -> (float, float):
+    env = dict(os.environ, NUMBA_CACHE_DIR=cacheDir)
+    out = subprocess.run([sys.executable, '-m', 'benchmarks.benchStartup', '--child', action, str(width), str(height)],
+                         env=env, capture_output=True, text=True, check=True).stdout
+    first, steady = out.split()
+    return float(first), float(steady)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        runChild(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+        sys.exit(0)
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 768
+    print("time to first result (s), %dx%d image" % (width, height))
+    print("%-28s%10s%10s%10s" % ("action", "cold", "warm", "steady"))
+    for action in ACTIONS:
+        with tempfile.TemporaryDirectory() as cacheDir:
+            cold, _ = measure(action, width, height, cacheDir)
+            warm, steady = measure(action, width, height, cacheDir)
+        print("%-28s%10.3f%10.3f%10.3f" % (action, cold, warm, steady))
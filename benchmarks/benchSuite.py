@@ -0,0 +1,234 @@
+'''
+Benchmark suite: every Utils and Filters kernel on deterministic synthetic images, with JSON results and regression checks
+Images (gradient, noise, photo-like) are written as BMPs and read back with readBMP, then each kernel is timed
+JIT warm-up (first call on a small image) is reported apart from steady-state timing (best and median of repeats),
+peak resident memory comes from a separate profiled run (Linux only, see Profiler)
+Usage: python -m benchmarks.benchSuite [--sizes 256,1024,4096] [--patterns gradient,noise,photo] [--repeat 5]
+                                       [-o results.json] [--baseline baseline.json] [--threshold 0.2] [--trace trace.json]
+    sizes are image sides, up to 16384 (16k x 16k RGB needs about 3 GB of memory and 0.8 GB of temporary disk)
+    exits with status 1 if any kernel is slower than in the baseline by more than threshold (0.2 = 20%)
+'''
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import numpy as np
+import numba
+
+from Utils import readBMP, writeBMP, cvtGrayscale, cvtAlignedData, cvtOrderedDithering, histogram, calEntropy
+from Utils import colorAdjustment, normalize, calHuffman, autolevel, setThreads
+from Filters import gaussianBlur, boxBlur, medianFilter, sobel
+from Profiler import PROFILER
+
+DEF_SIZES = [256, 1024, 4096]
+PATTERNS = ['gradient', 'noise', 'photo']
+DEF_REPEAT = 5
+DEF_THRESHOLD = 0.2
+MIN_COMPARE_SECONDS = 1e-3 # faster timings are too noisy to be compared against the baseline
+BAND_ROWS = 256 # rows generated at a time, so that 16k images need no full size float buffers
+WARMUP_SIZE = 64
+
+'''
+Deterministic synthetic RGB image, the same for a given pattern, size and seed on every machine
+'''
+def syntheticImage(pattern: str, width: int, height: int, seed: int = 0) -> np.ndarray:
+    assert pattern in PATTERNS, str.format("Unknown pattern: %s" % pattern)
+    ret = np.empty((height, width, 3), dtype=np.uint8)
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    # photo-like: a few smooth waves per channel, a vignette, hard edged shapes and sensor noise
+    waves = rng.uniform([0.5, 0.5, 0, 20], [4, 4, 2 * np.pi, 60], (3, 3, 4)).astype(np.float32)
+    shapes = rng.uniform(0, 1, (8, 4)).astype(np.float32)
+    for top in range(0, height, BAND_ROWS):
+        bottom = min(top + BAND_ROWS, height)
+        band = ret[top: bottom]
+        bandRng = np.random.default_rng((seed, top))
+        if pattern == 'noise':
+            band[...] = bandRng.integers(0, 256, band.shape, dtype=np.uint8)
+            continue
+        y = (np.arange(top, bottom, dtype=np.float32) / max(height - 1, 1))[:, None]
+        if pattern == 'gradient':
+            band[:, :, 0] = x * 255 + 0.5
+            band[:, :, 1] = y * 255 + 0.5
+            band[:, :, 2] = (x + y) * 127.5 + 0.5
+            continue
+        vignette = 1.0 - 0.6 * ((x - 0.5) ** 2 + (y - 0.5) ** 2)
+        for channel in range(3):
+            value = np.full((bottom - top, width), 128, dtype=np.float32)
+            for fx, fy, phase, amplitude in waves[channel]:
+                value += amplitude * np.sin(2 * np.pi * (fx * x + fy * y) + phase)
+            for left, upper, size, level in shapes:
+                inside = (np.abs(x - left) < size / 4) & (np.abs(y - upper) < size / 4)
+                value = np.where(inside, value * 0.5 + level * 128, value)
+            value = value * vignette + bandRng.normal(0, 4, value.shape).astype(np.float32)
+            band[:, :, channel] = np.clip(value + 0.5, 0, 255)
+    return ret
+
+'''
+Kernels of the suite: name -> (function of the prepared inputs, whether its time scales with the image size)
+'''
+KERNELS = {
+    'readBMP': (lambda inputs: readBMP(inputs['file']), True),
+    'cvtGrayscale': (lambda inputs: cvtGrayscale(inputs['rgb']), True),
+    'cvtAlignedData': (lambda inputs: cvtAlignedData(inputs['gray']), True),
+    'cvtOrderedDithering': (lambda inputs: cvtOrderedDithering(inputs['gray'], 2), True),
+    'histogram': (lambda inputs: histogram(inputs['gray']), True),
+    'calEntropy': (lambda inputs: calEntropy(inputs['hist']), False),
+    'colorAdjustment': (lambda inputs: colorAdjustment(inputs['rgb'], 0, (10, 1.2, 240), (0, 255)), True),
+    'normalize': (lambda inputs: normalize(inputs['gray'], (0, 255)), True),
+    'calHuffman': (lambda inputs: calHuffman(inputs['hist'][0]), False),
+    'autolevel': (lambda inputs: autolevel(inputs['rgb']), True),
+    'gaussianBlur': (lambda inputs: gaussianBlur(inputs['rgb'], 2.0), True),
+    'boxBlur': (lambda inputs: boxBlur(inputs['rgb'], 7), True),
+    'medianFilter': (lambda inputs: medianFilter(inputs['gray'], 2), True),
+    'sobel': (lambda inputs: sobel(inputs['gray']), True),
+}
+
+'''
+Inputs of every kernel for an image, reading it back from the BMP file as the GUI does
+'''
+def prepareInputs(fileName: str) -> dict:
+    rgb = readBMP(fileName)[0]
+    gray = cvtGrayscale(rgb)
+    return {'file': fileName, 'rgb': rgb, 'gray': gray, 'hist': histogram(gray)}
+
+def timeRepeats(func, inputs: dict, repeat: int) -> [float]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(inputs)
+        times.append(time.perf_counter() - start)
+    return times
+
+'''
+Cold call of every kernel on a small image: JIT compilation (or loading from numba's cache) happens here
+Returns kernel -> (seconds, of which compiling)
+'''
+def warmUpKernels(tmpDir: str, kernels: [str]) -> dict:
+    fileName = os.path.join(tmpDir, 'warmup.bmp')
+    writeBMP(fileName, syntheticImage('photo', WARMUP_SIZE, WARMUP_SIZE))
+    ret = {}
+    PROFILER.enable()
+    # the kernels preparing inputs are first called here, their spans are nested in this one
+    with PROFILER.span('prepareInputs', 'bench') as span:
+        inputs = prepareInputs(fileName)
+    for child in span.children:
+        if child.name in kernels:
+            ret[child.name] = (child.wall, child.jit)
+    for name in kernels:
+        if name not in ret:
+            with PROFILER.span(name, 'bench') as span:
+                KERNELS[name][0](inputs)
+            ret[name] = (span.wall, span.jit)
+    PROFILER.enable(False)
+    return {name: ret[name] for name in kernels}
+
+def benchImage(fileName: str, pattern: str, size: int, kernels: [str], repeat: int) -> [dict]:
+    inputs = prepareInputs(fileName)
+    megapixels = size * size / 1e6
+    rows = []
+    for name in kernels:
+        func, perPixel = KERNELS[name]
+        # one profiled run for memory, then plain timing so that profiling costs nothing
+        PROFILER.enable()
+        with PROFILER.span(name, 'bench', "%s %d" % (pattern, size)) as span:
+            func(inputs)
+        PROFILER.enable(False)
+        times = timeRepeats(func, inputs, repeat)
+        best = min(times)
+        rows.append({'kernel': name, 'pattern': pattern, 'size': size, 'megapixels': megapixels,
+                     'best_s': best, 'median_s': float(np.median(times)),
+                     'mp_per_s': megapixels / best if perPixel and best > 0 else None,
+                     'peak_rss_mb': span.peak / 2 ** 20 if span.peak else None,
+                     'peak_added_mb': span.peakMemory / 2 ** 20 if span.peak else None})
+    return rows
+
+def runSuite(sizes: [int], patterns: [str], kernels: [str], repeat: int) -> dict:
+    results = {'meta': {'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'platform': platform.platform(),
+                        'python': platform.python_version(), 'numpy': np.__version__, 'numba': numba.__version__,
+                        'cpus': os.cpu_count(), 'threads': numba.get_num_threads(), 'repeat': repeat},
+               'warmup': {}, 'results': []}
+    with tempfile.TemporaryDirectory() as tmpDir:
+        for name, (seconds, jit) in warmUpKernels(tmpDir, kernels).items():
+            results['warmup'][name] = {'seconds': seconds, 'jit_s': jit}
+            print("warm-up %-22s%10.3f s (JIT %.3f s)" % (name, seconds, jit), file=sys.stderr)
+        for size in sizes:
+            for pattern in patterns:
+                fileName = os.path.join(tmpDir, '%s_%d.bmp' % (pattern, size))
+                writeBMP(fileName, syntheticImage(pattern, size, size))
+                rows = benchImage(fileName, pattern, size, kernels, repeat)
+                os.remove(fileName)
+                for row in rows:
+                    print("%-22s%-10s%7d%12.4f s%12s MP/s%10s MB" % (
+                        row['kernel'], pattern, size, row['best_s'],
+                        "%.1f" % row['mp_per_s'] if row['mp_per_s'] is not None else "-",
+                        "%.1f" % row['peak_rss_mb'] if row['peak_rss_mb'] is not None else "-"))
+                results['results'].extend(rows)
+    return results
+
+'''
+Kernels slower than in the baseline by more than threshold, as (kernel, pattern, size, baseline s, current s)
+'''
+def regressions(results: dict, baseline: dict, threshold: float) -> [tuple]:
+    reference = {(row['kernel'], row['pattern'], row['size']): row['best_s'] for row in baseline['results']}
+    ret = []
+    for row in results['results']:
+        before = reference.get((row['kernel'], row['pattern'], row['size']))
+        if before is None or max(before, row['best_s']) < MIN_COMPARE_SECONDS:
+            continue
+        if row['best_s'] > before * (1 + threshold):
+            ret.append((row['kernel'], row['pattern'], row['size'], before, row['best_s']))
+    return ret
+
+def main(argv: [str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Homebrew Photoshop kernel benchmark suite")
+    parser.add_argument('--sizes', default=",".join(str(size) for size in DEF_SIZES),
+                        help="comma separated image sides, 256 to 16384")
+    parser.add_argument('--patterns', default=",".join(PATTERNS), help="comma separated: " + ", ".join(PATTERNS))
+    parser.add_argument('--kernels', default=",".join(KERNELS), help="comma separated: " + ", ".join(KERNELS))
+    parser.add_argument('--repeat', type=int, default=DEF_REPEAT, help="timed runs per kernel after the profiled one")
+    parser.add_argument('--threads', type=int, default=0, help="threads of parallel kernels, 0 for all cores")
+    parser.add_argument('-o', '--output', default='', help="JSON results, usable as a later baseline")
+    parser.add_argument('--baseline', default='', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=DEF_THRESHOLD,
+                        help="relative slowdown of the best time counted as a regression")
+    parser.add_argument('--trace', default='', help="Chrome trace of the profiled runs")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    patterns = [pattern.strip() for pattern in args.patterns.split(',') if pattern.strip()]
+    kernels = [kernel.strip() for kernel in args.kernels.split(',') if kernel.strip()]
+    for values, known, what in ((patterns, PATTERNS, "patterns"), (kernels, KERNELS, "kernels")):
+        unknown = [value for value in values if value not in known]
+        if unknown:
+            parser.error("unknown %s: %s" % (what, ", ".join(unknown)))
+    if any(size < 1 or size > 16384 for size in sizes):
+        parser.error("sizes must be between 1 and 16384")
+    if args.threshold < 0:
+        parser.error("threshold must not be negative")
+    setThreads(args.threads)
+
+    results = runSuite(sizes, patterns, kernels, max(1, args.repeat))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.trace:
+        errMsg = PROFILER.exportTrace(args.trace)
+        if errMsg:
+            print(errMsg + ": %s" % args.trace, file=sys.stderr)
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    slower = regressions(results, baseline, args.threshold)
+    for kernel, pattern, size, before, after in slower:
+        print("REGRESSION %s %s %d: %.4f s -> %.4f s (+%.0f%%)" % (kernel, pattern, size, before, after,
+                                                                 (after / before - 1) * 100), file=sys.stderr)
+    print("%d regressions beyond %.0f%% against %s" % (len(slower), args.threshold * 100, args.baseline), file=sys.stderr)
+    return 1 if slower else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,48 @@
+'''
+Benchmark: thread scaling of the parallel Utils kernels on 4K and 8K images
+Usage: python -m benchmarks.benchThreads [repeat]
+'''
+import sys
+import time
+import numba
+import numpy as np
+
+from Utils import setThreads, cvtGrayscale, cvtOrderedDithering, histogram, colorAdjustment, normalize
+
+SIZES = {'4K': (3840, 2160), '8K': (7680, 4320)}
+
+def timeIt(func, *args, repeat: int = 3) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == '__main__':
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    maxThreads = numba.config.NUMBA_NUM_THREADS
+    threadCounts = sorted({count for count in (1, 2, 4, maxThreads) if count <= maxThreads})
+    rng = np.random.default_rng(0)
+    for sizeName, (width, height) in SIZES.items():
+        rgbData = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        grayData = cvtGrayscale(rgbData)
+        kernels = {
+            'cvtGrayscale': (cvtGrayscale, rgbData),
+            'cvtOrderedDithering': (cvtOrderedDithering, grayData, 2),
+            'histogram': (histogram, rgbData),
+            'colorAdjustment': (colorAdjustment, rgbData, 0, (10, 1.5, 240), (0, 255)),
+            'normalize': (normalize, grayData, (0, 255)),
+        }
+        mpix = width * height / 1e6
+        print("%s (%dx%d), MP/s by thread count" % (sizeName, width, height))
+        print("%-22s" % "kernel" + "".join("%10d" % count for count in threadCounts))
+        for name, (func, *args) in kernels.items():
+            # first call compiles the kernel
+            func(*args)
+            row = []
+            for count in threadCounts:
+                setThreads(count)
+                row.append(mpix / timeIt(func, *args, repeat=repeat))
+            print("%-22s" % name + "".join("%10.1f" % value for value in row))
+        setThreads(0)
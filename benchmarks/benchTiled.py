@@ -0,0 +1,55 @@
+'''
+Benchmark: peak allocated memory and time of the tiled engine against the in-memory flow
+Usage: python -m benchmarks.benchTiled [width] [height] [band rows]
+'''
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+import numpy as np
+
+from Utils import readBMP, writeBMP, autolevel, cvtGrayscale, cvtOrderedDithering
+from Tiled import processTiled
+
+OPERATIONS = ['autolevel', 'dither8']
+
+def inMemory(inFile: str, outFile: str):
+    data = readBMP(inFile)[0]
+    data, _ = autolevel(data)
+    writeBMP(outFile, cvtOrderedDithering(cvtGrayscale(data), 2))
+
+def tiled(inFile: str, outFile: str, bandRows: int):
+    processTiled(inFile, outFile, OPERATIONS, bandRows)
+
+def measure(func, *args) -> (float, float):
+    # numpy reports its buffers to tracemalloc, so the traced peak covers image data
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(*args)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak / 2 ** 20
+
+if __name__ == '__main__':
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 6000
+    bandRows = int(sys.argv[3]) if len(sys.argv) > 3 else 256
+    with tempfile.TemporaryDirectory() as tmpDir:
+        inFile, outFile = os.path.join(tmpDir, 'in.bmp'), os.path.join(tmpDir, 'out.bmp')
+        gradient = np.linspace(40, 200, width, dtype=np.float32)[None, :, None]
+        writeBMP(inFile, np.clip(gradient + np.random.default_rng(0).normal(0, 20, (height, width, 3)), 0, 255).astype(np.uint8))
+        # compile kernels on a small image first
+        smallFile = os.path.join(tmpDir, 'small.bmp')
+        writeBMP(smallFile, np.zeros((16, 16, 3), dtype=np.uint8))
+        inMemory(smallFile, outFile)
+        tiled(smallFile, outFile, bandRows)
+        tMem, peakMem = measure(inMemory, inFile, outFile)
+        expected = readBMP(outFile)[0]
+        tTiled, peakTiled = measure(tiled, inFile, outFile, bandRows)
+        assert np.array_equal(readBMP(outFile)[0], expected), "tiled output differs"
+    print("image: %dx%d (%.1f MB RGB), chain: %s, band: %d rows" % (width, height, width * height * 3 / 2 ** 20,
+                                                                      ",".join(OPERATIONS), bandRows))
+    print("in memory: %8.3f s  peak %10.1f MB" % (tMem, peakMem))
+    print("tiled:     %8.3f s  peak %10.1f MB" % (tTiled, peakTiled))
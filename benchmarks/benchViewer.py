@@ -0,0 +1,44 @@
+'''
+Benchmark: repaint time and pyramid memory of the viewer for growing image sizes
+Usage: python -m benchmarks.benchViewer [largest side]
+'''
+import sys
+import time
+import numpy as np
+from PyQt5.QtWidgets import QApplication
+
+from ImageBuffer import ImageBuffer
+from ImageViewer import ImagePyramid, ImageView
+
+VIEWPORT = (1600, 900)
+# (zoom, center as a fraction of the image size), None fits the image to the viewport
+VIEWS = [None, (1.0, 0.5, 0.5), (4.0, 0.1, 0.9), (0.25, 0.3, 0.3)]
+
+def repaint(view: ImageView, repeat: int = 5) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        view.grab()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == '__main__':
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 16384
+    app = QApplication(sys.argv)
+    print("viewport: %dx%d, best repaint in ms per view, downsampled levels in MB" % VIEWPORT)
+    print("%-14s" % "image" + "".join("%12s" % ("fit" if v is None else "zoom %g" % v[0]) for v in VIEWS) + "%12s" % "levels MB")
+    size = 1024
+    while size <= largest:
+        data = np.random.default_rng(0).integers(0, 256, (size, size, 3), dtype=np.uint8)
+        pyramid = ImagePyramid(ImageBuffer.fromArray(data))
+        view = ImageView(pyramid)
+        view.resize(*VIEWPORT)
+        times = []
+        for v in VIEWS:
+            view.setView(None if v is None else (v[0], v[1] * size, v[2] * size))
+            # first paint builds pyramid levels, later paints are what panning costs
+            view.grab()
+            times.append(repaint(view) * 1e3)
+        levelBytes = pyramid.nbytes - pyramid.levels[0].nbytes
+        print("%-14s" % ("%dx%d" % (size, size)) + "".join("%12.1f" % t for t in times) + "%12.1f" % (levelBytes / 2 ** 20))
+        size *= 2
@@ -0,0 +1,51 @@
+'''
+Benchmark: writeBMP throughput, with readBMP round-trip checks on odd and aligned widths
+Usage: python -m benchmarks.benchWriteBMP [width] [height]
+'''
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+
+from Utils import readBMP, writeBMP, cvtGrayscale, cvtAlignedData
+
+def roundTrip(fileName: str):
+    rng = np.random.default_rng(0)
+    for width in range(1, 10):
+        rgbData = rng.integers(0, 256, (5, width, 3), dtype=np.uint8)
+        grayData = cvtGrayscale(rgbData)
+        writeBMP(fileName, rgbData)
+        assert np.array_equal(readBMP(fileName)[0], rgbData), "RGB round trip failed, width %d" % width
+        writeBMP(fileName, grayData)
+        assert np.array_equal(readBMP(fileName)[0], np.repeat(grayData, 3, axis=2)), "gray round trip failed, width %d" % width
+        writeBMP(fileName, cvtAlignedData(grayData), width)
+        data, size, _ = readBMP(fileName)
+        assert size == (width, 5) and np.array_equal(data[:, :, :1], grayData), "aligned round trip failed, width %d" % width
+
+def timeIt(func, *args, repeat: int = 5) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == '__main__':
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 7680
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 4320
+    rgbData = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    grayData = cvtGrayscale(rgbData)
+    cases = {
+        'RGB 24-bit': (rgbData, -1),
+        'gray 8-bit': (grayData, -1),
+        'gray 8-bit, 4-aligned': (cvtAlignedData(grayData), width),
+    }
+    with tempfile.TemporaryDirectory() as tmpDir:
+        fileName = os.path.join(tmpDir, 'bench.bmp')
+        roundTrip(fileName)
+        print("round trip: ok")
+        print("image: %dx%d" % (width, height))
+        for name, (data, dataWidth) in cases.items():
+            seconds = timeIt(writeBMP, fileName, data, dataWidth)
+            print("%-24s%8.3f s%10.1f MB/s" % (name, seconds, os.path.getsize(fileName) / seconds / 1e6))
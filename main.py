@@ -1,13 +1,27 @@
 import sys
+import threading
+import numba
 from PyQt5.QtWidgets import QApplication
 from PSWindow import PSWindow
+from Utils import warmUp
+import Pipeline
+import Filters
+import Quantize
 try:
     CUSTOMTHEME = True
     import qdarktheme
 except ModuleNotFoundError:
     CUSTOMTHEME = False
+# Compile (or load cached) numba kernels in the background while the window starts up
+WARMUP = True
 
 if __name__ == '__main__':
+    # the warm-up thread and render jobs launch parallel kernels beside the GUI thread, which the default workqueue
+    # threading layer aborts on; TBB or OpenMP allow it, set before the first parallel kernel runs
+    numba.config.THREADING_LAYER = 'threadsafe'
+    if WARMUP:
+        threading.Thread(target=lambda: (warmUp(), Pipeline.warmUp(), Filters.warmUp(), Quantize.warmUp()),
+                         daemon=True).start()
     mainApp = QApplication(sys.argv)
     if CUSTOMTHEME and len(sys.argv[1:]) == 0:
         qdarktheme.setup_theme(custom_colors={"background": "#404040"})
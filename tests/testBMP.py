@@ -0,0 +1,71 @@
+import struct
+import numpy as np
+import pytest
+
+from Utils import readBMP, writeBMP, bmpHeader, cvtRowsBMP, cvtAlignedData
+
+def randomImage(height: int, width: int, channels: int, seed: int = 7) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 256, (height, width, channels), dtype=np.uint8)
+
+def readBack(fileName: str) -> np.ndarray:
+    data, (width, height), errMsg = readBMP(fileName)
+    assert errMsg == ""
+    assert data.shape[: 2] == (height, width)
+    return data
+
+@pytest.mark.parametrize('width', [1, 3, 4, 5, 8, 13, 64])
+def testGrayscale(tmp_path, width):
+    # 4-aligned widths are written zero-copy as top-down BMPs, the others through cvtRowsBMP
+    data = randomImage(9, width, 1)
+    fileName = str(tmp_path / "gray.bmp")
+    assert writeBMP(fileName, data) == ""
+    assert np.array_equal(readBack(fileName), np.repeat(data, 3, axis=2))
+
+@pytest.mark.parametrize('width', [1, 2, 3, 4, 7, 64])
+def testRGB(tmp_path, width):
+    data = randomImage(11, width, 3)
+    fileName = str(tmp_path / "rgb.bmp")
+    assert writeBMP(fileName, data) == ""
+    assert np.array_equal(readBack(fileName), data)
+
+@pytest.mark.parametrize('channels', [1, 3])
+@pytest.mark.parametrize('topDown', [False, True])
+def testHeaderOrientation(tmp_path, channels, topDown):
+    data = randomImage(6, 5, channels)
+    header = bmpHeader(5, 6, channels, topDown=topDown)
+    assert struct.unpack_from('<i', header, 22)[0] == (-6 if topDown else 6)
+    # cvtRowsBMP produces bottom-up rows
+    rows = cvtRowsBMP(data)
+    fileName = str(tmp_path / "oriented.bmp")
+    with open(fileName, 'wb') as file:
+        file.write(header + (rows[:: -1] if topDown else rows).tobytes())
+    assert np.array_equal(readBack(fileName), np.repeat(data, 3 // channels, axis=2))
+
+def testCroppedWidth(tmp_path):
+    # data padded to 4-aligned rows by cvtAlignedData, cropped back to the image width when written
+    data = randomImage(5, 6, 1)
+    fileName = str(tmp_path / "cropped.bmp")
+    assert writeBMP(fileName, cvtAlignedData(data), width=6) == ""
+    assert np.array_equal(readBack(fileName), np.repeat(data, 3, axis=2))
+
+@pytest.mark.parametrize('colors, width', [(2, 5), (16, 8), (256, 13)])
+def testPalette(tmp_path, colors, width):
+    rng = np.random.default_rng(colors)
+    palette = rng.integers(0, 256, (colors, 3), dtype=np.uint8)
+    indices = rng.integers(0, colors, (7, width, 1), dtype=np.uint8)
+    fileName = str(tmp_path / "indexed.bmp")
+    assert writeBMP(fileName, indices, palette=palette) == ""
+    with open(fileName, 'rb') as file:
+        header = file.read(54)
+    assert struct.unpack_from('<H', header, 28)[0] == 8
+    assert struct.unpack_from('<I', header, 46)[0] == colors
+    assert np.array_equal(readBack(fileName), palette[indices[:, :, 0]])
+
+def testInvalidPalette():
+    with pytest.raises(AssertionError):
+        bmpHeader(4, 4, 3, palette=np.zeros((4, 3), dtype=np.uint8))
+    with pytest.raises(AssertionError):
+        bmpHeader(4, 4, 1, palette=np.zeros((257, 3), dtype=np.uint8))
+
+def testUnwritable(tmp_path):
+    assert writeBMP(str(tmp_path / "missing" / "image.bmp"), randomImage(2, 2, 3)) == "Cannot write file"
@@ -0,0 +1,26 @@
+import numpy as np
+
+from Utils import writeBMP
+from Batch import runBatch
+
+def writeImages(directory, count: int = 2) -> [str]:
+    rng = np.random.default_rng(6)
+    ret = []
+    for index in range(count):
+        ret.append(str(directory / ("image%d.bmp" % index)))
+        assert writeBMP(ret[-1], rng.integers(0, 256, (24, 37, 3), dtype=np.uint8)) == ""
+    return ret
+
+def testRaisingWorkerIsReported(tmp_path):
+    inFiles = writeImages(tmp_path)
+    # an unknown operation raises in the workers instead of being returned as an error by processFile
+    rows = runBatch(inFiles, '', ['grayscale', 'sharpen'], 1, 2)
+    assert sorted(row['input'] for row in rows) == inFiles
+    assert all(row['error'].startswith("ValueError: Unknown operation") for row in rows)
+
+def testTiledRowsHaveSize(tmp_path):
+    inFiles = writeImages(tmp_path, 1)
+    tiled, = runBatch(inFiles, '', ['autolevel'], 1, 1, bandRows=8)
+    whole, = runBatch(inFiles, '', ['autolevel'], 1, 1)
+    assert (tiled['width'], tiled['height']) == (whole['width'], whole['height']) == (37, 24)
+    assert (tiled['low'], tiled['high']) == (whole['low'], whole['high'])
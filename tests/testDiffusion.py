@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from Utils import cvtErrorDiffusion, DIFFUSION_KERNELS
+
+METHODS = sorted(DIFFUSION_KERNELS)
+SHAPES = [(1, 1, 1), (1, 17, 3), (23, 1, 1), (9, 4, 1), (31, 29, 3), (64, 97, 1)]
+
+def randomImage(shape: tuple) -> np.ndarray:
+    return np.random.default_rng(sum(shape)).integers(0, 256, shape, dtype=np.uint8)
+
+'''
+Textbook error diffusion, raster or serpentine order with the error kept for the whole image
+'''
+def referenceDiffusion(data: np.ndarray, method: str, levels: int, serpentine: bool) -> np.ndarray:
+    kernel, divisor = DIFFUSION_KERNELS[method]
+    height, width, _ = data.shape
+    err = np.zeros(data.shape, dtype=np.float64)
+    ret = np.zeros(data.shape, dtype=np.uint8)
+    for i in range(height):
+        reverse = serpentine and i % 2 == 1
+        for j in (range(width - 1, -1, -1) if reverse else range(width)):
+            value = data[i, j].astype(np.float64) + err[i, j]
+            level = np.floor(np.clip(value, 0, 255) * (levels - 1) / 255 + 0.5)
+            ret[i, j] = out = np.floor(level * 255 / (levels - 1) + 0.5)
+            for dy, dx, weight in kernel:
+                y, x = i + dy, j - dx if reverse else j + dx
+                if y < height and 0 <= x < width:
+                    err[y, x] += (value - out) * weight / divisor
+    return ret
+
+@pytest.mark.parametrize('shape', SHAPES)
+@pytest.mark.parametrize('method', METHODS)
+@pytest.mark.parametrize('levels', [2, 4])
+def testWavefrontMatchesSerial(shape, method, levels):
+    data = randomImage(shape)
+    serial = cvtErrorDiffusion(data, method, levels, serpentine=False)
+    assert np.array_equal(cvtErrorDiffusion(data, method, levels, parallel=True), serial)
+
+@pytest.mark.parametrize('shape', SHAPES)
+@pytest.mark.parametrize('method', METHODS)
+@pytest.mark.parametrize('serpentine', [False, True])
+def testSerialMatchesReference(shape, method, serpentine):
+    data = randomImage(shape)
+    ret = cvtErrorDiffusion(data, method, 2, serpentine)
+    # float32 error terms may round differently from the float64 reference at exact thresholds
+    assert np.mean(ret != referenceDiffusion(data, method, 2, serpentine)) <= 0.01
+
+@pytest.mark.parametrize('parallel', [False, True])
+@pytest.mark.parametrize('levels', [2, 3, 8])
+def testOutputLevels(parallel, levels):
+    data = randomImage((40, 50, 3))
+    ret = cvtErrorDiffusion(data, 'floyd-steinberg', levels, parallel=parallel)
+    allowed = np.floor(np.arange(levels) * 255 / (levels - 1) + 0.5)
+    assert np.isin(ret, allowed).all()
+    # diffusion keeps the local average, so the overall mean is close to the input one
+    assert abs(ret.mean() - data.mean()) < 255 / (levels - 1) / 10
+
+@pytest.mark.parametrize('parallel', [False, True])
+def testLevelValuesUnchanged(parallel):
+    data = np.full((16, 16, 1), 255, dtype=np.uint8)
+    data[::2] = 0
+    assert np.array_equal(cvtErrorDiffusion(data, 'stucki', 2, parallel=parallel), data)
+
+def testOut():
+    data = randomImage((12, 10, 3))
+    out = np.zeros_like(data)
+    assert cvtErrorDiffusion(data, 'atkinson', out=out) is out
+    assert np.array_equal(out, cvtErrorDiffusion(data, 'atkinson'))
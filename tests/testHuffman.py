@@ -0,0 +1,91 @@
+import struct
+import numpy as np
+import pytest
+
+from Huffman import (huffmanCodeLengths, canonicalCodes, encodeHuffman, decodeHuffman, saveHuffman, loadHuffman,
+                     MAX_CODE_LENGTH)
+
+def skewedHistogram() -> np.ndarray:
+    # Fibonacci counts give the deepest Huffman trees, far beyond MAX_CODE_LENGTH unlimited
+    counts = [1, 1]
+    while len(counts) < 40:
+        counts.append(counts[-1] + counts[-2])
+    ret = np.zeros(256, dtype=np.int64)
+    ret[0: 40] = counts
+    return ret
+
+@pytest.mark.parametrize('hist', [np.ones(256), np.arange(256), skewedHistogram(), np.eye(256)[17] * 1000,
+                                  np.eye(256)[3] + np.eye(256)[200]], ids=['flat', 'ramp', 'skewed', 'single', 'two'])
+def testCodeLengths(hist):
+    lengths = huffmanCodeLengths(hist).astype(np.int64)
+    assert np.array_equal(lengths > 0, hist > 0)
+    assert lengths.max() <= MAX_CODE_LENGTH
+    # a complete prefix code (Kraft sum of 1), apart from the single symbol case coded with one bit
+    kraft = sum(2.0 ** -int(length) for length in lengths if length)
+    assert kraft == 1.0 or (np.count_nonzero(hist) == 1 and kraft == 0.5)
+
+def testCanonicalCodesArePrefixFree():
+    lengths = huffmanCodeLengths(skewedHistogram() + np.arange(256))
+    codes = canonicalCodes(lengths)
+    words = sorted(format(int(codes[value]), '0%db' % lengths[value]) for value in np.flatnonzero(lengths))
+    assert all(not right.startswith(left) for left, right in zip(words, words[1:]))
+
+def randomImages():
+    rng = np.random.default_rng(11)
+    yield 'rgb', rng.integers(0, 256, (31, 45, 3), dtype=np.uint8)
+    yield 'gray', rng.integers(0, 256, (17, 13, 1), dtype=np.uint8)
+    yield 'constant', np.full((8, 9, 3), 77, dtype=np.uint8)
+    yield 'pixel', np.array([[[1, 2, 3]]], dtype=np.uint8)
+    # skewed values, forcing length-limited codes
+    yield 'skewed', np.repeat(np.arange(24, dtype=np.uint8), skewedHistogram()[0: 24])[None, :, None]
+    yield 'smooth', np.clip(rng.normal(128, 3, (64, 64, 3)), 0, 255).astype(np.uint8)
+
+@pytest.mark.parametrize('data', [data for _, data in randomImages()], ids=[name for name, _ in randomImages()])
+@pytest.mark.parametrize('chunkPixels', [7, 64, 1 << 18])
+def testRoundTrip(data, chunkPixels):
+    decoded, errMsg = decodeHuffman(encodeHuffman(data, chunkPixels))
+    assert errMsg == ""
+    assert np.array_equal(decoded, data)
+
+def testFileRoundTrip(tmp_path):
+    data = np.random.default_rng(3).integers(0, 256, (20, 30, 3), dtype=np.uint8)
+    fileName = str(tmp_path / "image.hph")
+    assert saveHuffman(fileName, data) == ""
+    decoded, (width, height), errMsg = loadHuffman(fileName)
+    assert errMsg == "" and (width, height) == (30, 20)
+    assert np.array_equal(decoded, data)
+
+def testMissingFile(tmp_path):
+    assert loadHuffman(str(tmp_path / "missing.hph")) == (None, (0, 0), "File not found")
+
+ENCODED = encodeHuffman(np.random.default_rng(5).integers(0, 256, (9, 10, 3), dtype=np.uint8), 16)
+
+@pytest.mark.parametrize('size', range(0, len(ENCODED), 7))
+def testTruncated(size):
+    data, errMsg = decodeHuffman(ENCODED[0: size])
+    assert data is None and errMsg
+
+def corrupted(offset: int, value: bytes) -> bytes:
+    return ENCODED[0: offset] + value + ENCODED[offset + len(value):]
+
+@pytest.mark.parametrize('buffer, errMsg', [
+    (b'', "Huffman file not valid"),
+    (corrupted(0, b'BMXX'), "Not a Huffman file"),
+    (corrupted(4, b'\x02'), "Not a Huffman file"),
+    (corrupted(5, b'\x00'), "Huffman file not valid"),
+    (corrupted(6, struct.pack('<I', 0)), "Huffman file not valid"),
+    (corrupted(14, struct.pack('<I', 0)), "Huffman file not valid"),
+    # code length above MAX_CODE_LENGTH
+    (corrupted(18, b'\x20'), "Huffman file not valid"),
+    # more pixels than chunk sizes stored
+    (corrupted(6, struct.pack('<I', 1 << 30)), "Huffman file not valid"),
+], ids=['empty', 'magic', 'version', 'channels', 'width', 'chunk', 'length', 'size'])
+def testCorrupt(buffer, errMsg):
+    assert decodeHuffman(buffer) == (None, errMsg)
+
+def testCorruptStreamDecodes():
+    # flipped bits in the coded stream are not detected, but decode to an image of the right size
+    buffer = bytearray(ENCODED)
+    buffer[-20:] = bytes(255 - byte for byte in buffer[-20:])
+    data, errMsg = decodeHuffman(bytes(buffer))
+    assert errMsg == "" and data.shape == (9, 10, 3)
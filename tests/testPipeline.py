@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from Utils import cvtGrayscale, cvtOrderedDithering, autolevel, levelsLUT, calEntropy
+from Pipeline import (Pipeline, Operation, PointOperation, Grayscale, Levels, Dither, Autolevel, Normalize, Huffman,
+                      ErrorDiffusion)
+
+def randomImage(shape: tuple = (21, 19, 3)) -> np.ndarray:
+    return np.clip(np.random.default_rng(15).normal(110, 30, shape), 0, 255).astype(np.uint8)
+
+def testFusedChainMatchesKernels():
+    data = randomImage()
+    pipeline = Pipeline(data)
+    leveled, (low, gamma, high) = autolevel(data)
+    node = pipeline.chain([Autolevel(), Grayscale(), Dither(8)])
+    assert np.array_equal(pipeline.evaluate(node), cvtOrderedDithering(cvtGrayscale(leveled), 2))
+    stats = pipeline.stats(node)
+    assert (stats['low'], stats['high']) == (low, high) and stats['gamma'] == pytest.approx(gamma)
+
+def testBranchesAndEdits():
+    data = randomImage()
+    pipeline = Pipeline(data)
+    gray = pipeline.add(Grayscale())
+    levels = pipeline.add(Levels([1.0] * 4, [(0, 255)] * 4, [(0, 255)] * 4), gray)
+    huffman = pipeline.add(Huffman(), gray)
+    assert np.array_equal(pipeline.evaluate(levels), cvtGrayscale(data))
+    hist = np.bincount(cvtGrayscale(data).reshape(-1), minlength=256)[None, :]
+    assert pipeline.stats(huffman)['entropy'] == pytest.approx(calEntropy(hist)[0, 0])
+    levels.edit(Levels([1.0] * 4, [(50, 200)] + [(0, 255)] * 3, [(0, 255)] * 4))
+    assert np.array_equal(pipeline.evaluate(levels), levelsLUT((50, 1.0, 200), (0, 255))[cvtGrayscale(data)])
+
+@pytest.mark.parametrize('operation', [Grayscale(), Dither(4), Autolevel(), Normalize(), Huffman(),
+                                       Levels([1.2] * 4, [(10, 240)] * 4, [(5, 250)] * 4)], ids=repr)
+def testApplyMatchesEvaluate(operation):
+    data = randomImage()
+    pipeline = Pipeline(data)
+    assert np.array_equal(operation.apply(data), pipeline.evaluate(pipeline.add(operation)))
+
+@pytest.mark.parametrize('shape', [(0, 5, 3), (4, 0, 1)])
+def testEmptyImage(shape):
+    data = np.zeros(shape, dtype=np.uint8)
+    pipeline = Pipeline(data)
+    node = pipeline.chain([Normalize(), Autolevel(), Huffman()])
+    assert pipeline.evaluate(node).shape == shape
+    assert (pipeline.stats(node)['low'], pipeline.stats(node)['high']) == (0, 255)
+    assert pipeline.size() == shape[0: 2]
+
+def testIncompleteOperations():
+    class NoAppend(PointOperation):
+        pass
+
+    class NoApply(Operation):
+        pass
+
+    for operation in (Operation, PointOperation, NoAppend, NoApply):
+        with pytest.raises(TypeError):
+            operation()
+    assert not ErrorDiffusion().pointWise and Grayscale().pointWise
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from Utils import readBMP, writeBMP, autolevel, normalize
+from Tiled import processTiled
+from Batch import runOperations
+
+CHAINS = [['grayscale'], ['dither8'], ['colordither4'], ['autolevel'], ['autolevel', 'dither2'],
+          ['grayscale', 'autolevel', 'huffman'], ['colordither2', 'huffman']]
+
+@pytest.fixture(scope='module')
+def imageFile(tmp_path_factory) -> str:
+    # low contrast, so that autolevel changes it, 37 columns, so that rows are padded
+    rng = np.random.default_rng(10)
+    data = np.clip(rng.normal(120, 25, (45, 37, 3)), 0, 255).astype(np.uint8)
+    ret = str(tmp_path_factory.mktemp('tiled') / "input.bmp")
+    assert writeBMP(ret, data) == ""
+    return ret
+
+@pytest.mark.parametrize('operations', CHAINS, ids=",".join)
+@pytest.mark.parametrize('bandRows', [8, 16, 256])
+def testMatchesInMemory(tmp_path, imageFile, operations, bandRows):
+    expected, expectedStats = runOperations(readBMP(imageFile)[0], operations)
+    outFile = str(tmp_path / "output.bmp")
+    stats, errMsg = processTiled(imageFile, outFile, operations, bandRows)
+    assert errMsg == ""
+    output = readBMP(outFile)[0]
+    assert np.array_equal(output, np.broadcast_to(expected, expected.shape[: 2] + (3,)))
+    for key, value in expectedStats.items():
+        assert stats[key] == pytest.approx(value)
+    assert (stats['width'], stats['height']) == (37, 45)
+
+def testAutolevelMatchesUtils(tmp_path, imageFile):
+    outFile = str(tmp_path / "output.bmp")
+    stats, _ = processTiled(imageFile, outFile, ['autolevel'], 8)
+    expected, (low, gamma, high) = autolevel(readBMP(imageFile)[0])
+    assert np.array_equal(readBMP(outFile)[0], expected)
+    assert (stats['low'], stats['high']) == (low, high) and stats['gamma'] == pytest.approx(gamma)
+
+def testNormalizeMatchesUtils(tmp_path, imageFile):
+    outFile = str(tmp_path / "output.bmp")
+    processTiled(imageFile, outFile, ['normalize'], 16)
+    assert np.array_equal(readBMP(outFile)[0], normalize(readBMP(imageFile)[0]))
+
+def testMissingFile(tmp_path):
+    stats, errMsg = processTiled(str(tmp_path / "missing.bmp"), "", ['grayscale'])
+    assert stats == {} and errMsg == "File not found"